@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Measures remote training against the stand-in CanDIG server, which answers from
+the same VCF and PED files as local training, with an injected latency per request.
+
+Reports the wall time, the requests sent and their throughput, and whether the
+remote tree predicts the training set as the local tree does.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from id3_variants_training.__train__ import train
+from id3_variants_training.__predict__ import predict
+from id3_variants_training.local_API import LOCAL_API
+from id3_variants_training.candig_standin import CanDIG_StandIn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', help='config file of the VCF and PED files to serve and train on')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the server waits before answering')
+    parser.add_argument('--jitter', type=float, default=0.005, help='up to this many more seconds, at random')
+    parser.add_argument('--epsilon', type=float, help='add Laplace noise of scale 1/EPSILON to every count')
+    args = parser.parse_args()
+
+    api = LOCAL_API(args.config_file)
+    with CanDIG_StandIn(api, latency=args.latency, jitter=args.jitter, epsilon=args.epsilon, seed=0) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        with open(args.config_file) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        config.setdefault('candig_server_dataset_id', 'standin')
+        remote_config = os.path.join(directory, 'config.json')
+        with open(remote_config, 'w') as f:
+            json.dump(config, f)
+
+        start = time.perf_counter()
+        remote_model = train(False, remote_config, verbose=False)
+        elapsed = time.perf_counter() - start
+
+    stats = remote_model.api.request_stats()
+    print('remote training %8.3f s %8d requests %10.0f requests/s %10.0f bytes/request' %
+          (elapsed, stats['requests'], stats['requests'] / elapsed, stats['mean_bytes']))
+
+    local_model = train(True, args.config_file, verbose=False)
+    agree = (predict(args.config_file, remote_model).conf_matrix == predict(args.config_file, local_model).conf_matrix).all()
+    print('confusion matrix on the training set matches local training: %s' % agree)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compares the size and serialization time of the count requests CanDIG_API sends
+for one node of the tree, when every request carries the component of every variant
+in the region and when it carries only the components its logic refers to.
+
+No server is needed; the API is set up for a synthetic region of variants.
+"""
+import argparse
+import json
+import time
+from id3_variants_training.candig_API import CanDIG_API
+
+
+def synthetic_api(n_variants):
+    """
+    Returns a CanDIG_API for a region of n_variants variants, without asking a server for them
+    """
+    api = CanDIG_API.__new__(CanDIG_API)
+    api.host_url = 'http://localhost:3000/'
+    api.dataset_id = 'WyJzeW50aGV0aWMiXQ'
+    api.variant_name_list = ['1:%d:%d' % (pos, pos + 1) for pos in range(100, 100 + 10 * n_variants, 10)]
+    api.prepare_requests()
+    return api
+
+
+def node_requests(api, depth):
+    """
+    The split paths of the requests for one node at a depth of the tree, one per candidate variant
+    """
+    split_path = (api.variant_name_list[:depth], [idx % 2 for idx in range(depth)])
+    return [(split_path[0] + [variant], split_path[1] + [1]) for variant in api.variant_name_list[depth:]]
+
+
+def every_component_request(api, split_path):
+    req_body = api.craft_api_request(split_path)
+    req_body['components'] = list(api.components.values())
+    return json.dumps(req_body).encode()
+
+
+def time_requests(encode, split_paths):
+    start = time.perf_counter()
+    n_bytes = sum(len(encode(split_path)) for split_path in split_paths)
+    return n_bytes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', type=int, nargs='+', default=[100, 1000, 3000], help='variants in the region')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the node in the tree')
+    args = parser.parse_args()
+
+    print('%8s %-22s %14s %14s %10s' % ('variants', 'request bodies', 'bytes/node', 'bytes/request', 'seconds'))
+    for n_variants in args.variants:
+        api = synthetic_api(n_variants)
+        split_paths = node_requests(api, args.depth)
+        runs = [
+            ('every component', lambda split_path: every_component_request(api, split_path)),
+            ('referenced, crafted', lambda split_path: json.dumps(api.craft_api_request(split_path)).encode()),
+            ('referenced, template', api.encode_api_request),
+        ]
+        for label, encode in runs:
+            n_bytes, elapsed = time_requests(encode, split_paths)
+            print('%8d %-22s %14d %14.0f %10.3f' % (n_variants, label, n_bytes, n_bytes / len(split_paths), elapsed))
+
+
+if __name__ == '__main__':
+    main()
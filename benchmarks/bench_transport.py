@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of the count traffic between CanDIG_API and the server: the client
+CPU time spent encoding count requests and decoding count responses, with the stdlib
+encoder against the fast encoder (orjson, when it is installed) and with a full
+decode against picking out only the ancestry counts; and remote training against the
+stand-in CanDIG server with and without gzip compression.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from id3_variants_training import candig_API
+from id3_variants_training.candig_API import CanDIG_API, decode_ethnicity, json_loads
+from id3_variants_training.candig_standin import CanDIG_StandIn
+from id3_variants_training.local_API import LOCAL_API
+from id3_variants_training.Profiler import Profiler
+from id3_variants_training.ID3_Class import ID3
+
+
+def synthetic_api(n_variants):
+    """
+    Returns a CanDIG_API for a region of n_variants variants, without asking a server for them
+    """
+    api = CanDIG_API.__new__(CanDIG_API)
+    api.host_url = 'http://localhost:3000/'
+    api.dataset_id = 'WyJzeW50aGV0aWMiXQ'
+    api.variant_name_list = ['1:%d:%d' % (pos, pos + 1) for pos in range(100, 100 + 10 * n_variants, 10)]
+    api.prepare_requests()
+    return api
+
+
+def count_response(n_ancestries, n_extra_fields):
+    """
+    A count response with the counts of n_ancestries ancestries, and n_extra_fields other
+    fields for a decoder to skip over
+    """
+    patient = {'ethnicity': {'ANC%d' % idx: idx + 1 for idx in range(n_ancestries)}}
+    extra = {'field%d' % idx: {'value': idx, 'label': 'field %d' % idx} for idx in range(n_extra_fields)}
+    return json.dumps({'results': {'patients': [patient], 'summary': extra}}).encode()
+
+
+def stdlib_ethnicity(body):
+    resp = json.loads(body)
+    return resp['results']['patients'][0].get('ethnicity', {})
+
+
+def fast_ethnicity(body):
+    return json_loads(body)['results']['patients'][0].get('ethnicity', {})
+
+
+def time_calls(function, arguments, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for argument in arguments:
+            function(argument)
+    return (time.perf_counter() - start) / (repeats * len(arguments))
+
+
+def bench_codecs(args):
+    api = synthetic_api(args.variants)
+    depth = args.depth
+    prefix = (api.variant_name_list[:depth], [idx % 2 for idx in range(depth)])
+    split_paths = [(prefix[0] + [variant], prefix[1] + [1]) for variant in api.variant_name_list[depth:]]
+    print('fast JSON library: %s' % ('orjson' if candig_API.orjson is not None else 'none, the stdlib is used'))
+
+    encoders = [
+        ('stdlib, crafted', lambda split_path: json.dumps(api.craft_api_request(split_path)).encode()),
+        ('template', api.encode_api_request),
+    ]
+    for label, encode in encoders:
+        print('encode %-26s %10.2f us/request' % (label, 1e6 * time_calls(encode, split_paths, args.repeats)))
+
+    for n_extra_fields in args.extra_fields:
+        responses = [count_response(args.ancestries, n_extra_fields)] * 100
+        decoders = [
+            ('stdlib, full', stdlib_ethnicity),
+            ('fast, full', fast_ethnicity),
+            ('ethnicity only', decode_ethnicity),
+        ]
+        for label, decode in decoders:
+            print('decode %-26s %10.2f us/response (%d bytes)' %
+                  (label, 1e6 * time_calls(decode, responses, args.repeats), len(responses[0])))
+
+
+def bench_training(args):
+    api = LOCAL_API(args.config_file)
+    with open(args.config_file) as f:
+        config = json.load(f)
+    config.setdefault('candig_server_dataset_id', 'standin')
+
+    for compress in (False, True):
+        with CanDIG_StandIn(api, latency=args.latency, compress=compress) as server, \
+                tempfile.TemporaryDirectory() as directory:
+            config['candig_server_url'] = server.start()
+            remote_config = os.path.join(directory, 'config.json')
+            with open(remote_config, 'w') as f:
+                json.dump(config, f)
+
+            profiler = Profiler()
+            start = time.perf_counter()
+            with CanDIG_API(remote_config, profiler=profiler, compress=compress,
+                            compress_min_bytes=args.compress_min_bytes) as remote_api:
+                ID3(remote_api, verbose=False)
+            elapsed = time.perf_counter() - start
+
+        counters = profiler.report()['counters']
+        print('training, compress=%-5s %8.3f s %8d requests %12d bytes sent %12d bytes received' %
+              (compress, elapsed, counters['requests'], counters['bytes_sent'], counters['bytes_received']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', nargs='?', help='config file of the VCF and PED files to serve and train on; '
+                        'training is not measured if not given')
+    parser.add_argument('--variants', type=int, default=1000, help='variants in the region of the synthetic requests')
+    parser.add_argument('--depth', type=int, default=10, help='depth of the node of the synthetic requests')
+    parser.add_argument('--ancestries', type=int, default=26, help='ancestries in the synthetic responses')
+    parser.add_argument('--extra-fields', type=int, nargs='+', default=[0, 100, 1000],
+                        help='other fields in the synthetic responses')
+    parser.add_argument('--repeats', type=int, default=20, help='times to repeat each measurement')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before answering')
+    parser.add_argument('--compress-min-bytes', type=int, default=1024, help='smallest request body to compress')
+    args = parser.parse_args()
+
+    bench_codecs(args)
+    if args.config_file:
+        bench_training(args)
+
+
+if __name__ == '__main__':
+    main()
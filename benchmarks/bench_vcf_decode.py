@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compares the throughput, in genotypes per second, of decoding VCF files into
+the LOCAL_API genotype matrix with PyVCF records and with the GT-only tabix path.
+
+By default a synthetic cohort is written to a temporary directory; pass a
+config file to benchmark real data instead.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy
+import pysam
+from id3_variants_training.local_API import LOCAL_API
+
+
+def write_synthetic_cohort(directory, n_samples, n_variants, n_chromosomes, seed=0):
+    """
+    Writes one tabix indexed VCF file per chromosome, a PED file and a config file
+    for a random cohort, and returns the path to the config file
+    """
+    rng = numpy.random.default_rng(seed)
+    sample_ids = ['S%d' % idx for idx in range(n_samples)]
+    populations = rng.integers(0, 5, n_samples)
+    config = {'variant_ranges': [], 'chr_paths': {}, 'user_mapping_path': os.path.join(directory, 'cohort.ped')}
+
+    with open(config['user_mapping_path'], 'w') as ped_file:
+        ped_file.write('Family ID\tIndividual ID\tPaternal ID\tMaternal ID\tGender\tPhenotype\tPopulation\n')
+        for sample_id, population in zip(sample_ids, populations):
+            ped_file.write('.\t%s\t0\t0\t1\t0\tP%d\n' % (sample_id, population))
+
+    per_chromosome = n_variants // n_chromosomes
+    for chrom in range(1, n_chromosomes + 1):
+        vcf_path = os.path.join(directory, 'chr%d.vcf' % chrom)
+        genotypes = rng.random((per_chromosome, n_samples)) < rng.beta(0.3, 1.5, (per_chromosome, 1))
+        with open(vcf_path, 'w') as vcf_file:
+            vcf_file.write('##fileformat=VCFv4.1\n')
+            vcf_file.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+            vcf_file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' + '\t'.join(sample_ids) + '\n')
+            for idx, row in enumerate(genotypes):
+                calls = '\t'.join(numpy.where(row, '0|1', '0|0'))
+                vcf_file.write('%d\t%d\t.\tG\tT\t100\tPASS\t.\tGT\t%s\n' % (chrom, idx + 1, calls))
+        pysam.tabix_compress(vcf_path, vcf_path + '.gz', force=True)
+        pysam.tabix_index(vcf_path + '.gz', preset='vcf', force=True)
+        config['chr_paths'][str(chrom)] = vcf_path + '.gz'
+        config['variant_ranges'].append({'chr': str(chrom), 'start': '0', 'end': str(per_chromosome + 1)})
+
+    config_path = os.path.join(directory, 'config.json')
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    return config_path
+
+
+def time_decoder(config_path, **kwargs):
+    start = time.perf_counter()
+    api = LOCAL_API(config_path, **kwargs)
+    elapsed = time.perf_counter() - start
+    return api, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', nargs='?', help='config file to benchmark; a synthetic cohort if omitted')
+    parser.add_argument('--samples', type=int, default=1000, help='people in the synthetic cohort')
+    parser.add_argument('--variants', type=int, default=4000, help='variants in the synthetic cohort')
+    parser.add_argument('--chromosomes', type=int, default=4, help='chromosomes to spread the variants over')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='variant ranges to decode concurrently')
+    parser.add_argument('--skip-pyvcf', action='store_true', help='only benchmark the tabix decoder')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = args.config_file or write_synthetic_cohort(directory, args.samples, args.variants, args.chromosomes)
+
+        runs = []
+        if not args.skip_pyvcf:
+            runs.append(('pyvcf', dict(decoder='pyvcf')))
+        runs.append(('tabix, 1 worker', dict(decoder='tabix', decode_workers=1)))
+        runs.append(('tabix, %d workers' % args.workers, dict(decoder='tabix', decode_workers=args.workers)))
+
+        reference = None
+        for label, kwargs in runs:
+            api, elapsed = time_decoder(config_path, **kwargs)
+            if reference is None:
+                reference = api.genotype_matrix
+            assert (api.genotype_matrix == reference).all(), 'decoders disagree'
+            n_genotypes = api.genotype_matrix.size
+            print('%-20s %10d genotypes %8.3f s %14.0f genotypes/s' % (label, n_genotypes, elapsed, n_genotypes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,10 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'train-id3=id3_variants_training.__train__:train_main',
-            'predict-id3=id3_variants_training.__predict__:predict_main'
+            'predict-id3=id3_variants_training.__predict__:predict_main',
+            'convert-id3-model=id3_variants_training.__convert__:convert_main',
+            'serve-id3=id3_variants_training.__serve__:serve_main',
+            'candig-standin=id3_variants_training.candig_standin:standin_main'
         ],
     },
 )
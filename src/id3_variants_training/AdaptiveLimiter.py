@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, initial_limit=16, min_limit=1, max_limit=100, backoff=0.5, error_tolerance=0.2,
+                 latency_tolerance=2.0, min_window=20):
+        """
+        Limits the number of requests in flight, adapting the limit to the server a window
+        of requests at a time, a window being as many requests as the limit: the limit grows
+        by one after a window in which the latency stayed healthy, and shrinks multiplicatively
+        after a window in which the server was overloaded (AIMD)
+
+        Args:
+            initial_limit (int): the limit to start at
+            min_limit (int): the lowest the limit can shrink to
+            max_limit (int): the highest the limit can grow to
+            backoff (float): the factor the limit is multiplied by when the server is overloaded
+            error_tolerance (float): the server is overloaded when more than this fraction of the
+                                     requests of a window were refused or timed out
+            latency_tolerance (float): the latency of a window is healthy when its mean is at most
+                                       this many times the lowest mean of a window seen
+            min_window (int): the fewest requests in a window, so that a few unlucky requests
+                              do not shrink a small limit
+
+        Attributes:
+            limit (float): the current limit; int(limit) requests may be in flight
+            in_flight (int): the number of requests in flight
+            min_latency (float): the lowest mean latency of a window seen, in seconds
+            window (dict): the number of requests done, refused and answered in this window,
+                           and the sum of the latencies of those answered
+            condition (asyncio.Condition): wakes the requests waiting for the limit, created on first use
+        """
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.error_tolerance = error_tolerance
+        self.latency_tolerance = latency_tolerance
+        self.min_window = min_window
+        self.in_flight = 0
+        self.min_latency = None
+        self.window = {'done': 0, 'overloaded': 0, 'answered': 0, 'latency': 0.0}
+        self.condition = None
+
+    def __getstate__(self):
+        # the condition belongs to an event loop; it is recreated on first use
+        state = self.__dict__.copy()
+        state['condition'] = None
+        return state
+
+    async def acquire(self):
+        """
+        Waits until another request may be sent
+
+        Returns:
+            started (float): when the request was let through, to pass on to release
+        """
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, succeeded=False, overloaded=False):
+        """
+        Marks a request as done, adapting the limit to how it went. A request which failed
+        for another reason, or was cancelled, leaves the limit as it is.
+
+        Args:
+            started (float): when the request was let through, as returned by acquire
+            succeeded (bool): whether the server answered the request
+            overloaded (bool): whether the server was overloaded, by its answer or by timing out
+        """
+        async with self.condition:
+            self.in_flight -= 1
+            if succeeded or overloaded:
+                self.record(time.monotonic() - started, overloaded)
+            self.condition.notify_all()
+
+    def record(self, latency, overloaded):
+        """
+        Counts a request towards the window, and adapts the limit once the window is full
+        """
+        self.window['done'] += 1
+        if overloaded:
+            self.window['overloaded'] += 1
+        else:
+            self.window['answered'] += 1
+            self.window['latency'] += latency
+
+        done = self.window['done']
+        if done < max(int(self.limit), self.min_window):
+            return
+
+        if self.window['overloaded'] > self.error_tolerance * done:
+            self.limit = max(self.limit * self.backoff, self.min_limit)
+        elif self.window['answered']:
+            mean_latency = self.window['latency'] / self.window['answered']
+            if self.min_latency is None or mean_latency < self.min_latency:
+                self.min_latency = mean_latency
+            if mean_latency <= self.min_latency * self.latency_tolerance:
+                self.limit = min(self.limit + 1, self.max_limit)
+        self.window = {'done': 0, 'overloaded': 0, 'answered': 0, 'latency': 0.0}
@@ -0,0 +1,275 @@
+import struct
+import zipfile
+import numpy
+
+# identifies a model file holding a compiled tree
+MODEL_FORMAT = 'id3-compiled-tree'
+# bump whenever the arrays of a model file change
+MODEL_FORMAT_VERSION = 1
+
+
+def load_arrays(file, mmap=False):
+    """
+    Loads the arrays of an .npz file, memory-mapping them read-only if asked to
+
+    Args:
+        file (str | file): the .npz file; a path if the arrays are memory-mapped
+        mmap (bool): whether to memory-map the arrays, which must be stored uncompressed
+
+    Returns:
+        arrays (dict): the arrays, by name
+    """
+    if not mmap:
+        with numpy.load(file, allow_pickle=False) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    arrays = {}
+    with zipfile.ZipFile(file) as archive, open(file, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('%s is compressed, and can not be memory-mapped' % info.filename)
+            # the array starts after the local header of the member and the header of the .npy file
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = numpy.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(f)
+
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if numpy.prod(shape) == 0:
+                # an empty array can not be mapped
+                arrays[name] = numpy.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = numpy.memmap(file, dtype=dtype, mode='r', shape=shape, offset=f.tell(),
+                                            order='F' if fortran_order else 'C')
+    return arrays
+
+
+def check_format(arrays, model_format, model_format_version, file):
+    """
+    Checks that the arrays of a model file are of a model format, and of a version which can be read
+
+    Raises:
+        ValueError: if the file is not of the model format, or is of a newer version
+    """
+    if 'format' not in arrays or str(arrays['format']) != model_format:
+        raise ValueError('%s is not an %s file' % (getattr(file, 'name', file), model_format))
+    if int(arrays['format_version']) > model_format_version:
+        raise ValueError('%s is of model format version %d, newer than version %d which can be read'
+                         % (getattr(file, 'name', file), int(arrays['format_version']), model_format_version))
+
+
+def variant_features(genotype_matrix, variant_name_list, variant_names):
+    """
+    Selects the columns of some variants from a genotype matrix. A variant that is missing
+    from the genotypes is treated as not existing in anyone, and a variant that names
+    several columns exists in a person if any of them do.
+
+    Args:
+        genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+        variant_name_list (list): the names of the columns of the genotype matrix
+        variant_names (list): the names of the variants to select
+
+    Returns:
+        features (numpy.ndarray): A (people x variant_names) boolean matrix
+    """
+    columns = {}
+    for idx, variant_name in enumerate(variant_name_list):
+        columns.setdefault(variant_name, []).append(idx)
+
+    genotype_matrix = numpy.asarray(genotype_matrix)
+    features = numpy.zeros((len(genotype_matrix), len(variant_names)), dtype=bool)
+    for idx, variant_name in enumerate(variant_names):
+        if variant_name in columns:
+            features[:, idx] = (genotype_matrix[:, columns[variant_name]] == 1).any(axis=1)
+    return features
+
+
+class CompiledTree:
+
+    def __init__(self, root_node):
+        """
+        Flattens a trained tree into parallel arrays, so that a whole cohort can be
+        routed through the tree with array operations. Nodes are numbered breadth
+        first, the root being node 0.
+
+        Args:
+            root_node (ID3_Node): the root node of a trained tree
+
+        Attributes:
+            variant_names (list): the names of the variants the tree splits on
+            ancestry_list (list): the ancestries which leaf labels are indices into
+            feature (numpy.ndarray): per node, the index into variant_names of the variant
+                                     the node splits on, or -1 for a leaf node
+            with_child (numpy.ndarray): per node, the child with the variant, or -1
+            without_child (numpy.ndarray): per node, the child without the variant, or -1
+            label (numpy.ndarray): per node, the index into ancestry_list of its most common ancestry
+            counts (numpy.ndarray): A (nodes x ancestry_list) matrix of the people of each
+                                    ancestry in each node when the tree was trained
+            depth (int): the number of splits on the longest path from the root
+        """
+        nodes = list(root_node.iter_nodes())
+        node_index = {id(node): idx for idx, node in enumerate(nodes)}
+
+        self.variant_names = []
+        self.ancestry_list = list(root_node.subset.keys())
+        variant_index = {}
+        ancestry_index = {ancestry: idx for idx, ancestry in enumerate(self.ancestry_list)}
+
+        self.feature = numpy.full(len(nodes), -1, dtype=numpy.int32)
+        self.with_child = numpy.full(len(nodes), -1, dtype=numpy.int32)
+        self.without_child = numpy.full(len(nodes), -1, dtype=numpy.int32)
+        self.label = numpy.zeros(len(nodes), dtype=numpy.int32)
+        self.depth = 0
+        node_depth = [0] * len(nodes)
+        node_counts = []
+
+        for idx, node in enumerate(nodes):
+            if node.most_common_ancestry not in ancestry_index:
+                ancestry_index[node.most_common_ancestry] = len(self.ancestry_list)
+                self.ancestry_list.append(node.most_common_ancestry)
+            self.label[idx] = ancestry_index[node.most_common_ancestry]
+            self.depth = max(self.depth, node_depth[idx])
+            node_counts.append(node.subset)
+
+            for child_node in node.children:
+                node_depth[node_index[id(child_node)]] = node_depth[idx] + 1
+                if child_node.variant_name not in variant_index:
+                    variant_index[child_node.variant_name] = len(self.variant_names)
+                    self.variant_names.append(child_node.variant_name)
+                self.feature[idx] = variant_index[child_node.variant_name]
+                if child_node.with_variant:
+                    self.with_child[idx] = node_index[id(child_node)]
+                else:
+                    self.without_child[idx] = node_index[id(child_node)]
+
+        self.counts = numpy.zeros((len(nodes), len(self.ancestry_list)), dtype=numpy.int64)
+        for idx, subset in enumerate(node_counts):
+            for ancestry, count in subset.items():
+                self.counts[idx, ancestry_index[ancestry]] = int(count)
+
+    def compile(self):
+        """
+        The tree is already compiled, so that it can be used wherever a trained ID3 can be
+
+        Returns:
+            compiled_tree (CompiledTree): this tree
+        """
+        return self
+
+    def save(self, file):
+        """
+        Writes the arrays of the tree to a model file, which holds nothing else of the trained
+        ID3, and can be read back with load
+
+        Args:
+            file (str | file): the path or the file to write the model to
+        """
+        numpy.savez(file, format=numpy.array(MODEL_FORMAT), format_version=numpy.array(MODEL_FORMAT_VERSION),
+                    **self.arrays())
+
+    def arrays(self):
+        """
+        Returns:
+            arrays (dict): the arrays of the tree, by name, as read back by from_arrays
+        """
+        return {
+            'variant_names': numpy.array(self.variant_names, dtype=str),
+            'ancestry_list': numpy.array(self.ancestry_list, dtype=str),
+            'feature': self.feature,
+            'with_child': self.with_child,
+            'without_child': self.without_child,
+            'label': self.label,
+            'counts': self.counts,
+            'depth': numpy.array(self.depth),
+        }
+
+    @classmethod
+    def load(cls, file, mmap=False):
+        """
+        Reads a tree from a model file written by save
+
+        Args:
+            file (str | file): the path or the file to read the model from
+            mmap (bool): whether to memory-map the arrays of the tree rather than reading them;
+                         file must be a path
+
+        Returns:
+            compiled_tree (CompiledTree): the tree
+
+        Raises:
+            ValueError: if the file is not a model file, or is of a newer version
+        """
+        arrays = load_arrays(file, mmap)
+        check_format(arrays, MODEL_FORMAT, MODEL_FORMAT_VERSION, file)
+        return cls.from_arrays(arrays)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Creates a tree from its arrays, as from the arrays method
+        """
+        compiled_tree = cls.__new__(cls)
+        compiled_tree.variant_names = arrays['variant_names'].tolist()
+        compiled_tree.ancestry_list = arrays['ancestry_list'].tolist()
+        compiled_tree.feature = arrays['feature']
+        compiled_tree.with_child = arrays['with_child']
+        compiled_tree.without_child = arrays['without_child']
+        compiled_tree.label = arrays['label']
+        compiled_tree.counts = arrays['counts']
+        compiled_tree.depth = int(arrays['depth'])
+        return compiled_tree
+
+    def feature_matrix(self, genotype_matrix, variant_name_list):
+        """
+        Selects the columns of the variants the tree splits on from a genotype matrix,
+        as variant_features does
+
+        Args:
+            genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+            variant_name_list (list): the names of the columns of the genotype matrix
+
+        Returns:
+            features (numpy.ndarray): A (people x variant_names) boolean matrix
+        """
+        return variant_features(genotype_matrix, variant_name_list, self.variant_names)
+
+    def predict_nodes(self, features):
+        """
+        Routes every person through the tree, a level at a time
+
+        Args:
+            features (numpy.ndarray): A (people x variant_names) boolean matrix, as from feature_matrix
+
+        Returns:
+            nodes (numpy.ndarray): the index of the node each person ends up in
+        """
+        people = numpy.arange(len(features))
+        nodes = numpy.zeros(len(features), dtype=numpy.int32)
+        for _ in range(self.depth):
+            feature = self.feature[nodes]
+            splitting = feature >= 0
+            if not splitting.any():
+                break
+            has_variant = features[people, numpy.where(splitting, feature, 0)]
+            next_nodes = numpy.where(has_variant, self.with_child[nodes], self.without_child[nodes])
+            # a person stays at a node which has no child on their side of the split
+            nodes = numpy.where(splitting & (next_nodes >= 0), next_nodes, nodes)
+        return nodes
+
+    def predict_batch(self, genotype_matrix, variant_name_list):
+        """
+        Predicts the ancestry of every person in a genotype matrix
+
+        Args:
+            genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+            variant_name_list (list): the names of the columns of the genotype matrix
+
+        Returns:
+            labels (numpy.ndarray): the index into ancestry_list of each person's predicted ancestry
+        """
+        features = self.feature_matrix(genotype_matrix, variant_name_list)
+        return self.label[self.predict_nodes(features)]
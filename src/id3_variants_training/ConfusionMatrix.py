@@ -14,13 +14,13 @@ class ConfusionMatrix:
         predicted is X axis
 
         Args:
-            id3_tree (ID3):
+            id3_tree (ID3 | CompiledTree | ID3_Ensemble):
 
         Attributes:
-            id3_tree (ID3):
+            id3_tree (ID3 | CompiledTree | ID3_Ensemble):
             api (LOCAL_API): API object that is used to interact with the virtual API
             length (int): length of all the ancestries
-            conf_matrix (list): the confusion matrix based on the ID3 classifier
+            conf_matrix (numpy.ndarray): the confusion matrix based on the ID3 classifier
             diagonal_sum (int): sum of the diagonals within the matrix
             total (int): total sum of all values in matrix
         """
@@ -29,21 +29,38 @@ class ConfusionMatrix:
 
         # create conf_matrix and calculate useful attributes
         self.length = len(self.api.ancestry_list)
-        self.conf_matrix = numpy.zeros((self.length, self.length), dtype=numpy.int)
 
-        for variants, popu in zip(self.api.variant_list, self.api.popu_list):
-            include_variants = [self.api.variant_name_list[idx] for idx, is_variant in enumerate(variants) if is_variant == 1]
+        # Actual Result
+        y = numpy.asarray(self.api.popu_idx, dtype=numpy.intp)
+        # Predicted Result
+        x = self.predicted_indices()
 
-            # Actual Result
-            y = self.api.ancestry_list.index(popu)
-            # Predicted Result
-            x = self.api.ancestry_list.index(self.id3_tree.predict(include_variants).most_common_ancestry)
-
-            self.conf_matrix[y,x] += 1
+        cells = numpy.bincount(y * self.length + x, minlength=self.length * self.length)
+        self.conf_matrix = cells.reshape((self.length, self.length))
 
         self.diagonal_sum = self.conf_matrix.diagonal().sum()
         self.total = self.conf_matrix.sum()
 
+    def predicted_indices(self):
+        """
+        Predicts every person in the api at once with the compiled tree
+
+        Returns:
+            (numpy.ndarray): the predicted ancestry of each person, coded as an index into
+                             the ancestry_list of the api
+        """
+        compiled_tree = self.id3_tree.compile()
+        labels = compiled_tree.predict_batch(self.api.genotype_matrix, self.api.variant_name_list)
+
+        ancestry_index = {ancestry: idx for idx, ancestry in enumerate(self.api.ancestry_list)}
+        label_map = numpy.array([ancestry_index.get(ancestry, -1) for ancestry in compiled_tree.ancestry_list],
+                                dtype=numpy.intp)
+        predicted = label_map[labels]
+        if (predicted < 0).any():
+            missing = compiled_tree.ancestry_list[labels[numpy.argmin(predicted)]]
+            raise ValueError("'%s' is not in the ancestry list" % missing)
+        return predicted
+
     def get_accuracy(self):
         """
         How often the classifier is correct
@@ -62,6 +79,37 @@ class ConfusionMatrix:
         """
         return 1 - self.get_accuracy()
 
+    def get_hit_rates(self):
+        """
+        For every ancestry, how often does it predict the correct ancestry
+
+        Returns:
+            (numpy.ndarray): a number between 0 and 1 per ancestry in ancestry_list,
+                             nan for an ancestry which is not in the sample
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self.conf_matrix.diagonal() / self.conf_matrix.sum(axis=1)
+
+    def get_precisions(self):
+        """
+        For every ancestry, how often is the prediction correct
+
+        Returns:
+            (numpy.ndarray): a number between 0 and 1 per ancestry in ancestry_list,
+                             nan for an ancestry which is never predicted
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self.conf_matrix.diagonal() / self.conf_matrix.sum(axis=0)
+
+    def get_prevalences(self):
+        """
+        How often does each ancestry appear in the sample relative to the sum of all ancestries
+
+        Returns:
+            (numpy.ndarray): a number between 0 and 1 per ancestry in ancestry_list
+        """
+        return self.conf_matrix.sum(axis=1) / self.total
+
     def get_hit_rate(self, ancestry):
         """
         For a particular ancestry, how often does it predict the correct ancestry
@@ -76,11 +124,7 @@ class ConfusionMatrix:
             print("Not a valid ancestry")
             return None
 
-        popu_i = self.api.ancestry_list.index(ancestry)
-        true_anc = self.conf_matrix[popu_i][popu_i]
-        sum_actual_anc = sum(self.conf_matrix[popu_i])
-
-        return true_anc / sum_actual_anc
+        return self.get_hit_rates()[self.api.ancestry_list.index(ancestry)]
 
     def get_miss_rate(self, ancestry):
         """
@@ -112,11 +156,7 @@ class ConfusionMatrix:
             print("Not a valid ancestry")
             return None
 
-        popu_i = self.api.ancestry_list.index(ancestry)
-        true_anc = self.conf_matrix[popu_i][popu_i]
-        sum_pred_anc = sum([self.conf_matrix[i][popu_i] for i in range(self.length)])
-
-        return true_anc / sum_pred_anc
+        return self.get_precisions()[self.api.ancestry_list.index(ancestry)]
 
     def get_prevalence(self, ancestry):
         """
@@ -132,10 +172,7 @@ class ConfusionMatrix:
             print("Not a valid ancestry")
             return None
 
-        popu_i = self.api.ancestry_list.index(ancestry)
-        sum_actual_anc = sum(self.conf_matrix[popu_i])
-
-        return sum_actual_anc / self.total
+        return self.get_prevalences()[self.api.ancestry_list.index(ancestry)]
 
     def __str__(self):
         return '\n'.join([str(self.conf_matrix[i]) for i in range(len(self.conf_matrix))])
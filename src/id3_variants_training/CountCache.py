@@ -0,0 +1,130 @@
+import json
+import sqlite3
+from collections import OrderedDict
+
+
+class CountCache:
+
+    def __init__(self, max_entries=100000, path=None, flush_every=1000):
+        """
+        Caches the ancestry counts of split paths, so that the server is asked for the
+        counts of a set of constraints only once however the split path orders them.
+        Recently used counts are kept in memory, and every count is kept in an sqlite
+        file if a path is given, so that it outlives the training run.
+
+        Args:
+            max_entries (int): the most counts to keep in memory
+            path (str): path to an sqlite file to persist counts in, or None to keep them in memory only
+            flush_every (int): the number of new counts to write to the sqlite file at once
+
+        Attributes:
+            entries (OrderedDict): the counts kept in memory, least recently used first
+            pending (list): new counts not yet written to the sqlite file
+            connection (sqlite3.Connection): connection to the sqlite file, opened on first use
+            hits (int): number of lookups answered by the cache
+            misses (int): number of lookups the server had to answer
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.flush_every = flush_every
+        self.entries = OrderedDict()
+        self.pending = []
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # cached counts belong to a training run rather than to the pickled model
+        state = self.__dict__.copy()
+        state['entries'] = OrderedDict()
+        state['pending'] = []
+        state['connection'] = None
+        return state
+
+    @staticmethod
+    def make_key(host_url, dataset_id, split_path):
+        """
+        Creates a key for a split path which does not depend on the order of its splits
+
+        Args:
+            host_url (str): url pointing to candig_server
+            dataset_id (str): dataset id of the candig_server the counts are from
+            split_path (list1, list2): the variant names and directions of the splits
+
+        Returns:
+            key (str): the canonical form of the split path
+        """
+        constraints = sorted(set(zip(split_path[0], (int(direction) for direction in split_path[1]))))
+        return json.dumps([host_url, dataset_id, constraints], separators=(',', ':'))
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS counts (key TEXT PRIMARY KEY, counts TEXT)')
+        return self.connection
+
+    def get(self, key):
+        """
+        Looks up the counts of a key, counting the lookup as a hit or a miss
+
+        Returns:
+            counts (dict): a copy of the ancestry counts, or None if they are not cached
+        """
+        counts = self.entries.get(key)
+        if counts is not None:
+            self.entries.move_to_end(key)
+        elif self.path is not None:
+            row = self.connect().execute('SELECT counts FROM counts WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                counts = json.loads(row[0])
+                self.remember(key, counts)
+
+        if counts is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(counts)
+
+    def put(self, key, counts):
+        """
+        Caches the ancestry counts of a key
+        """
+        counts = dict(counts)
+        self.remember(key, counts)
+        if self.path is not None:
+            self.pending.append((key, json.dumps(counts)))
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def remember(self, key, counts):
+        self.entries[key] = counts
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        """
+        Writes the new counts to the sqlite file
+        """
+        if self.pending:
+            with self.connect() as connection:
+                connection.executemany('INSERT OR REPLACE INTO counts VALUES (?, ?)', self.pending)
+            self.pending = []
+
+    def close(self):
+        """
+        Writes the new counts to the sqlite file and closes it. The cache can still be
+        used afterwards, reopening the file on first use.
+        """
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stats(self):
+        """
+        Returns:
+            (dict): the number of hits and misses and the hit rate of the cache
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -1,29 +1,92 @@
+import tempfile
 import numpy
+from concurrent.futures import ProcessPoolExecutor
 from anytree.exporter import DotExporter
 from .ID3_Node import ID3_Node
+from .CompiledTree import CompiledTree
+from .Profiler import Profiler
+
+
+# a split must gain more information than this for a node to be split
+MIN_INFO_GAIN = 0.1
+
+# allows for rounding when comparing an upper bound on a gain with a gain
+BOUND_SLACK = 1e-9
+
+# the API of a subtree worker process, attached to the shared genotypes once per process
+_subtree_api = None
+
+
+def _init_subtree_worker(api_class, shared_genotypes):
+    global _subtree_api
+    _subtree_api = api_class.from_shared_genotypes(shared_genotypes)
+
+
+def _build_subtree(root_node, samples, variant_counts, upper_variant_counts, prune=False, variants=None):
+    # each subtree is profiled on its own, to be merged into the profile of the whole tree
+    _subtree_api.profiler = Profiler()
+    # the build slots of the root are not pickled with it
+    root_node.samples = samples
+    root_node.variant_counts = variant_counts
+    root_node.upper_variant_counts = upper_variant_counts
+    tree = ID3(_subtree_api, verbose=False, root_node=root_node, prune=prune, variants=variants)
+    return tree.root_node, tree.prune_stats, tree.profiler
 
 
 class ID3:
 
-    def __init__(self, api, verbose=True):
+    def __init__(self, api, verbose=True, workers=1, parallel_depth=3, root_node=None, prune=False, variants=None):
         """
         Initializes the ID3 class
 
         Args:
             api (LOCAL_API | CanDIG_API): API object that is used to interact with the virtual API
+            workers (int): number of processes to build subtrees in; requires an API that
+                can share its genotypes with other processes (LOCAL_API)
+            parallel_depth (int): depth below which subtrees are built in the worker processes
+            root_node (ID3_Node): if given, builds the tree under this node rather than
+                under a new root node for the target set
+            prune (bool): if True, the counts of a candidate variant are only fetched for a node
+                when an upper bound on its information gain, from the counts of the node's
+                parent, shows it could be chosen to split on
+            variants (numpy.ndarray): the sorted indices of the variants the tree may split on,
+                such as a random subset for a tree of an ensemble; every variant if None
 
         Attributes:
             api (LOCAL_API | CanDIG_API): API object that is used to interact with the virtual API
             root_node (Node): Creates the root node of the tree to be added upon
+            prune_stats (dict): per depth, the candidate variant counts fetched and those that
+                would have been fetched without pruning
+            excluded (numpy.ndarray): whether each variant is left out of the variants the
+                tree may split on, or None if none are
+            profiler (Profiler): the profiler of the API, which also records the time spent
+                choosing splits and the nodes built
+            subtrees (list): the nodes whose subtrees are being built in worker processes,
+                each with the future of its subtree
 
         TODO:
             * Add logging so user can know if the classifier is working
         """
         self.api = api
-        subset = self.api.get_target_set()
-        self.root_node = ID3_Node('root', subset, True)
+        self.workers = workers
+        self.parallel_depth = parallel_depth
+        self.prune = prune
+        self.prune_stats = {}
+        self.variants = variants
+        self.excluded = None
+        if variants is not None:
+            self.excluded = numpy.ones(len(api.variant_name_list), dtype=bool)
+            self.excluded[variants] = False
+        self.profiler = api.profiler
+        self.subtrees = []
+        if root_node is None:
+            subset = self.api.get_target_set()
+            root_node = ID3_Node('root', self.subset_counts(subset), True, ancestries=self.api.ancestry_list,
+                                 samples=self.api.get_target_samples())
+        self.root_node = root_node
         self.verbose = verbose
-        self.ID3(self.root_node, self.verbose)
+        with self.profiler.stage('build_tree'):
+            self.ID3(self.root_node, self.verbose)
         if verbose:
             print("")
 
@@ -60,6 +123,110 @@ class ID3:
             
         return entropy
 
+    @staticmethod
+    def entropy_by_counts(counts):
+        """
+        Gets the entropy of every row of a matrix of counts
+
+        Args:
+            counts (numpy.ndarray): A (rows x ancestries) matrix of counts
+
+        Returns:
+            entropy (numpy.ndarray): the entropy value of each row, as computed by entropy_by_count
+        """
+        counts = numpy.asarray(counts, dtype=float)
+        totals = counts.sum(axis=1, keepdims=True)
+        positive = counts > 0
+        proportion = numpy.divide(counts, totals, out=numpy.ones_like(counts), where=positive)
+        return -numpy.sum(numpy.where(positive, proportion * numpy.log2(proportion), 0.), axis=1)
+
+    @staticmethod
+    def split_gains(w_var_counts, subset_counts):
+        """
+        Computes the information gain of splitting a subset on every candidate variant at once.
+
+        The counts on each side of the split are capped as in calc_other_split_variant_counts,
+        since counts that include differentially private noise could exceed the subset.
+
+        Args:
+            w_var_counts (numpy.ndarray): A (variants x ancestries) matrix of counts with each variant
+            subset_counts (numpy.ndarray): The counts of each ancestry in the subset being split
+
+        Returns:
+            w_var_counts (numpy.ndarray): The capped counts with each variant
+            wo_var_counts (numpy.ndarray): The counts without each variant
+            w_fraction (numpy.ndarray): The fraction of the subset with each variant
+            wo_fraction (numpy.ndarray): The fraction of the subset without each variant
+            info_gain (numpy.ndarray): The information gain of each variant; 0 where the
+                split would leave one side empty
+        """
+        subset_counts = numpy.asarray(subset_counts)
+        w_var_counts = numpy.maximum(numpy.minimum(w_var_counts, subset_counts), 0)
+        wo_var_counts = subset_counts - w_var_counts
+        total_count = subset_counts.sum()
+        w_fraction = w_var_counts.sum(axis=1) / total_count
+        wo_fraction = wo_var_counts.sum(axis=1) / total_count
+
+        subset_entropy = ID3.entropy_by_counts(subset_counts[numpy.newaxis])[0]
+        info_gain = subset_entropy - (wo_fraction * ID3.entropy_by_counts(wo_var_counts) +
+                                      w_fraction * ID3.entropy_by_counts(w_var_counts))
+        info_gain[(w_fraction == 0.) | (wo_fraction == 0.)] = 0.
+
+        return w_var_counts, wo_var_counts, w_fraction, wo_fraction, info_gain
+
+    @staticmethod
+    def binary_entropy(fraction):
+        """
+        Gets the entropy of splitting a subset into two, for every fraction on one side
+        """
+        fraction = numpy.asarray(fraction, dtype=float)
+        entropy = numpy.zeros_like(fraction)
+        inner = (fraction > 0.) & (fraction < 1.)
+        p = fraction[inner]
+        entropy[inner] = -(p * numpy.log2(p) + (1 - p) * numpy.log2(1 - p))
+        return entropy
+
+    @staticmethod
+    def child_count_bounds(lower, upper, node_counts, child_counts):
+        """
+        Bounds the candidate variant counts of a child from those of its parent. Of the people
+        of an ancestry with a variant in the parent, at most all and at least all but those
+        the child does not have are in the child.
+
+        Args:
+            lower (numpy.ndarray): A (variants x ancestries) matrix of lower bounds on the parent's counts
+            upper (numpy.ndarray): A (variants x ancestries) matrix of upper bounds on the parent's counts
+            node_counts (numpy.ndarray): The counts of each ancestry in the parent
+            child_counts (numpy.ndarray): The counts of each ancestry in the child
+
+        Returns:
+            lower (numpy.ndarray): the lower bounds on the child's counts
+            upper (numpy.ndarray): the upper bounds on the child's counts
+        """
+        return (numpy.maximum(lower - (node_counts - child_counts), 0),
+                numpy.minimum(upper, child_counts))
+
+    @staticmethod
+    def gain_upper_bounds(lower, upper, subset_counts):
+        """
+        Bounds the information gain of splitting a subset on every candidate variant, given
+        bounds on their counts. The gain can exceed neither the entropy of the subset nor the
+        entropy of the split itself, which is at most that of the most even split the bounds allow.
+
+        Args:
+            lower (numpy.ndarray): A (variants x ancestries) matrix of lower bounds on the counts
+            upper (numpy.ndarray): A (variants x ancestries) matrix of upper bounds on the counts
+            subset_counts (numpy.ndarray): The counts of each ancestry in the subset being split
+
+        Returns:
+            bounds (numpy.ndarray): an upper bound on the information gain of each variant
+        """
+        subset_counts = numpy.asarray(subset_counts)
+        total_count = subset_counts.sum()
+        most_even = numpy.minimum(numpy.maximum(0.5, lower.sum(axis=1) / total_count), upper.sum(axis=1) / total_count)
+        subset_entropy = ID3.entropy_by_counts(subset_counts[numpy.newaxis])[0]
+        return numpy.minimum(subset_entropy, ID3.binary_entropy(most_even))
+
     def predict(self, include_variants):
         """
         Traverses the tree and finds the leaf node corresponding to the list of included variants
@@ -91,18 +258,37 @@ class ID3:
         return node
 
 
-    def is_leaf_node(self, subset, split_path, split_index):
+    def compile(self):
         """
-        Checks if the node is a leaf node given a subset
+        Flattens the tree into arrays for batch prediction
+
+        Returns:
+            compiled_tree (CompiledTree): the tree as parallel arrays of nodes
+        """
+        return CompiledTree(self.root_node)
+
+    def predict_batch(self, genotype_matrix, variant_name_list):
+        """
+        Predicts the ancestry of every person in a genotype matrix at once
 
         Args:
-            subset (dict): A dictionary containing keys of ancestries and values of the counts for the particular ancestry
-            split_path (list1, list2): 
-                This is the paths of the splits before the current split. The first list
-                is the list of variant names and the second list is the direction
-                of the split. The direction of the second list is depicted by 1's
-                and 0's. Where 1 is splitting in the direction with the variant
-                and 0 is splitting in the direction without the variant. 
+            genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+            variant_name_list (list): the names of the columns of the genotype matrix
+
+        Returns:
+            predictions (list): the predicted ancestry of each person, the most common
+                ancestry of the leaf node they end up in as with predict
+        """
+        compiled_tree = self.compile()
+        labels = compiled_tree.predict_batch(genotype_matrix, variant_name_list)
+        return [compiled_tree.ancestry_list[label] for label in labels.tolist()]
+
+    def is_leaf_node(self, node, split_index):
+        """
+        Checks if the node is a leaf node given its counts and depth
+
+        Args:
+            node (ID3_Node): the node
             split_index (int): the index for the next split to be split on
 
         Returns:
@@ -115,16 +301,212 @@ class ID3:
 
         """
         # check if all variants are of one ancestry (Essentially if all remaining variants(attributes) contains one region(value))
-        attr_list = set()
-        upd_var_count = { k : v for k, v in subset.items() if v != 0 }
-        attr_list.update(upd_var_count.keys())
-        if len(attr_list) == 1 or len(split_path[0]) >= len(self.api.variant_name_list) or split_index is None or ID3.entropy_by_count(subset) == 0:
-        #if len(attr_list) == 1 or len(split_path[0]) >= 5 or split_index is None or ID3.entropy_by_count(subset) == 0:
+        n_ancestries = numpy.count_nonzero(node.counts)
+        if n_ancestries == 1 or node.depth >= self.n_variants() or split_index is None or ID3.entropy_by_counts(node.counts[numpy.newaxis])[0] == 0:
+        #if n_ancestries == 1 or node.depth >= 5 or split_index is None or ID3.entropy_by_counts(node.counts[numpy.newaxis])[0] == 0:
             return True
         return False
 
+    def n_variants(self):
+        """
+        The number of variants the tree may split on
+        """
+        return len(self.api.variant_name_list) if self.variants is None else len(self.variants)
+
+    def can_split(self, node):
+        """
+        Checks, before any counts are fetched for it, whether a node could be split at all
+
+        Args:
+            node (ID3_Node): the node
+
+        Returns:
+            (bool): False if the node is a leaf node whichever variant is found to split on
+        """
+        return node.counts.sum() > 1 and not self.is_leaf_node(node, split_index=0)
+
+    def split_subset_by_counts(self, node, split_index):
+        """
+        Splits the subset of a node on a variant, using the counts of the candidate
+        variants already fetched for the node rather than querying the API again
+
+        Args:
+            node (ID3_Node): the node being split, with its candidate variant counts
+            split_index (int): the index of the variant to split on
+
+        Returns:
+            w_counts (numpy.ndarray): The counts of each ancestry with the variant, capped as in
+                                      calc_other_split_variant_counts
+            wo_counts (numpy.ndarray): The counts of each ancestry without the variant
+        """
+        w_counts = numpy.maximum(numpy.minimum(node.variant_counts[split_index], node.counts), 0)
+        return w_counts, node.counts - w_counts
+
+    async def find_children_variant_counts(self, splits):
+        """
+        Fetches the candidate variant counts of the children of split nodes, for a whole
+        level of nodes at once. Since the counts of the children sum to the counts of the
+        parent, only the smaller child is fetched from the API and the other child's counts
+        are derived by subtraction, capped at zero in case the counts include differentially
+        private noise.
+
+        Args:
+            splits (list): pairs of a node that was split, with its candidate variant
+                counts, and its new child nodes
+        """
+        derivations = []
+        fetched = []
+        for node, children in splits:
+            searched = [child for child in children if self.can_split(child)]
+            if not searched:
+                continue
+            smaller = min(children, key=lambda child: child.counts.sum())
+            fetched.append(smaller)
+            derivations.extend((child, node, smaller) for child in searched if child is not smaller)
+
+        for child in fetched:
+            self.count_fetches(child.split_path)
+        fetched_counts = await self.api.async_find_next_variant_count_matrices([child.split_path for child in fetched],
+                                                                               [child.samples for child in fetched],
+                                                                               [self.variants] * len(fetched))
+        for child, variant_counts in zip(fetched, fetched_counts):
+            child.variant_counts = variant_counts
+        for child, node, smaller in derivations:
+            child.variant_counts = numpy.maximum(node.variant_counts - smaller.variant_counts, 0)
+
+    async def find_pruned_children_variant_counts(self, splits):
+        """
+        Fetches the candidate variant counts of the children of split nodes, as
+        find_children_variant_counts does, but only of the candidates that could be chosen
+        to split a child on. The counts of each child are bounded by those of its parent;
+        a candidate is fetched only if its counts are not already pinned down by the bounds,
+        and the upper bound on its information gain exceeds both MIN_INFO_GAIN and the best
+        gain of a candidate whose counts are. The counts of the other candidates are kept
+        as bounds, lower in variant_counts and upper in upper_variant_counts.
+
+        The bounds assume exact counts; with differentially private noise the pruning is approximate.
+
+        Args:
+            splits (list): pairs of a node that was split, with its candidate variant
+                counts, and its new child nodes
+        """
+        plans = []
+        queries = []
+        for node, children in splits:
+            searched = [child for child in children if self.can_split(child)]
+            if not searched:
+                continue
+            node_counts = node.counts
+            node_lower = node.variant_counts
+            node_upper = node_lower if node.upper_variant_counts is None else node.upper_variant_counts
+            node_exact = (node_lower == node_upper).all(axis=1)
+            smaller = min(children, key=lambda child: child.counts.sum())
+
+            bounds = {}
+            wanted = {}
+            for child in children:
+                bounds[id(child)] = self.child_count_bounds(node_lower, node_upper, node_counts, child.counts)
+                wanted[id(child)] = numpy.zeros(len(node_lower), dtype=bool)
+            smaller_exact = (bounds[id(smaller)][0] == bounds[id(smaller)][1]).all(axis=1)
+            for child in searched:
+                needed = self.find_pruned_candidates(child, *bounds[id(child)])
+                if child is smaller:
+                    wanted[id(smaller)] |= needed
+                else:
+                    # the counts of the sibling can be derived from those of the smaller child
+                    # where the counts of the parent are exact, and are fetched otherwise
+                    wanted[id(smaller)] |= needed & node_exact & ~smaller_exact
+                    wanted[id(child)] |= needed & ~node_exact
+
+            plans.append((node, children, searched, smaller, node_exact, bounds))
+            # without pruning, every candidate of the smaller child would have been fetched
+            self.count_fetches(smaller.split_path, 0)
+            for child in children:
+                if wanted[id(child)].any():
+                    queries.append((child, numpy.flatnonzero(wanted[id(child)])))
+                    self.count_fetches(child.split_path, len(queries[-1][1]), unpruned=False)
+
+        fetched_counts = await self.api.async_find_next_variant_count_matrices(
+            [child.split_path for child, _ in queries], [child.samples for child, _ in queries],
+            [candidates for _, candidates in queries])
+        fetched = {id(child): (candidates, variant_counts)
+                   for (child, candidates), variant_counts in zip(queries, fetched_counts)}
+
+        for node, children, searched, smaller, node_exact, bounds in plans:
+            for child in [smaller] + [child for child in children if child is not smaller]:
+                lower, upper = bounds[id(child)]
+                if id(child) in fetched:
+                    candidates, variant_counts = fetched[id(child)]
+                    lower[candidates] = upper[candidates] = variant_counts[candidates]
+                if child is not smaller:
+                    derivable = node_exact & (smaller.variant_counts == smaller.upper_variant_counts).all(axis=1)
+                    derived = numpy.maximum(node.variant_counts - smaller.variant_counts, 0)
+                    lower[derivable] = upper[derivable] = derived[derivable]
+                child.variant_counts = lower
+                child.upper_variant_counts = upper
+            for child in children:
+                if (child.variant_counts == child.upper_variant_counts).all():
+                    child.upper_variant_counts = None
+                if child not in searched:
+                    child.variant_counts = child.upper_variant_counts = None
+
+    def find_pruned_candidates(self, node, lower, upper):
+        """
+        Finds the candidate variants whose counts must be fetched for a node, given bounds on them
+
+        Args:
+            node (ID3_Node): the node, which has not been fetched yet
+            lower (numpy.ndarray): A (variants x ancestries) matrix of lower bounds on the counts
+            upper (numpy.ndarray): A (variants x ancestries) matrix of upper bounds on the counts
+
+        Returns:
+            needed (numpy.ndarray): whether each variant must be fetched
+        """
+        subset_counts = node.counts
+        exact = (lower == upper).all(axis=1)
+        considered = numpy.ones(len(lower), dtype=bool) if self.excluded is None else ~self.excluded
+        considered[[self.api.variant_name_list.index(var_name) for var_name in node.split_path[0]]] = False
+
+        best_gain = MIN_INFO_GAIN
+        if (exact & considered).any():
+            gains = self.split_gains(lower[exact & considered], subset_counts)[-1]
+            best_gain = max(best_gain, gains.max())
+        bounds = self.gain_upper_bounds(lower, upper, subset_counts)
+        return considered & ~exact & (bounds + BOUND_SLACK > MIN_INFO_GAIN) & (bounds + BOUND_SLACK >= best_gain)
+
+    def subset_counts(self, subset):
+        return numpy.array([subset.get(anc, 0) for anc in self.api.ancestry_list])
+
+    def count_fetches(self, split_path, fetched=None, unpruned=True):
+        """
+        Counts the candidate variant counts fetched for a node, and those that would have been
+        fetched without pruning, by the depth of the node
+
+        Args:
+            split_path (list1, list2): the split path of the node
+            fetched (int | None): the number of candidates fetched, all of them if None
+            unpruned (bool): whether all of the candidates would have been fetched without pruning
+        """
+        candidates = self.n_variants() - len(split_path[0])
+        depth_stats = self.prune_stats.setdefault(len(split_path[0]), {'fetched': 0, 'unpruned': 0})
+        depth_stats['fetched'] += candidates if fetched is None else fetched
+        if unpruned:
+            depth_stats['unpruned'] += candidates
+
+    def pruning_summary(self):
+        """
+        Returns:
+            (dict): the candidate variant counts fetched, those that would have been fetched
+                without pruning, and the number and fraction of them that pruning avoided
+        """
+        fetched = sum(depth_stats['fetched'] for depth_stats in self.prune_stats.values())
+        unpruned = sum(depth_stats['unpruned'] for depth_stats in self.prune_stats.values())
+        return {'fetched': fetched, 'unpruned': unpruned, 'avoided': unpruned - fetched,
+                'avoided_fraction': (unpruned - fetched) / unpruned if unpruned else 0.0}
+
     def print_tree(self, file_name):
-        DotExporter(self.root_node, nodenamefunc=ID3_Node.name_func).to_picture(file_name)
+        DotExporter(self.root_node.to_anytree(),
+                    nodenamefunc=lambda export_node: ID3_Node.name_func(export_node.node)).to_picture(file_name)
 
     @staticmethod
     def calc_other_split_variant_counts(w_var_counts, subset):
@@ -160,7 +542,7 @@ class ID3:
         return new_w_var_counts, wo_var_counts
 
 
-    def find_variant_split(self, subset, split_path):
+    def find_variant_split(self, subset, split_path, samples=None, w_var_counts=None, upper_var_counts=None):
         """
         Finds the variant to split on and returns the index where it should be split on.
         This calculation is based on which attribute gives the greatest information gain.
@@ -173,78 +555,200 @@ class ID3:
                 of the split. The direction of the second list is depicted by 1's
                 and 0's. Where 1 is splitting in the direction with the variant
                 and 0 is splitting in the direction without the variant. 
+            samples (numpy.ndarray | None): the samples of the node, if the API tracks them
+            w_var_counts (numpy.ndarray | None): the (variants x ancestries) counts of the
+                candidate variants in the node, fetched from the API if not given
+            upper_var_counts (numpy.ndarray | None): upper bounds on w_var_counts, if they were
+                pruned; only the variants whose counts are exact are considered
 
         Returns:
             ret_index (int): index that yields the greatest information gain
 
         """
 
-        variant_list = self.api.find_next_variant_counts(split_path)
         total_count = sum(subset.values())
-        ret_index = 0
-        final_info_gain = 0
-        var_idx_list = [self.api.variant_name_list.index(var_name) for var_name in split_path[0]]
-
         if total_count <= 1:
             return None
 
-        # loops through all the counts for each variant
-        for idx, w_var_counts in enumerate(variant_list):
-            w_var_counts, wo_var_counts = self.calc_other_split_variant_counts(w_var_counts, subset)
-            w_fraction = sum(w_var_counts.values()) / total_count
-            wo_fraction = sum(wo_var_counts.values()) / total_count
-            if w_fraction == 0. or wo_fraction == 0.:
-                continue
+        subset_counts = numpy.array([subset.get(anc, 0) for anc in self.api.ancestry_list])
+        if w_var_counts is None:
+            w_var_counts = self.api.find_next_variant_count_matrix(split_path, samples, self.variants)
+        if len(w_var_counts) == 0:
+            return None
+        info_gain = self.split_gains(w_var_counts, subset_counts)[-1]
 
-            # calculates info gain
-#            info_gain = ID3.entropy_by_count(subset) - ( sum(wo_var_counts.values()) / total_count * ID3.entropy_by_count(wo_var_counts) + sum(w_var_counts.values()) / total_count * ID3.entropy_by_count(w_var_counts) )
-            info_gain = ID3.entropy_by_count(subset) - (wo_fraction * ID3.entropy_by_count(wo_var_counts) + 
-                                                        w_fraction * ID3.entropy_by_count(w_var_counts))
-            # finds max info gain and checks if the index is not in excluded variants list
-            if final_info_gain < info_gain and idx not in var_idx_list:
-                final_info_gain = info_gain
-                ret_index = idx
+        # excludes the variants that have already been split upon
+        var_idx_list = [self.api.variant_name_list.index(var_name) for var_name in split_path[0]]
+        info_gain[var_idx_list] = 0.
+        if self.excluded is not None:
+            info_gain[self.excluded] = 0.
+        # excludes the variants that were pruned, which cannot be chosen
+        if upper_var_counts is not None:
+            info_gain[(w_var_counts != upper_var_counts).any(axis=1)] = 0.
+
+        # finds max info gain, the first variant winning any tie
+        ret_index = int(numpy.argmax(info_gain))
         # checks if there is any info gain
-        if final_info_gain <= 0.1:
+        if info_gain[ret_index] <= MIN_INFO_GAIN:
             return None
         return ret_index
 
+    def split_node(self, node):
+        """
+        Finds the variant to split a node on and creates its children
+
+        Note: the candidate variant counts of the node must already have been fetched,
+        unless the node cannot be split
+
+        Args:
+            node (ID3_Node): the node to split
+
+        Returns:
+            children (list): the new child nodes, empty if the node is a leaf node
+        """
+        if not self.can_split(node):
+            return []
+        with self.profiler.stage('find_variant_split'):
+            split_index = self.find_variant_split(node.subset, node.split_path, node.samples, node.variant_counts,
+                                                  node.upper_variant_counts)
+        if split_index is None:
+            return []
+        with self.profiler.stage('is_leaf_node'):
+            if self.is_leaf_node(node, split_index):
+                return []
+
+        var_name = self.api.variant_name_list[split_index]
+        w_counts, wo_counts = self.split_subset_by_counts(node, split_index)
+        w_samples, wo_samples = self.api.split_samples(node, var_name)
+
+        children = []
+        if w_counts.sum() > 0:
+            children.append(ID3_Node(var_name, w_counts, with_variant=True, parent=node, samples=w_samples))
+        if wo_counts.sum() > 0:
+            children.append(ID3_Node(var_name, wo_counts, with_variant=False, parent=node, samples=wo_samples))
+        return children
+
     # note: variant list must be same length as count list
     def ID3(self, node, verbose=True):
         """
-        A recursive function that creates a tree given the root node and a subset
+        Creates a tree given the root node and a subset, by running async_ID3 to
+        completion with the API: on its event loop for a remote API, and without one
+        for local VCF files
 
         Note: variant list must be same length as count list
 
         Args:
             node (Node): A node object from the anytree library
-            split_path (list1, list2): 
-                This is the paths of the splits before the current split. The first list
-                is the list of variant names and the second list is the direction
-                of the split. The direction of the second list is depicted by 1's
-                and 0's. Where 1 is splitting in the direction with the variant
-                and 0 is splitting in the direction without the variant. 
-
-        TODO:
-            * Clean up if statements that check if the subset values are greater than 0 (should be taken care of in leaf node calc)
 
         """
-        # find the attrivute to split on and adds that variant to exclude variant list
         self.verbose = verbose
-        if self.verbose:
-            print('.', end='', flush=True)
-        subset = node.subset
-        split_index = self.find_variant_split(subset, node.split_path)
-        if split_index is None:
-            return
-        if not self.is_leaf_node(subset, node.split_path, split_index):
-            var_name = self.api.variant_name_list[split_index]
+        self.api.run(self.async_ID3(node))
 
-            w_subset, wo_subset = self.api.split_subset(node, var_name)
-            w_split_path, wo_split_path = self.api.create_split_path(node.split_path, var_name)
+    async def async_ID3(self, node):
+        """
+        Creates a tree given the root node and a subset. The tree is built breadth first,
+        from a frontier of the nodes of one level rather than by recursion, so that deep
+        trees do not reach the recursion limit: the candidate variant counts of every node
+        of a level are asked of the API in one batch, which a remote API sends as
+        concurrent requests over its session, and then the nodes of the level are split.
 
+        When more than one worker is used, the subtrees below parallel_depth are
+        built in a pool of processes instead, and attached once the levels above them
+        are built. The genotypes are shared with the workers through a memory-mapped file
+        rather than being copied to each of them.
+
+        Args:
+            node (Node): A node object from the anytree library
+        """
+        if self.workers <= 1:
+            await self.expand_levels([node])
+            return
+        with tempfile.TemporaryDirectory() as shared_dir:
+            shared_genotypes = self.api.share_genotypes(shared_dir)
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_subtree_worker,
+                                     initargs=(type(self.api), shared_genotypes)) as executor:
+                await self.expand_levels([node], executor)
+                for subtree_node, subtree in self.subtrees:
+                    self.attach_subtree(subtree_node, *subtree.result())
+                self.subtrees = []
+
+    async def expand_levels(self, frontier, executor=None):
+        """
+        Expands the nodes of a level, then those of the next level, until no node is split
 
-            if sum(w_subset.values()) > 0:
-                self.ID3(ID3_Node(var_name, dict(w_subset), with_variant=True, split_path=w_split_path, parent=node), self.verbose)
-            if sum(wo_subset.values()) > 0:
-                self.ID3(ID3_Node(var_name, dict(wo_subset), with_variant=False, split_path=wo_split_path, parent=node), self.verbose)
\ No newline at end of file
+        Args:
+            frontier (list): the nodes of the first level to expand, all of the same depth
+            executor (ProcessPoolExecutor): the pool to build the subtrees below
+                parallel_depth in, or None to build them here
+        """
+        depth = frontier[0].depth if frontier else 0
+        while frontier:
+            if executor is not None and depth >= self.parallel_depth:
+                for frontier_node in frontier:
+                    self.submit_subtree(frontier_node, executor)
+                return
+
+            unfetched = [frontier_node for frontier_node in frontier
+                         if frontier_node.variant_counts is None and self.can_split(frontier_node)]
+            if unfetched:
+                for frontier_node in unfetched:
+                    self.count_fetches(frontier_node.split_path)
+                fetched_counts = await self.api.async_find_next_variant_count_matrices(
+                    [frontier_node.split_path for frontier_node in unfetched],
+                    [frontier_node.samples for frontier_node in unfetched],
+                    [self.variants] * len(unfetched))
+                for frontier_node, variant_counts in zip(unfetched, fetched_counts):
+                    frontier_node.variant_counts = variant_counts
+
+            splits = []
+            for frontier_node in frontier:
+                if self.verbose:
+                    print('.', end='', flush=True)
+                self.profiler.node_built(depth)
+                children = self.split_node(frontier_node)
+                if children:
+                    splits.append((frontier_node, children))
+            if self.prune:
+                await self.find_pruned_children_variant_counts(splits)
+            else:
+                await self.find_children_variant_counts(splits)
+
+            # the level is built, and its children hold what they need of its samples and counts
+            for frontier_node in frontier:
+                frontier_node.samples = None
+                frontier_node.variant_counts = None
+                frontier_node.upper_variant_counts = None
+            frontier = [child for _, children in splits for child in children]
+            depth += 1
+
+    def submit_subtree(self, node, executor):
+        """
+        Submits the subtree under a node to be built in a worker process, to be attached
+        back to the node by attach_subtree
+
+        Args:
+            node (ID3_Node): the node to build the subtree under
+            executor (ProcessPoolExecutor): the pool of worker processes
+        """
+        # the subtree root is sent detached so that the rest of the tree is not pickled
+        subtree = executor.submit(_build_subtree, node.detached(), node.samples, node.variant_counts,
+                                  node.upper_variant_counts, self.prune, self.variants)
+        self.subtrees.append((node, subtree))
+        node.samples = None
+        node.variant_counts = None
+        node.upper_variant_counts = None
+
+    def attach_subtree(self, node, subtree_root, prune_stats, profiler):
+        """
+        Attaches a subtree built in a worker process back to its node, merging its
+        pruning statistics and profile into those of the tree
+        """
+        if self.verbose:
+            print('.', end='', flush=True)
+        node.children = subtree_root.children
+        for child in node.children:
+            child.parent = node
+        for depth, depth_stats in prune_stats.items():
+            for key, value in depth_stats.items():
+                self.prune_stats.setdefault(depth, {'fetched': 0, 'unpruned': 0})[key] += value
+        self.profiler.merge(profiler)
@@ -0,0 +1,218 @@
+import math
+import tempfile
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from .CompiledTree import CompiledTree, check_format, load_arrays, variant_features
+from .ID3_Class import ID3
+from .ID3_Node import ID3_Node
+from .Profiler import Profiler
+
+# identifies a model file holding an ensemble of compiled trees
+ENSEMBLE_FORMAT = 'id3-compiled-ensemble'
+# bump whenever the arrays of an ensemble model file change
+ENSEMBLE_FORMAT_VERSION = 1
+
+# the API of an ensemble worker process, attached to the shared genotypes once per process
+_ensemble_api = None
+
+
+def _init_ensemble_worker(api_class, shared_genotypes):
+    global _ensemble_api
+    _ensemble_api = api_class.from_shared_genotypes(shared_genotypes)
+
+
+def _build_member(seed, bootstrap, variant_fraction, prune):
+    # each tree is profiled on its own, to be merged into the profile of the ensemble
+    _ensemble_api.profiler = Profiler()
+    return build_tree(_ensemble_api, seed, bootstrap, variant_fraction, prune)
+
+
+def build_tree(api, seed, bootstrap=True, variant_fraction=0.5, prune=False):
+    """
+    Builds a tree of an ensemble on a bootstrap sample of the people and a random subset of the variants
+
+    Args:
+        api (LOCAL_API): the genotypes to train on
+        seed (numpy.random.SeedSequence): the seed of the tree's samples and variants
+        bootstrap (bool): whether to train on a bootstrap sample of the people, rather than all of them
+        variant_fraction (float): the fraction of the variants the tree may split on
+        prune (bool): whether to prune candidate variants, as with ID3
+
+    Returns:
+        compiled_tree (CompiledTree): the tree
+        profiler (Profiler): the profile of building the tree
+    """
+    rng = numpy.random.default_rng(seed)
+    n_people = len(api.genotype_matrix)
+    n_variants = len(api.variant_name_list)
+    samples = numpy.arange(n_people)
+    if bootstrap:
+        # sorted, so that the rows of the genotype matrix are read in order
+        samples = numpy.sort(rng.integers(0, n_people, n_people))
+    variants = None
+    if variant_fraction < 1:
+        variants = numpy.sort(rng.choice(n_variants, max(1, math.ceil(variant_fraction * n_variants)), replace=False))
+
+    root_node = ID3_Node('root', api.count_ancestries(samples), True, ancestries=api.ancestry_list, samples=samples)
+    tree = ID3(api, verbose=False, root_node=root_node, prune=prune, variants=variants)
+    return tree.compile(), tree.profiler
+
+
+class ID3_Ensemble:
+
+    def __init__(self, api, n_trees=10, bootstrap=True, variant_fraction=0.5, workers=1, seed=None, prune=False,
+                 verbose=True):
+        """
+        Trains a bagged ensemble of ID3 trees, each on a bootstrap sample of the people and a
+        random subset of the variants, which predicts by a majority vote of its trees. With
+        more than one worker the trees are built in a pool of processes, which share the
+        genotypes through a memory-mapped file rather than each decoding the VCF files.
+
+        Args:
+            api (LOCAL_API): the genotypes to train on
+            n_trees (int): the number of trees
+            bootstrap (bool): whether to train each tree on a bootstrap sample of the people
+            variant_fraction (float): the fraction of the variants each tree may split on
+            workers (int): number of processes to build trees in
+            seed (int): seed of the samples and variants of the trees
+            prune (bool): whether to prune candidate variants, as with ID3
+            verbose (bool): whether to print a dot as each tree is built
+
+        Attributes:
+            trees (list): the compiled trees
+            ancestry_list (list): the ancestries which predicted labels are indices into
+            variant_names (list): the names of the variants any of the trees split on
+            profiler (Profiler): the profiler of the API, with the profiles of building each tree merged in
+        """
+        self.profiler = api.profiler
+        self.ancestry_list = list(api.ancestry_list)
+        seeds = numpy.random.SeedSequence(seed).spawn(n_trees)
+
+        self.trees = []
+        with self.profiler.stage('build_ensemble'):
+            if workers <= 1:
+                try:
+                    for tree_seed in seeds:
+                        # each tree is profiled on its own, as in the worker processes
+                        api.profiler = Profiler()
+                        self.add_tree(*build_tree(api, tree_seed, bootstrap, variant_fraction, prune), verbose)
+                finally:
+                    api.profiler = self.profiler
+            else:
+                with tempfile.TemporaryDirectory() as shared_dir:
+                    shared_genotypes = api.share_genotypes(shared_dir)
+                    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ensemble_worker,
+                                             initargs=(type(api), shared_genotypes)) as executor:
+                        n = len(seeds)
+                        for compiled_tree, profiler in executor.map(_build_member, seeds, [bootstrap] * n,
+                                                                    [variant_fraction] * n, [prune] * n):
+                            self.add_tree(compiled_tree, profiler, verbose)
+        if verbose:
+            print("")
+        self.variant_names = self.union_variant_names()
+
+    def add_tree(self, compiled_tree, profiler, verbose=False):
+        """
+        Adds a tree as it is built, merging its profile into that of the ensemble
+        """
+        self.trees.append(compiled_tree)
+        self.profiler.merge(profiler)
+        if verbose:
+            print('.', end='', flush=True)
+
+    def union_variant_names(self):
+        return list(dict.fromkeys(variant_name for tree in self.trees for variant_name in tree.variant_names))
+
+    def compile(self):
+        """
+        The trees are already compiled, so that the ensemble can be used wherever a trained ID3 can be
+
+        Returns:
+            ensemble (ID3_Ensemble): this ensemble
+        """
+        return self
+
+    def predict_votes(self, genotype_matrix, variant_name_list):
+        """
+        Counts the votes of the trees for the ancestry of every person in a genotype matrix.
+        The columns of every variant a tree splits on are selected once for the whole ensemble.
+
+        Args:
+            genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+            variant_name_list (list): the names of the columns of the genotype matrix
+
+        Returns:
+            votes (numpy.ndarray): A (people x ancestry_list) matrix of the number of trees
+                                   voting for each ancestry of each person
+        """
+        features = variant_features(genotype_matrix, variant_name_list, self.variant_names)
+        feature_index = {variant_name: idx for idx, variant_name in enumerate(self.variant_names)}
+        ancestry_index = {ancestry: idx for idx, ancestry in enumerate(self.ancestry_list)}
+
+        n_people, n_ancestries = len(features), len(self.ancestry_list)
+        labels = numpy.empty((len(self.trees), n_people), dtype=numpy.intp)
+        for idx, tree in enumerate(self.trees):
+            columns = [feature_index[variant_name] for variant_name in tree.variant_names]
+            label_map = numpy.array([ancestry_index[ancestry] for ancestry in tree.ancestry_list], dtype=numpy.intp)
+            labels[idx] = label_map[tree.label[tree.predict_nodes(features[:, columns])]]
+
+        # the votes of every tree for every person, counted in one pass
+        cells = numpy.arange(n_people) * n_ancestries + labels
+        return numpy.bincount(cells.ravel(), minlength=n_people * n_ancestries).reshape(n_people, n_ancestries)
+
+    def predict_batch(self, genotype_matrix, variant_name_list):
+        """
+        Predicts the ancestry of every person in a genotype matrix by a majority vote of the
+        trees, ties going to the ancestry first in ancestry_list
+
+        Args:
+            genotype_matrix (numpy.ndarray): A (people x variants) matrix of 0's and 1's
+            variant_name_list (list): the names of the columns of the genotype matrix
+
+        Returns:
+            labels (numpy.ndarray): the index into ancestry_list of each person's predicted ancestry
+        """
+        return numpy.argmax(self.predict_votes(genotype_matrix, variant_name_list), axis=1)
+
+    def save(self, file):
+        """
+        Writes the arrays of the trees to a model file, which can be read back with load
+
+        Args:
+            file (str | file): the path or the file to write the model to
+        """
+        arrays = {'tree%d_%s' % (idx, name): array
+                  for idx, tree in enumerate(self.trees) for name, array in tree.arrays().items()}
+        numpy.savez(file, format=numpy.array(ENSEMBLE_FORMAT), format_version=numpy.array(ENSEMBLE_FORMAT_VERSION),
+                    n_trees=numpy.array(len(self.trees)), ancestry_list=numpy.array(self.ancestry_list, dtype=str),
+                    **arrays)
+
+    @classmethod
+    def load(cls, file, mmap=False):
+        """
+        Reads an ensemble from a model file written by save
+
+        Args:
+            file (str | file): the path or the file to read the model from
+            mmap (bool): whether to memory-map the arrays of the trees rather than reading them;
+                         file must be a path
+
+        Returns:
+            ensemble (ID3_Ensemble): the ensemble, without a profiler
+
+        Raises:
+            ValueError: if the file is not an ensemble model file, or is of a newer version
+        """
+        arrays = load_arrays(file, mmap)
+        check_format(arrays, ENSEMBLE_FORMAT, ENSEMBLE_FORMAT_VERSION, file)
+
+        ensemble = cls.__new__(cls)
+        ensemble.profiler = None
+        ensemble.ancestry_list = arrays['ancestry_list'].tolist()
+        ensemble.trees = []
+        for idx in range(int(arrays['n_trees'])):
+            prefix = 'tree%d_' % idx
+            ensemble.trees.append(CompiledTree.from_arrays({name[len(prefix):]: array for name, array in arrays.items()
+                                                            if name.startswith(prefix)}))
+        ensemble.variant_names = ensemble.union_variant_names()
+        return ensemble
@@ -1,17 +1,158 @@
-from anytree import NodeMixin
+import numpy
+from anytree import AnyNode
 
-class ID3_Node(NodeMixin):
-    def __init__(self, variant_name, subset, with_variant, split_path=([], []), parent=None, children=None):
-        super(ID3_Node, self).__init__()
+
+class ID3_Node:
+
+    __slots__ = ('variant_name', 'with_variant', 'counts', 'ancestries', 'parent', 'children',
+                 'samples', 'variant_counts', 'upper_variant_counts')
+    # the slots only needed while the node is being built, which are not pickled
+    build_slots = ('samples', 'variant_counts', 'upper_variant_counts')
+
+    def __init__(self, variant_name, counts, with_variant, ancestries=None, parent=None, samples=None):
+        """
+        A node of a decision tree, holding only its split and the counts of each ancestry in
+        it; its split path and depth are found by walking up its parents
+
+        Args:
+            variant_name (str): the variant the node was split from its parent on, or 'root'
+            counts (numpy.ndarray): the counts of each ancestry in the node, ordered as in ancestries
+            with_variant (bool): whether the people of the node have the variant
+            ancestries (list): the ancestries the counts are of, shared by every node of a
+                               tree; those of the parent if None
+            parent (ID3_Node): the parent of the node, which it is added as a child of
+            samples (numpy.ndarray): the samples of the node, if the API tracks them
+
+        Attributes:
+            children (list): the child nodes
+            variant_counts (numpy.ndarray): the (variants x ancestries) counts of the candidate
+                                            variants in the node, while it is being built
+            upper_variant_counts (numpy.ndarray): upper bounds on variant_counts, if they were pruned
+        """
         self.variant_name = variant_name
         self.with_variant = with_variant
-        self.subset = subset
-        self.total_count = str(sum(subset.values()))
-        self.most_common_ancestry = str(max(subset, key=subset.get))
+        self.counts = counts
+        self.ancestries = parent.ancestries if ancestries is None else ancestries
         self.parent = parent
-        self.split_path = split_path
-        if children:
-            self.children = children
+        self.children = []
+        self.samples = samples
+        self.variant_counts = None
+        self.upper_variant_counts = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__ if name not in self.build_slots}
+        # a list pickles smaller than an array of a few counts
+        state['counts'] = self.counts.tolist()
+        return state
+
+    def __setstate__(self, state):
+        if 'counts' in state:
+            state = dict(state, counts=numpy.array(state['counts']))
+        else:
+            # a node pickled before nodes had slots, as an anytree NodeMixin
+            subset = state['subset']
+            state = {
+                'variant_name': state['variant_name'],
+                'with_variant': state['with_variant'],
+                'counts': numpy.array(list(subset.values())),
+                'ancestries': list(subset),
+                'parent': state.get('_NodeMixin__parent'),
+                'children': list(state.get('_NodeMixin__children', [])),
+            }
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
+    @property
+    def subset(self):
+        """
+        A dictionary containing keys of ancestries and values of the counts for the particular ancestry
+        """
+        return dict(zip(self.ancestries, self.counts.tolist()))
+
+    @property
+    def total_count(self):
+        return self.counts.sum().item()
+
+    @property
+    def most_common_ancestry(self):
+        """
+        The most common ancestry in the node, the first in ancestries winning any tie
+        """
+        return self.ancestries[int(numpy.argmax(self.counts))]
+
+    @property
+    def depth(self):
+        """
+        The number of splits from the root to the node
+        """
+        depth = 0
+        node = self.parent
+        while node is not None:
+            depth += 1
+            node = node.parent
+        return depth
+
+    @property
+    def split_path(self):
+        """
+        The paths of the splits from the root to the node. The first list is the list of
+        variant names and the second list is the direction of the split, 1 for the direction
+        with the variant and 0 for the direction without it.
+        """
+        variant_names = []
+        directions = []
+        node = self
+        while node.parent is not None:
+            variant_names.append(node.variant_name)
+            directions.append(int(node.with_variant))
+            node = node.parent
+        return variant_names[::-1], directions[::-1]
+
+    def iter_nodes(self):
+        """
+        Iterates over the node and every node under it, breadth first
+        """
+        nodes = [self]
+        for node in nodes:
+            yield node
+            nodes.extend(node.children)
+
+    def detached(self):
+        """
+        Copies the node, without its children, under copies of its ancestors which hold only
+        their splits and counts, so that it can be sent to another process without the rest
+        of the tree while keeping its split path. As the build slots are not pickled, they
+        are sent to the other process alongside the copy.
+
+        Returns:
+            node (ID3_Node): the copy of the node
+        """
+        ancestors = []
+        node = self.parent
+        while node is not None:
+            ancestors.append(node)
+            node = node.parent
+        parent = None
+        for ancestor in reversed(ancestors):
+            parent = ID3_Node(ancestor.variant_name, ancestor.counts, ancestor.with_variant,
+                              ancestries=self.ancestries, parent=parent)
+        return ID3_Node(self.variant_name, self.counts, self.with_variant, ancestries=self.ancestries, parent=parent)
+
+    def to_anytree(self):
+        """
+        Copies the tree under the node to anytree nodes, for anytree's exporters and renderers
+
+        Returns:
+            root (anytree.AnyNode): the copy of the node, whose `node` is this node
+        """
+        root = AnyNode(node=self)
+        export_nodes = [root]
+        for export_node in export_nodes:
+            for child in export_node.node.children:
+                export_nodes.append(AnyNode(node=child, parent=export_node))
+        return root
 
     @staticmethod
     def name_func(node):
@@ -19,4 +160,4 @@ class ID3_Node(NodeMixin):
 
     @staticmethod
     def nodeattrfunc(node):
-        return "most common ancestry: %s | total count: %s" % (node.most_common_ancestry, node.total_count)
\ No newline at end of file
+        return "most common ancestry: %s | total count: %s" % (node.most_common_ancestry, node.total_count)
@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import deque
+import numpy
+
+
+class PredictionService:
+
+    def __init__(self, models, max_batch=256, max_delay=0.002, latency_window=10000):
+        """
+        Predicts the ancestry of people with trained trees which stay loaded, coalescing
+        the requests that arrive together into micro-batches, each routed through a tree
+        with array operations at once
+
+        Args:
+            models (dict): the compiled trees to predict with, by name
+            max_batch (int): the most people to predict in one batch
+            max_delay (float): the most seconds a request waits for others to join its batch
+            latency_window (int): the number of latest requests the latency percentiles are of
+
+        Attributes:
+            variant_columns (dict): per model, the column of each variant it splits on
+            queues (dict): per model, the requests waiting to be batched, created on first use
+            batchers (dict): per model, the task which batches its requests
+            latencies (collections.deque): the seconds the latest requests took, queueing included
+            stats (dict): the number of requests answered, of those which failed and of
+                          batches, and when the service started
+        """
+        self.models = models
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.variant_columns = {name: {variant_name: idx for idx, variant_name in enumerate(model.variant_names)}
+                                for name, model in models.items()}
+        self.queues = {}
+        self.batchers = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.stats = {'requests': 0, 'errors': 0, 'batches': 0, 'started': time.perf_counter()}
+
+    def features(self, model_name, sample):
+        """
+        Converts a sample to the row of features of a model
+
+        Args:
+            model_name (str): the model to predict with
+            sample (dict): either "variants", the ids of the variants the person has, or
+                           "genotypes", a row of 0's and 1's for the variants the model splits
+                           on, in the order of its variant_names
+
+        Returns:
+            row (numpy.ndarray): whether the person has each variant the model splits on
+
+        Raises:
+            ValueError: if the sample has neither, its variants are not a list of ids or its
+                        genotypes are not a list of 0's and 1's which fits the model
+        """
+        columns = self.variant_columns[model_name]
+        row = numpy.zeros(len(columns), dtype=bool)
+        if 'variants' in sample:
+            variants = sample['variants']
+            if not isinstance(variants, list) or not all(isinstance(variant, str) for variant in variants):
+                raise ValueError('variants must be a list of variant ids')
+            row[[columns[variant] for variant in variants if variant in columns]] = True
+        elif 'genotypes' in sample:
+            if not isinstance(sample['genotypes'], list) or \
+                    not all(genotype in (0, 1) for genotype in sample['genotypes']):
+                raise ValueError("genotypes must be a list of 0's and 1's")
+            genotypes = numpy.asarray(sample['genotypes'])
+            if genotypes.shape != row.shape:
+                raise ValueError('expected %d genotypes, in the order of the variant names of model %s, got %s'
+                                 % (len(row), model_name, genotypes.shape))
+            row[:] = genotypes == 1
+        else:
+            raise ValueError('a sample needs either variants or genotypes')
+        return row
+
+    def model_name(self, sample):
+        """
+        The model a sample asks for, which may be left out if only one model is loaded
+
+        Raises:
+            ValueError: if the model is not loaded
+        """
+        name = sample.get('model')
+        if name is None and len(self.models) == 1:
+            return next(iter(self.models))
+        if name not in self.models:
+            raise ValueError('unknown model %r; the models are %s' % (name, ', '.join(self.models)))
+        return name
+
+    async def predict(self, sample):
+        """
+        Predicts the ancestry of one person, in a batch with the other requests that arrive
+        within max_delay
+
+        Args:
+            sample (dict): the person, as for features, and the "model" to predict with
+
+        Returns:
+            (dict): the predicted ancestry, and the counts of each ancestry in the leaf node
+                    the person ends up in when the tree was trained
+
+        Raises:
+            ValueError: if the sample is not a dict, or does not fit the model
+        """
+        started = time.perf_counter()
+        try:
+            if not isinstance(sample, dict):
+                raise ValueError('a sample must be a JSON object, got %s' % type(sample).__name__)
+            model_name = self.model_name(sample)
+            row = self.features(model_name, sample)
+            if model_name not in self.queues:
+                self.queues[model_name] = asyncio.Queue()
+                self.batchers[model_name] = asyncio.ensure_future(self.batch_requests(model_name))
+            future = asyncio.get_running_loop().create_future()
+            await self.queues[model_name].put((row, future))
+            node = await future
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+
+        model = self.models[model_name]
+        self.stats['requests'] += 1
+        self.latencies.append(time.perf_counter() - started)
+        counts = model.counts[node]
+        return {'model': model_name, 'ancestry': model.ancestry_list[model.label[node]],
+                'counts': {ancestry: int(count) for ancestry, count in zip(model.ancestry_list, counts.tolist()) if count}}
+
+    async def batch_requests(self, model_name):
+        """
+        Takes the requests of a model off its queue a batch at a time, and routes each
+        batch through the model at once
+        """
+        queue = self.queues[model_name]
+        model = self.models[model_name]
+        while True:
+            batch = [await queue.get()]
+            if queue.qsize() + 1 < self.max_batch and self.max_delay > 0:
+                # gives the requests arriving together time to join the batch
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            self.stats['batches'] += 1
+            try:
+                nodes = model.predict_nodes(numpy.stack([row for row, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), node in zip(batch, nodes.tolist()):
+                if not future.done():
+                    future.set_result(node)
+
+    def report(self):
+        """
+        Returns:
+            (dict): the requests answered and failed, the batches and their mean size, the
+                    requests answered per second since the service started, and the p50
+                    and p99 latency of the latest requests in milliseconds
+        """
+        elapsed = time.perf_counter() - self.stats['started']
+        report = {key: value for key, value in self.stats.items() if key != 'started'}
+        report['mean_batch'] = self.stats['requests'] / self.stats['batches'] if self.stats['batches'] else 0.0
+        report['requests_per_second'] = self.stats['requests'] / elapsed if elapsed > 0 else 0.0
+        if self.latencies:
+            p50, p99 = numpy.percentile(numpy.array(self.latencies), [50, 99]) * 1000
+            report.update(p50_ms=float(p50), p99_ms=float(p99))
+        return report
+
+    async def close(self):
+        """
+        Stops batching requests
+        """
+        for batcher in self.batchers.values():
+            batcher.cancel()
+        await asyncio.gather(*self.batchers.values(), return_exceptions=True)
+        self.batchers = {}
+        self.queues = {}
@@ -0,0 +1,112 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+
+    def __init__(self, callback=None, interval=0.0):
+        """
+        Records where a training run spends its time: the wall time and number of calls of
+        each stage, such as decoding the VCF files or fetching counts, counters such as the
+        requests sent and their bytes, and the nodes of the tree built so far
+
+        Args:
+            callback (callable): if given, called with the progress of the training run, as
+                                 from progress_report, whenever a node of the tree is built
+            interval (float): the fewest seconds between calls of the callback
+
+        Attributes:
+            started (float): when the profiler was created, by time.perf_counter
+            stages (dict): the number of calls and the seconds spent in each stage, by name;
+                           time spent in a stage nested in another counts towards both
+            counters (dict): the value of each counter, by name
+            nodes (int): the number of nodes of the tree built
+            depth (int): the depth of the nodes being built
+            last_progress (float): when the callback was last called
+        """
+        self.callback = callback
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.nodes = 0
+        self.depth = 0
+        self.last_progress = None
+
+    def __getstate__(self):
+        # the callback belongs to the training run rather than to the pickled model
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code run within the context as a call of a stage
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds, calls=1):
+        stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        stage['calls'] += calls
+        stage['seconds'] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def node_built(self, depth):
+        """
+        Counts a node of the tree as built, reporting the progress to the callback
+        """
+        self.nodes += 1
+        self.depth = depth
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if self.last_progress is None or now - self.last_progress >= self.interval:
+            self.last_progress = now
+            self.callback(self.progress_report())
+
+    def merge(self, other):
+        """
+        Adds the stages, counters and nodes of another profiler, such as that of a subtree
+        built in another process, to this one
+        """
+        for name, stage in other.stages.items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, value in other.counters.items():
+            self.count(name, value)
+        self.nodes += other.nodes
+        if self.callback is not None:
+            self.callback(self.progress_report())
+
+    def progress_report(self):
+        """
+        Returns:
+            (dict): the nodes built, the depth being built, the seconds elapsed and the nodes built per second
+        """
+        elapsed = time.perf_counter() - self.started
+        return {'nodes': self.nodes, 'depth': self.depth, 'elapsed': elapsed,
+                'nodes_per_second': self.nodes / elapsed if elapsed > 0 else 0.0}
+
+    def report(self):
+        """
+        Returns:
+            (dict): the progress, as from progress_report, with the stages, slowest first, and the counters
+        """
+        report = self.progress_report()
+        report['stages'] = dict(sorted(self.stages.items(), key=lambda item: -item[1]['seconds']))
+        report['counters'] = dict(sorted(self.counters.items()))
+        return report
+
+    def write(self, path):
+        """
+        Writes the report to a JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
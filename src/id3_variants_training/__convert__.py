@@ -0,0 +1,30 @@
+import argparse
+import pickle
+
+
+def convert(pickle_path, model_path):
+    """
+    Converts a pickled ID3 model to a compiled tree model file
+
+    Args:
+        pickle_path (str): path to the pickled ID3 model
+        model_path (str): path to write the compiled tree model file to
+
+    Returns:
+        compiled_tree (CompiledTree): the compiled tree
+    """
+    with open(pickle_path, 'rb') as f:
+        id3_tree = pickle.load(f)
+    compiled_tree = id3_tree.compile()
+    with open(model_path, 'wb') as f:
+        compiled_tree.save(f)
+    return compiled_tree
+
+
+def convert_main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pickle_file', help='path to a pickled ID3 file, as written by train-id3 --format pickle')
+    parser.add_argument('model_file', help='path to output the compiled ID3 file to')
+    args = parser.parse_args()
+
+    convert(args.pickle_file, args.model_file)
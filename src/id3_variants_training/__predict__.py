@@ -2,22 +2,68 @@ import argparse
 import pickle
 import numpy
 from .ConfusionMatrix import ConfusionMatrix
+from .CompiledTree import CompiledTree
+from .ID3_Ensemble import ENSEMBLE_FORMAT, ID3_Ensemble
 from .local_API import LOCAL_API
 
 
-def predict(config_path, id3_tree):
-    api = LOCAL_API(config_path, False)
+def load_model(model_path, mmap=False):
+    """
+    Loads a model file, either a compiled tree, an ensemble of compiled trees or a pickled
+    ID3 from before the compiled format
+
+    Args:
+        model_path (str): path to the model file
+        mmap (bool): whether to memory-map the arrays of a compiled tree or an ensemble
+
+    Returns:
+        model (CompiledTree | ID3_Ensemble | ID3): the model
+    """
+    with open(model_path, 'rb') as f:
+        # compiled models are zip archives of arrays
+        if f.read(2) != b'PK':
+            f.seek(0)
+            return pickle.load(f)
+    with numpy.load(model_path) as archive:
+        model_format = str(archive['format']) if 'format' in archive.files else None
+    if model_format == ENSEMBLE_FORMAT:
+        return ID3_Ensemble.load(model_path, mmap=mmap)
+    return CompiledTree.load(model_path, mmap=mmap)
+
+
+def predict(config_path, id3_tree, cache_dir=None, targeted=False):
+    """
+    Predicts the ancestry of the people of a config with a trained tree
+
+    Args:
+        config_path (str): path to the config file of the VCF and PED files to predict
+        id3_tree (ID3 | CompiledTree | ID3_Ensemble): the trained tree, or ensemble of trees
+        cache_dir (str): directory to cache the genotypes decoded from VCF files in
+        targeted (bool): whether to decode only the variants the tree splits on, by targeted
+                         tabix queries, rather than every variant of the variant ranges
+
+    Returns:
+        conf_matrix (ConfusionMatrix): the predictions against the actual ancestries
+    """
+    variant_names = id3_tree.compile().variant_names if targeted else None
+    api = LOCAL_API(config_path, False, cache_dir=cache_dir, variant_names=variant_names)
     return ConfusionMatrix(id3_tree, api)
 
 
 def predict_main():
     parser = argparse.ArgumentParser()
     parser.add_argument('config_path', help='path to the config file that contains vcf file paths', default='config.json')
-    parser.add_argument('model_file', help='path to input ID3 file', type=argparse.FileType('rb'))
+    parser.add_argument('model_file', help='path to input ID3 file', type=str)
+    parser.add_argument('--cache-dir', help='directory to cache the genotypes decoded from VCF files in', type=str)
+    parser.add_argument('--mmap', action='store_true', default=False,
+                        help='memory-map the arrays of the model file rather than reading them')
+    parser.add_argument('--targeted', action='store_true', default=False,
+                        help='decode only the variants the model splits on, by targeted tabix queries, rather '
+                        'than every variant of the variant ranges')
     args = parser.parse_args()
 
-    id3_model = pickle.load(args.model_file)
-    conf_matrix = predict(args.config_path, id3_model)
+    id3_model = load_model(args.model_file, mmap=args.mmap)
+    conf_matrix = predict(args.config_path, id3_model, cache_dir=args.cache_dir, targeted=args.targeted)
     numpy.set_printoptions(linewidth=10000)
     print(conf_matrix)
     print(conf_matrix.get_accuracy())
@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from aiohttp import web
+from .CompiledTree import CompiledTree
+from .PredictionService import PredictionService
+from .__predict__ import load_model
+
+
+def load_models(model_specs, mmap=False):
+    """
+    Loads the models to serve
+
+    Args:
+        model_specs (list): paths to model files, each optionally prefixed with "name=" to
+                            name the model; a model is named by its file name otherwise
+        mmap (bool): whether to memory-map the arrays of compiled trees
+
+    Returns:
+        models (dict): the compiled trees, by name
+
+    Raises:
+        ValueError: if a model is not a single tree, such as an ensemble
+    """
+    models = {}
+    for model_spec in model_specs:
+        name, _, model_path = model_spec.rpartition('=')
+        if not name:
+            name = os.path.splitext(os.path.basename(model_path))[0]
+        model = load_model(model_path, mmap=mmap).compile()
+        if not isinstance(model, CompiledTree):
+            raise ValueError('%s is not a single tree; only single trees can be served' % model_path)
+        models[name] = model
+    return models
+
+
+def make_app(service):
+    """
+    The HTTP app of a prediction service: POST /predict takes a sample, or a list of samples,
+    GET /stats returns the service's report and GET /models the variants each model splits on
+    """
+    async def predict(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text=json.dumps({'message': 'request body is not JSON'}),
+                                     content_type='application/json')
+        samples = body if isinstance(body, list) else [body]
+        try:
+            results = await asyncio.gather(*[service.predict(sample) for sample in samples])
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=json.dumps({'message': str(e)}), content_type='application/json')
+        except Exception as e:
+            raise web.HTTPInternalServerError(text=json.dumps({'message': 'prediction failed: %r' % e}),
+                                              content_type='application/json')
+        return web.json_response(results if isinstance(body, list) else results[0])
+
+    async def get_stats(request):
+        return web.json_response(service.report())
+
+    async def get_models(request):
+        return web.json_response({name: {'variant_names': list(model.variant_names),
+                                         'ancestry_list': list(model.ancestry_list)}
+                                  for name, model in service.models.items()})
+
+    async def close_service(app):
+        await service.close()
+
+    app = web.Application(client_max_size=1 << 30)
+    app.add_routes([web.post('/predict', predict),
+                    web.get('/stats', get_stats),
+                    web.get('/models', get_models)])
+    app.on_cleanup.append(close_service)
+    return app
+
+
+async def answer_line(service, line, out):
+    """
+    Answers a line of the stdin protocol: a JSON sample, answered with its prediction, or
+    {"stats": true}, answered with the service's report. The "id" of the line, if any,
+    is echoed, as lines are answered as their predictions finish rather than in order.
+    Every line is answered, with an error if it could not be predicted.
+    """
+    sample = None
+    try:
+        sample = json.loads(line)
+        if isinstance(sample, dict) and sample.get('stats'):
+            answer = service.report()
+        else:
+            answer = await service.predict(sample)
+    except ValueError as e:
+        answer = {'error': str(e)}
+    except Exception as e:
+        answer = {'error': 'prediction failed: %r' % e}
+    if isinstance(sample, dict) and 'id' in sample:
+        answer['id'] = sample['id']
+    out.write(json.dumps(answer) + '\n')
+    out.flush()
+
+
+async def serve_lines(service, lines=None, out=None):
+    """
+    Answers JSON lines, one sample each, concurrently, so that the lines read together
+    are predicted in batches; the service's report is written to stderr at the end
+
+    Args:
+        service (PredictionService): the service to predict with
+        lines (file): the file to read lines from, stdin by default
+        out (file): the file to write the answers to, stdout by default
+    """
+    lines = sys.stdin if lines is None else lines
+    out = sys.stdout if out is None else out
+    loop = asyncio.get_running_loop()
+    pending = set()
+    try:
+        while True:
+            line = await loop.run_in_executor(None, lines.readline)
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(answer_line(service, line, out))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+    finally:
+        await service.close()
+    print(json.dumps(service.report()), file=sys.stderr)
+
+
+def serve_main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_files', nargs='+', help='paths to the model files to serve, each optionally as '
+                        'NAME=PATH; a model is named by its file name otherwise')
+    parser.add_argument('--host', help='host to listen on', type=str, default='localhost')
+    parser.add_argument('--port', help='port to listen on', type=int, default=8080)
+    parser.add_argument('--stdin', action='store_true', default=False,
+                        help='answer JSON lines read from stdin on stdout rather than HTTP requests')
+    parser.add_argument('--max-batch', help='most samples to predict in one batch', type=int, default=256)
+    parser.add_argument('--max-delay', help='most seconds a sample waits for others to join its batch',
+                        type=float, default=0.002)
+    parser.add_argument('--mmap', action='store_true', default=False,
+                        help='memory-map the arrays of the model files rather than reading them')
+    args = parser.parse_args()
+
+    service = PredictionService(load_models(args.model_files, mmap=args.mmap),
+                                max_batch=args.max_batch, max_delay=args.max_delay)
+    if args.stdin:
+        asyncio.run(serve_lines(service))
+    else:
+        web.run_app(make_app(service), host=args.host, port=args.port)
@@ -2,16 +2,33 @@ import argparse
 import pickle
 from .local_API import LOCAL_API
 from .candig_API import CanDIG_API
+from .CountCache import CountCache
+from .Profiler import Profiler
 from .ID3_Class import ID3
+from .ID3_Ensemble import ID3_Ensemble
 
 
-def train(use_local, config_path, verbose=True):
+def train(use_local, config_path, verbose=True, workers=1, parallel_depth=3, cache_dir=None, count_cache=None,
+          prune=False, profiler=None, compress=False, trees=1, variant_fraction=0.5, bootstrap=True, seed=None):
+    if workers > 1 and not use_local:
+        raise ValueError('workers are only supported with local VCF files')
+    if trees > 1 and not use_local:
+        raise ValueError('ensembles of trees are only supported with local VCF files')
     if use_local:
-        api = LOCAL_API(config_path, False)
+        api = LOCAL_API(config_path, False, cache_dir=cache_dir, profiler=profiler)
+        if trees > 1:
+            return ID3_Ensemble(api, n_trees=trees, bootstrap=bootstrap, variant_fraction=variant_fraction,
+                                workers=workers, seed=seed, prune=prune, verbose=verbose)
+        id3_tree = ID3(api, verbose, workers=workers, parallel_depth=parallel_depth, prune=prune)
     else:
-        api = CanDIG_API(config_path)
-
-    return ID3(api, verbose)
+        # closes the pooled connections to the server once the tree is built
+        with CanDIG_API(config_path, count_cache=count_cache, profiler=profiler, compress=compress) as api:
+            id3_tree = ID3(api, verbose, workers=workers, parallel_depth=parallel_depth, prune=prune)
+        if verbose:
+            print('count cache: %(hits)d hits, %(misses)d misses' % api.count_cache.stats())
+    if verbose and prune:
+        print('pruning: %(fetched)d of %(unpruned)d candidate counts fetched, %(avoided)d avoided' % id3_tree.pruning_summary())
+    return id3_tree
 
 
 def train_main():
@@ -22,12 +39,53 @@ def train_main():
     parser.add_argument('--use-candig-apis', action='store_true', default=False,
                         help='use remote API to access variant information rather than local VCF files')
 
+    parser.add_argument('--workers', help='number of processes to build subtrees, or the trees of an ensemble, in '
+                        'when using local VCF files',
+                        type=int, default=1)
+    parser.add_argument('--parallel-depth', help='depth of the tree below which subtrees are built in parallel',
+                        type=int, default=3)
+    parser.add_argument('--cache-dir', help='directory to cache the genotypes decoded from local VCF files in', type=str)
+    parser.add_argument('--count-cache', help='sqlite file to cache the counts fetched from the remote API in', type=str)
+    parser.add_argument('--prune', action='store_true', default=False,
+                        help='only fetch the counts of candidate variants whose information gain could be the best')
+    parser.add_argument('--compress', action='store_true', default=False,
+                        help='gzip the requests sent to the remote API, and ask for gzipped responses')
+    parser.add_argument('--format', help='compiled: only the arrays of the tree, which predict-id3 loads '
+                        'quickly; pickle: the whole trained ID3 object', choices=['compiled', 'pickle'], default='compiled')
+    parser.add_argument('--trees', help='train an ensemble of this many trees, which predicts by a majority vote',
+                        type=int, default=1)
+    parser.add_argument('--variant-fraction', help='fraction of the variants each tree of an ensemble may split on',
+                        type=float, default=0.5)
+    parser.add_argument('--no-bootstrap', action='store_true', default=False,
+                        help='train each tree of an ensemble on all the people, rather than a bootstrap sample')
+    parser.add_argument('--seed', help='seed of the samples and variants of the trees of an ensemble', type=int)
+    parser.add_argument('--profile', help='write the time spent in each stage of training and the requests sent '
+                        'to this JSON file', type=str)
+
     args = parser.parse_args()
     use_local_vcf_files = not args.use_candig_apis
     config_file_path = args.config_file
+    if args.workers > 1 and not use_local_vcf_files:
+        parser.error('--workers is only supported with local VCF files')
+    if args.trees > 1 and not use_local_vcf_files:
+        parser.error('--trees is only supported with local VCF files')
+    if args.trees > 1 and args.diagram:
+        parser.error('--diagram is not supported for an ensemble of trees')
+    if not 0 < args.variant_fraction <= 1:
+        parser.error('--variant-fraction must be in (0, 1]')
 
-    id3_tree = train(use_local_vcf_files, config_file_path)
+    count_cache = CountCache(path=args.count_cache) if args.count_cache else None
+    profiler = Profiler()
+    id3_tree = train(use_local_vcf_files, config_file_path, workers=args.workers, parallel_depth=args.parallel_depth,
+                     cache_dir=args.cache_dir, count_cache=count_cache, prune=args.prune, profiler=profiler,
+                     compress=args.compress, trees=args.trees, variant_fraction=args.variant_fraction,
+                     bootstrap=not args.no_bootstrap, seed=args.seed)
+    if args.profile:
+        profiler.write(args.profile)
 
-    pickle.dump(id3_tree, args.model_file)
+    if args.format == 'pickle':
+        pickle.dump(id3_tree, args.model_file)
+    else:
+        id3_tree.compile().save(args.model_file)
     if args.diagram:
         id3_tree.print_tree(args.diagram)
@@ -1,10 +1,120 @@
 import asyncio
+import gzip
 import json
-import requests
+import random
+import re
+import time
+import numpy
 import aiohttp
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from .AdaptiveLimiter import AdaptiveLimiter
+from .CountCache import CountCache
+from .Profiler import Profiler
+
+# answers which mean the server is overloaded, and the request is worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# answers to a compressed request which mean the server may not accept compressed bodies
+COMPRESSION_REFUSED_STATUSES = {400, 415}
+
+# responses at least this large are decoded partially even when orjson is installed
+PARTIAL_DECODE_MIN_BYTES = 4096
+
+# where the ancestry counts start in the body of a count response
+_ETHNICITY_FIELD = re.compile(rb'"ethnicity"\s*:\s*')
+_JSON_DECODER = json.JSONDecoder()
+
+
+class CanDIGAPIError(Exception):
+    """
+    Raised when the candig_server can not be reached, or answers a request with an error
+
+    Attributes:
+        status (int): the HTTP status of the last answer, or None if there was none
+        attempts (int): the number of times the request was sent
+    """
+    def __init__(self, message, status=None, attempts=1):
+        super().__init__(message)
+        self.status = status
+        self.attempts = attempts
+
+
+def json_dumps(obj):
+    """
+    Serializes an object to compact JSON bytes, with orjson if it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def json_loads(body):
+    """
+    Deserializes JSON bytes, with orjson if it is installed
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_results(body):
+    """
+    Decodes the body of a response, which must be an object with results
+
+    Raises:
+        ValueError: if the body is not JSON, or has no results
+    """
+    resp = json_loads(body)
+    if not isinstance(resp, dict) or 'results' not in resp:
+        raise ValueError('no results in %s' % body[:200])
+    return resp
+
+
+def decode_ethnicity(body):
+    """
+    Decodes only the ancestry counts of the body of a count response, found at
+    results.patients[0].ethnicity, rather than the whole response. Small responses,
+    which orjson decodes faster whole, and responses which the counts can not be
+    picked out of, are decoded whole.
+
+    Returns:
+        counts (dict): the ancestry counts; empty if the response has none
+    """
+    field = None
+    if orjson is None or len(body) >= PARTIAL_DECODE_MIN_BYTES:
+        field = _ETHNICITY_FIELD.search(body)
+    # the counts can only be picked out if no other field shares their name
+    if field is not None and body.find(b'"ethnicity"', field.end()) == -1:
+        ethnicity = _JSON_DECODER.raw_decode(body[field.end():].decode())[0]
+        if isinstance(ethnicity, dict):
+            return ethnicity
+
+    patients = decode_results(body)['results']['patients']
+    return patients[0].get('ethnicity', {}) if patients else {}
+
+
+async def gather_or_cancel(*coroutines):
+    """
+    Gathers coroutines like asyncio.gather, but cancels the rest as soon as one fails,
+    so that a failed request does not leave the others running
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 class CanDIG_API:
-    def __init__(self, file_path):
+    def __init__(self, file_path, connection_limit=100, keepalive_timeout=60, max_concurrency=None, count_cache=None,
+                 initial_concurrency=16, max_retries=5, retry_delay=0.1, max_retry_delay=10.0, request_timeout=60.0,
+                 window_size=1000000, page_size=10000, profiler=None, compress=False, compress_min_bytes=1024):
         """
         Initializes the CanDIG_API class
 
@@ -14,6 +124,26 @@ class CanDIG_API:
 
         Args:
             file_path (str): Path to json file that contains the variant ranges
+            connection_limit (int): the most connections to keep open to the server at once
+            keepalive_timeout (float): seconds to keep an idle connection open for reuse
+            max_concurrency (int): the most requests in flight at once, connection_limit if None
+            count_cache (CountCache): cache of the counts of split paths, which may be shared between
+                                      APIs; a new in memory cache if None
+            initial_concurrency (int): the requests in flight at once to start at, before adapting
+                                       to how the server copes
+            max_retries (int): the most times to retry a request the server was too overloaded to answer
+            retry_delay (float): seconds to wait, at most, before the first retry; the wait doubles
+                                 with every retry and is chosen at random up to that
+            max_retry_delay (float): the most seconds to wait before a retry
+            request_timeout (float): seconds to wait for an answer before retrying a request
+            window_size (int): the variant ranges are searched for variants in windows of this many
+                               positions, concurrently
+            page_size (int): the most variants to ask the server for in one search request
+            profiler (Profiler): records the requests sent and the time spent waiting for them;
+                                 a new one if None
+            compress (bool): whether to gzip request bodies and ask for gzipped responses; request
+                             bodies are sent uncompressed again if the server does not accept them
+            compress_min_bytes (int): the smallest request body worth compressing
 
         Attributes:
             config (json): loaded config file
@@ -24,20 +154,249 @@ class CanDIG_API:
                                           "CHROMOSOME_#:START_POS:END_POS" (TODO - UPDATE TO THIS)
             ancestry_list (list): A unique list of all the ancestries of people
             is_conf_matrix (bool): tells API to initialize the API for confusion matrix operations
-
-        TODO:
-            * Throw error when server gives incorrect response
+            loop (asyncio.AbstractEventLoop): event loop that every request runs on, created on first use
+            session (aiohttp.ClientSession): pooled session that every request is sent through
+            limiter (AdaptiveLimiter): bounds the number of requests in flight, adapting the bound
+                                       to how the server copes
+            count_cache (CountCache): cache that counts are looked up in before asking the server
+            components (dict): the request component of each variant, by variant name
+            component_json (dict): the serialized request component of each variant, by variant name
+            request_template (tuple): the serialized count request body, split around its logic
+                                      and its components
+            request_count (int): number of requests sent to the server
+            request_bytes (int): total size of the bodies of the requests sent to the server
+            retry_count (int): number of requests that were sent again
+            window_timings (list): per window searched for variants, in the order the searches
+                                   finished, its chromosome, start and end, the number of variants
+                                   and pages found in it and the seconds it took
+            profiler (Profiler): records the requests sent and the time spent waiting for them
+            compress_requests (bool): whether request bodies are compressed, until the server
+                                      turns down a compressed body
         """
         with open(file_path) as f:
             self.config = json.load(f)
         self.host_url = self.config['candig_server_url']
         self.dataset_id = self.config['candig_server_dataset_id']
-        self.variant_name_list = self.fetch_variants()
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.max_concurrency = max_concurrency or connection_limit
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.request_timeout = request_timeout
+        self.window_size = window_size
+        self.page_size = page_size
+        self.window_timings = []
+        self.loop = None
+        self.session = None
+        self.limiter = AdaptiveLimiter(initial_concurrency, max_limit=self.max_concurrency)
+        self.count_cache = CountCache() if count_cache is None else count_cache
+        self.request_count = 0
+        self.request_bytes = 0
+        self.retry_count = 0
+        self.profiler = Profiler() if profiler is None else profiler
+        self.compress = compress
+        self.compress_requests = compress
+        self.compress_min_bytes = compress_min_bytes
+        try:
+            with self.profiler.stage('variant_discovery'):
+                self.variant_name_list = self.fetch_variants()
+        except BaseException:
+            self.close()
+            raise
         self.ancestry_list = []
+        self.prepare_requests()
 
         # updates variables
         #self.read_user_mappings(variant_dict)
 
+    def __getstate__(self):
+        # the event loop and the session can not be pickled; they are recreated on first use
+        state = self.__dict__.copy()
+        state['loop'] = None
+        state['session'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine to completion on the event loop of the API, creating the
+        loop if it does not exist yet
+        """
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(coroutine)
+
+    async def get_session(self):
+        """
+        Returns the pooled session of the API, opening it on first use so that
+        connections are kept alive and reused across nodes
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout)
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    def close(self):
+        """
+        Closes the pooled session and the event loop of the API, and writes any new
+        counts to the persistent count cache. The API can still be used afterwards,
+        at the cost of opening new ones.
+        """
+        self.count_cache.close()
+        if self.loop is None or self.loop.is_closed():
+            return
+        if self.session is not None and not self.session.closed:
+            self.loop.run_until_complete(self.session.close())
+            # lets the connector finish closing its transports
+            self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        self.session = None
+        self.limiter.condition = None
+
+    async def post(self, endpoint, req_body, session=None, decode=None):
+        """
+        Posts a request body to an endpoint of the server through the pooled session.
+        Requests the server is too overloaded to answer, or which time out, are retried
+        with a growing, jittered delay.
+
+        Args:
+            endpoint (str): the endpoint of the server, such as 'count' or 'search'
+            req_body (dict or bytes): the request body, or the request body already serialized
+            session (aiohttp.ClientSession): the session to send the request through,
+                                             the pooled session if None
+
+            decode (callable): decodes the body of the response, raising ValueError, or the
+                               error of a missing key or wrong type, if it can not;
+                               decode_results if None
+
+        Returns:
+            (dict): the decoded JSON response, or what decode returns
+
+        Raises:
+            CanDIGAPIError: if the server answers with an error, or is still overloaded
+                            after max_retries retries
+        """
+        if not isinstance(req_body, bytes):
+            req_body = json_dumps(req_body)
+        if session is None:
+            session = await self.get_session()
+        if decode is None:
+            decode = decode_results
+        url = '%s%s' % (self.host_url, endpoint)
+
+        for attempt in range(1, self.max_retries + 2):
+            body, headers = self.encode_body(req_body)
+            self.request_count += 1
+            self.request_bytes += len(body)
+            self.profiler.count('requests')
+            self.profiler.count('bytes_sent', len(body))
+            retry_after = None
+            succeeded = overloaded = refused = False
+
+            started = await self.limiter.acquire()
+            sent = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=headers) as response:
+                    if response.status in COMPRESSION_REFUSED_STATUSES and 'Content-Encoding' in headers:
+                        # the server may not accept compressed bodies; the request is sent again uncompressed
+                        self.compress_requests = False
+                        refused = True
+                        error = CanDIGAPIError('%s does not accept compressed requests' % url, response.status, attempt)
+                    elif response.status in RETRY_STATUSES:
+                        overloaded = True
+                        retry_after = response.headers.get('Retry-After')
+                        error = CanDIGAPIError('%s answered %d' % (url, response.status), response.status, attempt)
+                    elif response.status >= 400:
+                        raise CanDIGAPIError('%s answered %d: %s' % (url, response.status, (await response.text())[:200]),
+                                             response.status, attempt)
+                    else:
+                        resp_body = await response.read()
+                        # as sent, if the server says, rather than as decompressed
+                        self.profiler.count('bytes_received', response.content_length or len(resp_body))
+                        try:
+                            resp = decode(resp_body)
+                        except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+                            # not JSON, or not shaped as the endpoint answers
+                            raise CanDIGAPIError('%s did not answer with JSON results on attempt %d: %r'
+                                                 % (url, attempt, e), None, attempt)
+                        succeeded = True
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                overloaded = True
+                error = CanDIGAPIError('%s could not be reached: %r' % (url, e), None, attempt)
+            finally:
+                await self.limiter.release(started, succeeded, overloaded)
+                # concurrent requests overlap, so their latencies add up to more than the wall time
+                self.profiler.add_time('request_latency', time.perf_counter() - sent)
+
+            if succeeded:
+                return resp
+            if refused:
+                continue
+
+            if attempt <= self.max_retries:
+                self.retry_count += 1
+                self.profiler.count('retries')
+                await asyncio.sleep(self.backoff_delay(attempt, retry_after))
+
+        raise CanDIGAPIError('%s gave up after %d attempts: %s' % (url, error.attempts, error), error.status,
+                             error.attempts)
+
+    def encode_body(self, req_body):
+        """
+        Compresses a request body if compression is on and the body is large enough to be worth it
+
+        Returns:
+            body (bytes): the body to send
+            headers (dict): the headers to send it with
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            headers['Accept-Encoding'] = 'gzip'
+        if self.compress_requests and len(req_body) >= self.compress_min_bytes:
+            headers['Content-Encoding'] = 'gzip'
+            return gzip.compress(req_body, compresslevel=1), headers
+        return req_body, headers
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        Chooses how long to wait before retrying a request, at random up to a bound which
+        doubles with every attempt, and for at least as long as the server asked
+
+        Args:
+            attempt (int): the number of times the request has been sent
+            retry_after (str): the Retry-After header of the server's answer, if any
+
+        Returns:
+            (float): seconds to wait
+        """
+        delay = random.uniform(0, min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay))
+        try:
+            return max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            return delay
+
+    def request_stats(self):
+        """
+        Returns:
+            (dict): the number of requests sent to the server, the total size of their
+                    bodies in bytes and their mean size, how many of them were retries,
+                    and the current limit of requests in flight
+        """
+        return {
+            'requests': self.request_count,
+            'bytes': self.request_bytes,
+            'mean_bytes': self.request_bytes / self.request_count if self.request_count else 0.0,
+            'retries': self.retry_count,
+            'concurrency': int(self.limiter.limit)
+        }
+
     @staticmethod
     def create_split_path(split_path, new_variant_name):
         """
@@ -67,10 +426,29 @@ class CanDIG_API:
         return w_split_path, wo_split_path
 
     def fetch_variants(self):
-        variant_list = []
+        """
+        Finds the variants within the variant ranges of the config file, searching windows
+        of the ranges concurrently
+
+        Returns:
+            variant_name_list (list): the de-duplicated variant names, in the order of the
+                                      variant ranges and then of the position of the variants
+        """
+        windows = []
         for var_range in self.config['variant_ranges']:
-            variant_list.extend(self.query_variants(str(var_range['chr']), str(var_range['start']), str(var_range['end'])))
-        return variant_list
+            chrom, start, end = str(var_range['chr']), int(var_range['start']), int(var_range['end'])
+            # a range of one base, whose start and end may be equal, still gets a window
+            end = max(end, start + 1)
+            windows.extend((chrom, window_start, min(window_start + self.window_size, end))
+                           for window_start in range(start, end, self.window_size))
+        return self.run(self.async_fetch_variants(windows))
+
+    async def async_fetch_variants(self, windows):
+        session = await self.get_session()
+        window_variants = await gather_or_cancel(*[self.query_window(chrom, start, end, session)
+                                                   for chrom, start, end in windows])
+        # a variant overlapping two windows may be found in both
+        return list(dict.fromkeys(variant for variants in window_variants for variant in variants))
 
     def query_variants(self, chrom, start, end):
         """
@@ -84,30 +462,134 @@ class CanDIG_API:
             end (str): ending position of variant
 
         Returns: 
-            variant_name_list (list): list of variant names formatted in the for of `CHR:POS`
+            variant_name_list (list): list of variant names formatted in the for of `CHR:START:END`,
+                                      ordered by position
         """
+        return self.run(self.query_window(str(chrom), int(start), int(end)))
+
+    async def query_window(self, chrom, start, end, session=None):
+        """
+        Searches a window of a chromosome for variants, a page at a time, and records how long it took
+
+        Args:
+            chrom (str): chromosome number
+            start (int): starting position of the window
+            end (int): ending position of the window
+            session (aiohttp.ClientSession): the session to search in, the pooled session if None
+
+        Returns:
+            variant_name_list (list): the de-duplicated variant names in the window, ordered by position
+        """
+        started = time.perf_counter()
         req_body = {
             'datasetId' : self.dataset_id,
             'logic': {'id': 'A'},
             'components': [{'id': 'A', 'patients': {}}],
             'results': [{
-                'start': start,
-                'end': end,
+                'start': str(start),
+                'end': str(end),
                 'referenceName': chrom,
                 'table': 'variants',
                 'fields': [
                     'start',
                     'end'
                 ]
-            }]
+            }],
+            'page_size': self.page_size
         }
-        r = requests.post('%s%s' %  (self.host_url, 'search'), json=req_body).json()
-        if 'results' in r:
-            # use set reduction to deduplicate results
-            variant_set = {':'.join([chrom, variant['start'], variant['end']]) 
-                           for variant in  r['results']['variants'] }
-        return list(variant_set)
 
+        positions = set()
+        pages = 0
+        while True:
+            r = await self.post('search', req_body, session)
+            pages += 1
+            positions.update((int(variant['start']), int(variant['end'])) for variant in r['results'].get('variants', []))
+            page_token = r.get('next_page_token') or r.get('nextPageToken')
+            if not page_token:
+                break
+            req_body['page_token'] = page_token
+
+        variant_names = [':'.join([chrom, str(variant_start), str(variant_end)])
+                         for variant_start, variant_end in sorted(positions)]
+        self.window_timings.append({
+            'chr': chrom,
+            'start': start,
+            'end': end,
+            'variants': len(variant_names),
+            'pages': pages,
+            'seconds': time.perf_counter() - started
+        })
+        return variant_names
+
+    def prepare_requests(self):
+        """
+        Builds the request component of every variant, and the parts of the count
+        request body which are the same for every split path, once, so that crafting
+        a request only puts together the components its logic refers to
+        """
+        self.components = {}
+        for variant_id in self.variant_name_list:
+            CHR, START, END = variant_id.split(':')
+            self.components[variant_id] = {
+                "id": variant_id,
+                "variants": {
+                    "start": START,
+                    "end": END,
+                    "referenceName": CHR,
+                }
+            }
+        self.component_json = {variant_id: json_dumps(component)
+                               for variant_id, component in self.components.items()}
+
+        # the body of every count request, serialized around its logic and its components
+        template = json_dumps({
+            'logic': '<logic>',
+            'components': ['<components>'],
+            'dataset_id': self.dataset_id,
+            'results': [{'table': 'patients', 'fields': ['ethnicity']}],
+            'page_size': 10000000
+        })
+        prefix, template = template.split(b'"<logic>"', 1)
+        middle, suffix = template.split(b'"<components>"', 1)
+        self.request_template = (prefix, middle, suffix)
+
+    def craft_api_logic(self, split_path):
+        """
+        Crafts the logic of a count request, which a person satisfies if they have every
+        variant split on with and none of those split on without
+        """
+        logic = { 'and':
+            [
+                { 'and': [] },
+                { 'and': [] }
+            ]
+        }
+
+        for variant, direction in zip(split_path[0], split_path[1]):
+            if direction:
+                logic['and'][0]['and'].append({"id": variant})
+            else:
+                logic['and'][1]['and'].append({"id": variant, "negate": True})
+
+        # Finds index with empty list and removes it
+        if logic['and'][1]['and'] == []:
+            del logic['and'][1]
+        if logic['and'][0]['and'] == []:
+            del logic['and'][0]
+        return logic
+
+    def encode_api_request(self, split_path=([], [])):
+        """
+        Serializes the request body crafted by craft_api_request, reusing the serialized
+        components and request template
+
+        Returns:
+            req_body (bytes): the serialized request body
+        """
+        prefix, middle, suffix = self.request_template
+        logic = json_dumps(self.craft_api_logic(split_path))
+        components = b','.join(self.component_json[variant] for variant in dict.fromkeys(split_path[0]))
+        return b''.join((prefix, logic, middle, components, suffix))
 
     def craft_api_request(self, split_path=([], [])):
         """
@@ -127,37 +609,9 @@ class CanDIG_API:
         Returns:
             req_body (json): Returns a JSON containing the request body
         """
-        components = []
-        logic = { 'and': 
-            [ 
-                { 'or': [] },
-                { 'and': [] }
-            ] 
-        }
-
-        for variant_id in self.variant_name_list:
-            CHR, START, END = variant_id.split(':')
-            components.append(
-                {
-                    "id": variant_id,
-                    "variants":{
-                        "start": START,
-                        "end": END,
-                        "referenceName": CHR,
-                    }
-                })
-
-        for variant, direction in zip(split_path[0], split_path[1]):
-            if direction:
-                logic['and'][0]['or'].append({"id": variant})
-            else:
-                logic['and'][1]['and'].append({"id": variant, "negate": True})
-
-        # Finds index with empty list and removes it
-        if logic['and'][1]['and'] == []:
-            del logic['and'][1]
-        if logic['and'][0]['or'] == []:
-            del logic['and'][0]
+        logic = self.craft_api_logic(split_path)
+        # only the variants the logic refers to are needed
+        components = [self.components[variant] for variant in dict.fromkeys(split_path[0])]
 
         # puts the request together into a form digestable by the API
         req_body = {}
@@ -201,7 +655,12 @@ class CanDIG_API:
             ],
             'page_size': 10000000
         }
-        ancestry_counts = requests.post('%s%s' % (self.host_url, 'count'), json=req).json()['results']['patients'][0]['ethnicity']
+        # every person is in the subset of the empty split path
+        key = self.count_cache.make_key(self.host_url, self.dataset_id, ([], []))
+        ancestry_counts = self.count_cache.get(key)
+        if ancestry_counts is None:
+            ancestry_counts = self.run(self.post('count', req, decode=decode_ethnicity))
+            self.count_cache.put(key, ancestry_counts)
         if self.ancestry_list == []:
             self.ancestry_list = list(ancestry_counts.keys())
         return ancestry_counts
@@ -227,69 +686,103 @@ class CanDIG_API:
         """
         w_variant_split_path, wo_variant_split_path = CanDIG_API.create_split_path(node.split_path, split_var)
 
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                self.fetch_count(session, '+', w_variant_split_path),
-                self.fetch_count(session, '-', wo_variant_split_path)
-            ]
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            if '+' in responses[0]:
-                r_w_var = responses[0]['+']
-                r_wo_var = responses[1]['-']
-            else:
-                r_wo_var = responses[0]['-']
-                r_w_var = responses[1]['+']
+        session = await self.get_session()
+        tasks = [
+            self.fetch_count(session, '+', w_variant_split_path),
+            self.fetch_count(session, '-', wo_variant_split_path)
+        ]
+        responses = await gather_or_cancel(*tasks)
+        if '+' in responses[0]:
+            r_w_var = responses[0]['+']
+            r_wo_var = responses[1]['-']
+        else:
+            r_wo_var = responses[0]['-']
+            r_w_var = responses[1]['+']
 
         return r_w_var, r_wo_var
 
     def split_subset(self, node, split_var):
-        return asyncio.run(self.async_split_subset(node, split_var))
+        with self.profiler.stage('split_queries'):
+            return self.run(self.async_split_subset(node, split_var))
+
+    def get_target_samples(self):
+        """
+        The samples of a node live on the server and are selected by its split path,
+        so there is no sample set to carry down the tree
+        """
+        return None
+
+    def split_samples(self, node, split_var):
+        """
+        The samples of a node live on the server and are selected by its split path,
+        so there is no sample set to partition
+        """
+        return None, None
 
     async def fetch_count(self, session, var, split_path):
         """
         Asynchronously fetches counts consistent with split path
         from the API.  Labels the return value with a label
-        (which is typically a variant)
+        (which is typically a variant). Counts already in the count cache
+        are not fetched again.
         """
-        url = f"{self.host_url}count"
-        req_body = self.craft_api_request(split_path)
-        async with session.post(url, json=req_body) as response:
-            resp = await response.json()
-            variant_counts = resp['results']['patients'][0]['ethnicity'] if 'ethnicity' in resp['results']['patients'][0] else {}
-            return {var: variant_counts}
+        key = self.count_cache.make_key(self.host_url, self.dataset_id, split_path)
+        variant_counts = self.count_cache.get(key)
+        if variant_counts is None:
+            req_body = self.encode_api_request(split_path)
+            variant_counts = await self.post('count', req_body, session, decode=decode_ethnicity)
+            self.count_cache.put(key, variant_counts)
+        return {var: variant_counts}
 
 
-    async def fetch_all_counts(self, split_path):
+    async def fetch_all_counts(self, split_path, session=None, candidates=None):
         """
-        Fetches all the counts given all of the possible split variants
+        Fetches all the counts given all of the possible split variants,
+        in the given session or in the pooled one. If candidates are given,
+        only the counts of those variants are fetched, the others being empty.
         """
+        if session is None:
+            session = await self.get_session()
+        if candidates is not None:
+            candidates = {self.variant_name_list[idx] for idx in candidates}
+
         null_responses = []
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-
-            for var in self.variant_name_list:
-                if var in split_path[0]:
-                    null_responses.append({var:{}})
-                    continue
-
-                local_split_path = (split_path[0] + [var], split_path[1] + [1])
-                tasks.append(
-                    self.fetch_count(session, var, local_split_path)
-                )
-
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            alldict = {}
-            for item in null_responses + responses:
-                for k, v in item.items():
-                    alldict[k] = v
-            
-            w_variant_list = []
-            for var in self.variant_name_list:
-                w_variant_list.append(alldict[var])
+        tasks = []
+
+        for var in self.variant_name_list:
+            if var in split_path[0] or (candidates is not None and var not in candidates):
+                null_responses.append({var:{}})
+                continue
+
+            local_split_path = (split_path[0] + [var], split_path[1] + [1])
+            tasks.append(
+                self.fetch_count(session, var, local_split_path)
+            )
+
+        responses = await gather_or_cancel(*tasks)
+        alldict = {}
+        for item in null_responses + responses:
+            for k, v in item.items():
+                alldict[k] = v
+
+        w_variant_list = []
+        for var in self.variant_name_list:
+            w_variant_list.append(alldict[var])
 
         return w_variant_list
 
-    def find_next_variant_counts(self, split_path):
+    async def fetch_all_counts_batch(self, split_paths, candidates_list=None):
+        """
+        Fetches all the counts given all of the possible split variants for a batch
+        of split paths, firing the requests of every split path concurrently
+        """
+        if candidates_list is None:
+            candidates_list = [None] * len(split_paths)
+        session = await self.get_session()
+        return await gather_or_cancel(*[self.fetch_all_counts(split_path, session, candidates)
+                                        for split_path, candidates in zip(split_paths, candidates_list)])
+
+    def find_next_variant_counts(self, split_path, samples=None):
         """
         Finds the counts of the a potential next variant to perform the
         split on
@@ -301,6 +794,7 @@ class CanDIG_API:
                 of the split. The direction of the second list is depicted by 1's
                 and 0's. Where 1 is splitting in the direction with the variant
                 and 0 is splitting in the direction without the variant.
+            samples (None): unused, as the server selects samples by the split path
         Returns:
             w_variant_list: 
                 A list representing of a dictionary of ancestry counts per variant
@@ -311,9 +805,69 @@ class CanDIG_API:
                     .
                 ]
         """
-        ancestry_counts = asyncio.run(self.fetch_all_counts(split_path))
+        ancestry_counts = self.run(self.fetch_all_counts(split_path))
         for count in ancestry_counts:
             for anc in self.ancestry_list:
                 if anc not in count.keys():
                     count[anc] = 0
         return ancestry_counts
+
+    def find_next_variant_count_matrix(self, split_path, samples=None, candidates=None):
+        """
+        Finds the counts of the potential next variants to perform the split on,
+        as a matrix rather than a list of dictionaries
+
+        Attributes:
+            split_path (list1, list2): 
+                This is the paths of the splits before the current split. The first list
+                is the list of variant names and the second list is the direction
+                of the split. The direction of the second list is depicted by 1's
+                and 0's. Where 1 is splitting in the direction with the variant
+                and 0 is splitting in the direction without the variant.
+            samples (None): unused, as the server selects samples by the split path
+            candidates (numpy.ndarray): the indices of the variants to fetch, or None for every variant
+        Returns:
+            counts (numpy.ndarray): a (variants x ancestries) matrix of the counts of
+                people with each variant, the ancestries being ordered as in ancestry_list;
+                0 for the variants which are not candidates
+        """
+        self.profiler.count('count_queries')
+        with self.profiler.stage('count_queries'):
+            return self.count_matrix(self.run(self.fetch_all_counts(split_path, candidates=candidates)))
+
+    def find_next_variant_count_matrices(self, split_paths, samples_list=None, candidates_list=None):
+        """
+        Finds the count matrices of the potential next variants for a batch of nodes,
+        querying the server for every node at once
+
+        Attributes:
+            split_paths (list): the split paths of the nodes
+            samples_list (None): unused, as the server selects samples by the split path
+            candidates_list (list): the indices of the variants to fetch for each node, or None
+        Returns:
+            count_matrices (list): a count matrix, as from find_next_variant_count_matrix, per node
+        """
+        if not split_paths:
+            return []
+        return self.run(self.async_find_next_variant_count_matrices(split_paths, samples_list, candidates_list))
+
+    async def async_find_next_variant_count_matrices(self, split_paths, samples_list=None, candidates_list=None):
+        """
+        Finds the count matrices of the potential next variants for a batch of nodes, as
+        find_next_variant_count_matrices does, on the running event loop of the API
+        """
+        if not split_paths:
+            return []
+        self.profiler.count('count_queries', len(split_paths))
+        with self.profiler.stage('count_queries'):
+            return [self.count_matrix(ancestry_counts)
+                    for ancestry_counts in await self.fetch_all_counts_batch(split_paths, candidates_list)]
+
+    def count_matrix(self, ancestry_counts):
+        """
+        Converts a list of dictionaries of ancestry counts per variant into a
+        (variants x ancestries) matrix, the ancestries being ordered as in ancestry_list
+        """
+        # counts are kept in the type the server sends, as noisy counts need not be integers
+        counts = numpy.array([[count.get(anc, 0) for anc in self.ancestry_list] for count in ancestry_counts])
+        return counts.reshape(len(ancestry_counts), len(self.ancestry_list))
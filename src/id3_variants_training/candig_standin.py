@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import threading
+import numpy
+from aiohttp import web
+from .local_API import LOCAL_API
+
+# the smallest response body worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+class CanDIG_StandIn:
+
+    def __init__(self, api, latency=0.0, jitter=0.0, error_rate=0.0, epsilon=None, seed=None, capacity=None,
+                 compress=False):
+        """
+        A lightweight stand-in for the candig_server, answering the `search` and `count`
+        requests that CanDIG_API sends from the data a LOCAL_API has loaded, so that
+        remote training can be run and measured without a real server
+
+        Args:
+            api (LOCAL_API): the genotypes and ancestries to answer from
+            latency (float): seconds to wait before answering each request
+            jitter (float): up to this many more seconds, chosen at random, to wait before answering
+            error_rate (float): the chance that a request is answered with a server error
+            epsilon (float): if given, Laplace noise of scale 1/epsilon is added to every count
+            seed (int): seed of the random latencies, errors and noise
+            capacity (int): if given, requests beyond this many in flight are refused as too many
+            compress (bool): whether to accept gzipped request bodies and gzip responses for clients
+                             which accept them; gzipped requests are refused as unsupported otherwise
+
+        Attributes:
+            genotypes (numpy.ndarray): A (people x variants) boolean matrix, stored column by column
+            popu_idx (numpy.ndarray): The ancestry of each person, coded as an index into ancestry_list
+            ancestry_list (list): A unique list of all the ancestries of people
+            variant_positions (dict): per chromosome, the sorted start positions of its variants
+                                      and their columns in genotypes
+            stats (dict): the number of requests answered, the bytes received as sent, the errors
+                          injected and the requests refused for being over capacity
+            in_flight (int): the number of requests being answered
+        """
+        self.genotypes = numpy.asfortranarray(numpy.asarray(api.genotype_matrix) == 1)
+        self.popu_idx = numpy.asarray(api.popu_idx)
+        self.ancestry_list = list(api.ancestry_list)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.epsilon = epsilon
+        self.capacity = capacity
+        self.compress = compress
+        self.in_flight = 0
+        self.rng = numpy.random.default_rng(seed)
+
+        chromosomes = {}
+        for column, variant_name in enumerate(api.variant_name_list):
+            chrom, start, end = variant_name.split(':')
+            chromosomes.setdefault(chrom, []).append((int(start), int(end), column))
+        self.variant_positions = {}
+        for chrom, variants in chromosomes.items():
+            variants.sort()
+            self.variant_positions[chrom] = (numpy.array([variant[0] for variant in variants]),
+                                             numpy.array([variant[1] for variant in variants]),
+                                             numpy.array([variant[2] for variant in variants], dtype=numpy.intp))
+
+        self.stats = {'search': 0, 'count': 0, 'bytes': 0, 'errors': 0, 'refused': 0}
+        self.runner = None
+        self.loop = None
+        self.thread = None
+
+    def find_columns(self, chrom, start, end):
+        """
+        Finds the columns of the variants of a chromosome which start within [start, end)
+
+        Returns:
+            columns (numpy.ndarray): the columns, ordered by the start of the variant
+        """
+        if chrom not in self.variant_positions:
+            return numpy.zeros(0, dtype=numpy.intp)
+        starts, _, columns = self.variant_positions[chrom]
+        first, last = numpy.searchsorted(starts, [int(start), int(end)])
+        return columns[first:last]
+
+    def component_mask(self, component):
+        """
+        Finds the people which a component of a request selects: everyone for a patients
+        component, and everyone with any of the variants in its range for a variants component
+        """
+        if 'variants' not in component:
+            return numpy.ones(len(self.genotypes), dtype=bool)
+        variant = component['variants']
+        columns = self.find_columns(str(variant['referenceName']), variant['start'], variant['end'])
+        if len(columns) == 1:
+            return self.genotypes[:, columns[0]].copy()
+        return self.genotypes[:, columns].any(axis=1)
+
+    def logic_mask(self, logic, components):
+        """
+        Evaluates the logic of a request, made of component ids joined by 'and' and 'or'
+        groups, any of which may be negated
+
+        Args:
+            logic (dict): the logic of the request
+            components (dict): the components of the request, by id
+
+        Returns:
+            mask (numpy.ndarray): the people that satisfy the logic
+        """
+        if 'id' in logic:
+            mask = self.component_mask(components[logic['id']])
+        elif 'and' in logic:
+            mask = numpy.ones(len(self.genotypes), dtype=bool)
+            for term in logic['and']:
+                mask &= self.logic_mask(term, components)
+        elif 'or' in logic:
+            mask = numpy.zeros(len(self.genotypes), dtype=bool)
+            for term in logic['or']:
+                mask |= self.logic_mask(term, components)
+        else:
+            raise web.HTTPBadRequest(text='logic must have an id, an and or an or')
+
+        if logic.get('negate'):
+            mask = ~mask
+        return mask
+
+    def noisy_counts(self, counts):
+        """
+        Adds Laplace noise to the counts if epsilon is set, keeping them non-negative
+        """
+        if self.epsilon is None:
+            return counts
+        return numpy.maximum(counts + self.rng.laplace(0, 1 / self.epsilon, len(counts)), 0)
+
+    async def respond(self, request):
+        """
+        Reads a request body, waiting the injected latency and injecting errors, and
+        refusing the request if the server is over capacity
+
+        Returns:
+            req_body (dict): the decoded request body
+        """
+        body = await request.read()
+        self.stats['bytes'] += request.content_length or len(body)
+        if request.headers.get('Content-Encoding') and not self.compress:
+            raise web.HTTPUnsupportedMediaType(text=json.dumps({'message': 'compressed requests are not supported'}),
+                                               content_type='application/json')
+        if self.capacity is not None and self.in_flight >= self.capacity:
+            self.stats['refused'] += 1
+            raise web.HTTPTooManyRequests(text=json.dumps({'message': 'over capacity'}),
+                                          content_type='application/json')
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        self.in_flight += 1
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            raise web.HTTPServiceUnavailable(text=json.dumps({'message': 'injected error'}),
+                                             content_type='application/json')
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise web.HTTPBadRequest(text='request body is not JSON')
+
+    async def count(self, request):
+        """
+        Answers a count request with the number of people of each ancestry who satisfy its logic
+        """
+        req_body = await self.respond(request)
+        self.stats['count'] += 1
+        components = {component['id']: component for component in req_body['components']}
+        mask = self.logic_mask(req_body['logic'], components)
+        counts = self.noisy_counts(numpy.bincount(self.popu_idx[mask], minlength=len(self.ancestry_list)))
+
+        ethnicity = {ancestry: count for ancestry, count in zip(self.ancestry_list, counts.tolist()) if count > 0}
+        patients = {'ethnicity': ethnicity} if ethnicity else {}
+        return self.json_response({'results': {'patients': [patients]}})
+
+    async def search(self, request):
+        """
+        Answers a search of the variants table with the start and end of the variants in its
+        range, a page at a time if it gives a page size
+        """
+        req_body = await self.respond(request)
+        self.stats['search'] += 1
+        result = req_body['results'][0]
+        if result.get('table') != 'variants':
+            raise web.HTTPBadRequest(text='only the variants table can be searched')
+
+        chrom = str(result['referenceName'])
+        variants = []
+        if chrom in self.variant_positions:
+            starts, ends, _ = self.variant_positions[chrom]
+            first, last = numpy.searchsorted(starts, [int(result['start']), int(result['end'])])
+            variants = [{'start': str(start), 'end': str(end)}
+                        for start, end in zip(starts[first:last].tolist(), ends[first:last].tolist())]
+
+        response = {'results': {'variants': variants}}
+        page_size = req_body.get('page_size')
+        if page_size:
+            offset = int(req_body.get('page_token') or 0)
+            response['results']['variants'] = variants[offset:offset + int(page_size)]
+            if offset + int(page_size) < len(variants):
+                response['next_page_token'] = str(offset + int(page_size))
+        return self.json_response(response)
+
+    def json_response(self, body):
+        response = web.json_response(body)
+        # small bodies are not worth the time to compress them, and may even grow
+        if self.compress and len(response.body) >= COMPRESS_MIN_BYTES:
+            response.enable_compression()
+        return response
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def make_app(self):
+        app = web.Application(client_max_size=1 << 30)
+        app.add_routes([web.post('/count', self.count),
+                        web.post('/search', self.search),
+                        web.get('/stats', self.get_stats)])
+        return app
+
+    def start(self, host='localhost', port=0):
+        """
+        Starts serving in a background thread
+
+        Args:
+            host (str): the host to listen on
+            port (int): the port to listen on, any free port if 0
+
+        Returns:
+            url (str): the url of the server, as the candig_server_url of a config file
+        """
+        self.loop = asyncio.new_event_loop()
+        self.runner = web.AppRunner(self.make_app())
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, host, port)
+        self.loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        return 'http://%s:%d/' % (host, port)
+
+    def stop(self):
+        """
+        Stops serving in the background thread
+        """
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def standin_main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_path', help='path to the config file that contains vcf file paths')
+    parser.add_argument('--host', help='host to listen on', type=str, default='localhost')
+    parser.add_argument('--port', help='port to listen on', type=int, default=3000)
+    parser.add_argument('--latency', help='seconds to wait before answering each request', type=float, default=0.0)
+    parser.add_argument('--jitter', help='up to this many more seconds, at random, to wait before answering',
+                        type=float, default=0.0)
+    parser.add_argument('--error-rate', help='chance that a request is answered with a server error',
+                        type=float, default=0.0)
+    parser.add_argument('--epsilon', help='add Laplace noise of scale 1/EPSILON to every count', type=float)
+    parser.add_argument('--seed', help='seed of the random latencies, errors and noise', type=int)
+    parser.add_argument('--capacity', help='refuse requests beyond this many in flight', type=int)
+    parser.add_argument('--compress', help='accept gzipped requests and gzip responses', action='store_true')
+    parser.add_argument('--cache-dir', help='directory to cache the genotypes decoded from VCF files in', type=str)
+    args = parser.parse_args()
+
+    api = LOCAL_API(args.config_path, cache_dir=args.cache_dir)
+    server = CanDIG_StandIn(api, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            epsilon=args.epsilon, seed=args.seed, capacity=args.capacity, compress=args.compress)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    standin_main()
@@ -1,9 +1,149 @@
+import os
+import re
 import vcf
 import json
+import pysam
+import shutil
+import hashlib
+import tempfile
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from .Profiler import Profiler
+
+# genotypes which are treated as the variant not existing in a person
+NO_VARIANT_GTS = frozenset(['0/0', '0|0', '.'])
+
+# environment variable naming the genotype cache directory, if the config does not
+GENOTYPE_CACHE_ENV = 'ID3_GENOTYPE_CACHE'
+# bump whenever the layout or meaning of the cached files changes
+GENOTYPE_CACHE_VERSION = 1
+
+_ZERO, _SLASH, _PIPE, _TAB = b'0/|\t'
+# positions closer together than this are fetched by one tabix query, as a query decompresses
+# at least a block of the file, which holds the variants of many positions
+TARGETED_QUERY_GAP = 16384
+# columns are separated by tabs, or by runs of spaces, as PyVCF accepts
+_COLUMN_SEPARATOR = re.compile('\t| +')
+
+
+def parse_gt_calls(fmt, samples, n_samples):
+    """
+    Parses the sample columns of a VCF line, reading only the GT field
+
+    Args:
+        fmt (str): the FORMAT column of the line
+        samples (str): the sample columns of the line, still tab separated
+        n_samples (int): the number of samples in the file
+
+    Returns:
+        row (numpy.ndarray): uint8 array which is 1 where the variant exists in the sample
+    """
+    if fmt == 'GT' and len(samples) == 4 * n_samples - 1:
+        # every call is a three character diploid genotype, so the line is fixed width
+        calls = numpy.frombuffer(samples.encode() + b'\t', dtype=numpy.uint8).reshape(n_samples, 4)
+        if (calls[:, 3] == _TAB).all():
+            no_variant = (calls[:, 0] == _ZERO) & (calls[:, 2] == _ZERO) & \
+                         ((calls[:, 1] == _SLASH) | (calls[:, 1] == _PIPE))
+            return (~no_variant).view(numpy.uint8)
+
+    calls = samples.split('\t')
+    if fmt == 'GT':
+        gts = calls
+    else:
+        gt_idx = fmt.split(':').index('GT')
+        gts = [call.split(':')[gt_idx] if call.count(':') >= gt_idx else None for call in calls]
+    return numpy.fromiter((gt not in NO_VARIANT_GTS for gt in gts), dtype=numpy.uint8, count=n_samples)
+
+
+def fetch_region_genotypes(vcf_path, chrom, start, end, positions=None):
+    """
+    Fetches the genotypes of a region of a tabix indexed VCF file, reading only the GT
+    field of each line rather than parsing full records
+
+    Args:
+        vcf_path (str): path to the VCF file
+        chrom (str): chromosome of the region
+        start (int): zero-based start of the region
+        end (int): end of the region, exclusive
+        positions (iterable): if given, only the variants of the region at these one-based
+                              positions are fetched, each by its own tabix query, so that
+                              the rest of the region is never read
+
+    Returns:
+        sample_ids (list): The individual IDs of the file
+        variant_names (list): Names of the variants in the region, as "CHR:POS-1:POS"
+        genotypes (numpy.ndarray): A (variants x people) uint8 matrix where
+                                   (1 = variant exists, 0 = variant doesn't exist)
+
+    Raises:
+        ValueError: if a line of the region has no FORMAT and sample columns, as in a
+                    sites-only VCF file
+    """
+    with pysam.TabixFile(str(vcf_path)) as tabix_file:
+        sample_ids = _COLUMN_SEPARATOR.split(tabix_file.header[-1].rstrip())[9:]
+        n_samples = len(sample_ids)
+        variant_names = []
+        if positions is None:
+            lines = tabix_file.fetch(str(chrom), start, end)
+        else:
+            lines = targeted_lines(tabix_file, chrom, sorted(pos for pos in set(positions) if pos <= end))
+        # grows by doubling, so that each line is written straight into the array
+        genotypes = numpy.empty((1024 if positions is None else 16, n_samples), dtype=numpy.uint8)
+        for line in lines:
+            if len(variant_names) == len(genotypes):
+                genotypes = numpy.concatenate([genotypes, numpy.empty_like(genotypes)])
+            if ' ' in line:
+                line = _COLUMN_SEPARATOR.sub('\t', line.rstrip())
+            fields = line.split('\t', 9)
+            if len(fields) < 10:
+                raise ValueError('%s has no genotypes at %s:%s; a VCF file needs FORMAT and sample columns'
+                                 % (vcf_path, fields[0], fields[1] if len(fields) > 1 else '?'))
+            if positions is not None and int(fields[1]) - 1 + len(fields[3]) <= start:
+                # the variant ends before the region, which a query of the region would leave out
+                continue
+            genotypes[len(variant_names)] = parse_gt_calls(fields[8], fields[9], n_samples)
+            variant_names.append(':'.join([fields[0], str(int(fields[1]) - 1), fields[1]]))
+        return sample_ids, variant_names, genotypes[:len(variant_names)]
+
+
+def targeted_lines(tabix_file, chrom, positions):
+    """
+    Fetches the lines of a tabix indexed VCF file at some positions, with one query for each
+    run of positions less than TARGETED_QUERY_GAP apart
+
+    Args:
+        tabix_file (pysam.TabixFile): the VCF file
+        chrom (str): chromosome of the positions
+        positions (list): sorted one-based positions
+
+    Returns:
+        lines (generator): the lines of the variants at the positions, in order
+    """
+    wanted = set(positions)
+    runs = []
+    for pos in positions:
+        if runs and pos - runs[-1][1] < TARGETED_QUERY_GAP:
+            runs[-1][1] = pos
+        else:
+            runs.append([pos, pos])
+    for first, last in runs:
+        # a query also returns the longer variants before it which overlap it, and those between the positions
+        for line in tabix_file.fetch(str(chrom), first - 1, last):
+            if int(_COLUMN_SEPARATOR.split(line, 2)[1]) in wanted:
+                yield line
+
+
+def region_has_variants(vcf_path, chrom, start, end):
+    """
+    Whether a region of a tabix indexed VCF file has any variants, reading at most one line
+    """
+    with pysam.TabixFile(str(vcf_path)) as tabix_file:
+        return next(tabix_file.fetch(str(chrom), start, end), None) is not None
 
 
 class LOCAL_API:
-    def __init__(self, file_path, conf_matrix=False):
+    def __init__(self, file_path, conf_matrix=False, cache_dir=None, decoder='tabix', decode_workers=None,
+                 profiler=None, variant_names=None):
         """
         Initializes the API class
 
@@ -14,39 +154,225 @@ class LOCAL_API:
         Args:
             file_path (str): Path to json file that contains the variant rangess
             conf_matrix (bool): Initializes API to perform conf_matrix operations
+            cache_dir (str): Directory to cache the decoded genotypes in. Defaults to the
+                             "genotype_cache_dir" of the config file, then to the
+                             ID3_GENOTYPE_CACHE environment variable; no caching if none is set
+            decoder (str): 'tabix' to read only the GT field of each VCF line, or 'pyvcf'
+                           to parse full PyVCF records into the variants attribute
+            decode_workers (int): number of variant ranges to decode concurrently with the
+                                  'tabix' decoder; defaults to the number of CPUs
+            profiler (Profiler): records the time spent decoding and counting; a new one if None
+            variant_names (iterable): if given, only the variants of the variant ranges with
+                                      these names are decoded, such as those a trained tree
+                                      splits on, each by a targeted tabix query; the genotypes
+                                      decoded are not cached, though a cache of all the
+                                      variants is still read
 
         Attributes:
-            variant_list (list): Represents the variants in each person. 
-                                     The value of the variants is a list of 0's and 
+            genotype_matrix (numpy.ndarray): A (people x variants) uint8 matrix of 0's and
                                      1's indicating if the variant exists in the person.
             indiv_list (list): Represents the individual code of a person
             popu_list (list): Represents the ancestry of the person
+            popu_idx (numpy.ndarray): The ancestry of each person, coded as an index
+                                     into ancestry_list
             variant_name_list (list): Names of the variants in the format of
                                           "VARIANT_POS,VARIANT_REF,VARIANT_ALT"
                                           "CHROMOSOME_#:START_POS:END_POS" (TODO - UPDATE TO THIS)
+            variant_index (dict): a dictionary which maps a variant name to its column
+                                  in the genotype_matrix
             ancestry_dict (dict): a dictionary which maps indivdual ID to population
             ancestry_list (list): A unique list of all the ancestries of people
             is_conf_matrix (bool): tells API to initialize the API for confusion matrix operations
+            cache_dir (str): Directory the decoded genotypes are cached in, or None
+            profiler (Profiler): records the time spent decoding and counting
 
         """
         with open(file_path) as f:
             self.config = json.load(f)
-        self.variant_list = []
+        self.genotype_matrix = numpy.zeros((0, 0), dtype=numpy.uint8)
         self.indiv_list = []
         self.popu_list = []
+        self.popu_idx = numpy.zeros(0, dtype=numpy.intp)
 
         self.variant_name_list = []
+        self.variant_index = {}
         self.ancestry_dict = {}
         self.ancestry_list = []
 
         self.is_conf_matrix = conf_matrix
-
-        # fetch variants from vcf and create a dictionary
-        self.variants = self.fetch_variants()
-        self.variant_dict = self.create_variant_dict(self.variants)
+        self.cache_dir = cache_dir or self.config.get('genotype_cache_dir') or os.environ.get(GENOTYPE_CACHE_ENV)
+        self.profiler = Profiler() if profiler is None else profiler
+
+        with self.profiler.stage('genotype_cache_load'):
+            cached = self.load_genotype_cache()
+        if cached:
+            self.variants = []
+            return
+
+        # fetch variants from vcf and create the genotype matrix
+        with self.profiler.stage('vcf_decode'):
+            if decoder == 'pyvcf' and variant_names is None:
+                self.variants = self.fetch_variants()
+                sample_ids, genotypes = self.create_genotype_matrix(self.variants)
+            elif decoder == 'tabix':
+                self.variants = []
+                sample_ids, genotypes = self.fetch_genotypes(decode_workers, variant_names)
+            elif decoder == 'pyvcf':
+                raise ValueError("Only the tabix decoder can decode selected variants")
+            else:
+                raise ValueError("Unknown VCF decoder: %s" % decoder)
+            self.index_variants()
 
         # updates variables
-        self.read_user_mappings(self.variant_dict)
+        self.read_user_mappings(sample_ids, genotypes)
+        if variant_names is None:
+            self.save_genotype_cache()
+
+    def genotype_cache_key(self):
+        """
+        Creates the key of the decoded genotypes in the cache. The key changes whenever
+        the variant ranges change or the VCF or PED files they are read from are modified.
+
+        Returns:
+            key (str): a hex digest identifying the decoded genotypes
+        """
+        def fingerprint(path):
+            stat = os.stat(path)
+            return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+        variant_ranges = [[str(var_range['chr']), int(var_range['start']), int(var_range['end'])]
+                          for var_range in self.config['variant_ranges']]
+        chr_paths = sorted({chrom for chrom, _, _ in variant_ranges})
+        key = {
+            'version': GENOTYPE_CACHE_VERSION,
+            'variant_ranges': variant_ranges,
+            'chr_paths': [fingerprint(self.config['chr_paths'][chrom]) for chrom in chr_paths],
+            'user_mapping_path': fingerprint(self.config['user_mapping_path']),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def load_genotype_cache(self):
+        """
+        Loads the decoded genotypes from the cache, memory-mapping the genotype matrix
+        read-only so that several processes can share one copy of it
+
+        Returns:
+            (bool): whether the genotypes were found in the cache
+        """
+        if not self.cache_dir:
+            return False
+        entry = os.path.join(self.cache_dir, self.genotype_cache_key())
+        if not os.path.isdir(entry):
+            return False
+
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        self.genotype_matrix = numpy.load(os.path.join(entry, 'genotypes.npy'), mmap_mode='r')
+        self.popu_idx = numpy.load(os.path.join(entry, 'popu_idx.npy'))
+        self.indiv_list = meta['indiv_list']
+        self.popu_list = meta['popu_list']
+        self.variant_name_list = meta['variant_name_list']
+        self.ancestry_dict = meta['ancestry_dict']
+        self.ancestry_list = meta['ancestry_list']
+        self.index_variants()
+        return True
+
+    def save_genotype_cache(self):
+        """
+        Saves the decoded genotypes to the cache, if there is one. The entry is written
+        to a temporary directory and renamed into place, so that readers never see a
+        partially written entry.
+        """
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = os.path.join(self.cache_dir, self.genotype_cache_key())
+        tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            numpy.save(os.path.join(tmp_entry, 'genotypes.npy'), self.genotype_matrix)
+            numpy.save(os.path.join(tmp_entry, 'popu_idx.npy'), self.popu_idx)
+            with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+                json.dump({
+                    'indiv_list': self.indiv_list,
+                    'popu_list': self.popu_list,
+                    'variant_name_list': self.variant_name_list,
+                    'ancestry_dict': self.ancestry_dict,
+                    'ancestry_list': self.ancestry_list,
+                }, f)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # another process saved the same entry first
+            if not os.path.isdir(entry):
+                raise
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    @classmethod
+    def from_shared_genotypes(cls, shared_genotypes):
+        """
+        Creates an API in another process from genotypes shared by share_genotypes,
+        memory-mapping the genotype matrix read-only rather than reading the VCF files
+
+        Args:
+            shared_genotypes (dict): the description of the genotypes from share_genotypes
+
+        Returns:
+            api (LOCAL_API): an API which can count variants, but holds no PyVCF records
+        """
+        api = cls.__new__(cls)
+        api.config = shared_genotypes['config']
+        api.genotype_matrix = numpy.load(shared_genotypes['genotype_path'], mmap_mode='r')
+        api.indiv_list = shared_genotypes['indiv_list']
+        api.popu_list = shared_genotypes['popu_list']
+        api.popu_idx = shared_genotypes['popu_idx']
+        api.variant_name_list = shared_genotypes['variant_name_list']
+        api.variant_index = shared_genotypes['variant_index']
+        api.ancestry_dict = shared_genotypes['ancestry_dict']
+        api.ancestry_list = shared_genotypes['ancestry_list']
+        api.is_conf_matrix = shared_genotypes['is_conf_matrix']
+        api.cache_dir = None
+        api.variants = []
+        api.profiler = Profiler()
+        return api
+
+    def share_genotypes(self, directory):
+        """
+        Writes the genotype matrix to a memory-mappable file, so that other processes
+        can map it rather than each being sent a copy
+
+        Args:
+            directory (str): directory to write the genotype matrix in; it must outlive
+                the processes that use the shared genotypes
+
+        Returns:
+            shared_genotypes (dict): a description of the genotypes for from_shared_genotypes
+        """
+        if isinstance(self.genotype_matrix, numpy.memmap):
+            # already memory-mapped from the genotype cache
+            genotype_path = self.genotype_matrix.filename
+        else:
+            genotype_path = os.path.join(directory, 'genotypes.npy')
+            numpy.save(genotype_path, self.genotype_matrix)
+        return {
+            'config': self.config,
+            'genotype_path': genotype_path,
+            'indiv_list': self.indiv_list,
+            'popu_list': self.popu_list,
+            'popu_idx': self.popu_idx,
+            'variant_name_list': self.variant_name_list,
+            'variant_index': self.variant_index,
+            'ancestry_dict': self.ancestry_dict,
+            'ancestry_list': self.ancestry_list,
+            'is_conf_matrix': self.is_conf_matrix,
+        }
+
+    @property
+    def variant_list(self):
+        """
+        The genotype matrix; each row represents the variants in a person.
+        Kept for callers that iterate over people.
+        """
+        return self.genotype_matrix
 
     def fetch_variants(self):
         """
@@ -66,6 +392,68 @@ class LOCAL_API:
             variant_list.extend([variant for variant in variants])
         return variant_list
 
+    def fetch_genotypes(self, decode_workers=None, variant_names=None):
+        """
+        Fetches the genotypes of the variant ranges from the VCF files, reading only the GT
+        field of each line. Independent variant ranges are decoded concurrently.
+
+        Args:
+            decode_workers (int): number of variant ranges to decode concurrently
+            variant_names (iterable): if given, only the variants with these names are fetched
+
+        Returns:
+            sample_ids (list): The individual IDs, in the order of the matrix rows
+            genotypes (numpy.ndarray): A (people x variants) uint8 matrix where
+                                       (1 = variant exists, 0 = variant doesn't exist)
+        """
+        var_ranges = self.config['variant_ranges']
+        positions = None
+        if variant_names is not None:
+            positions = {}
+            for variant_name in variant_names:
+                chrom, _, pos = variant_name.split(':')
+                positions.setdefault(chrom, set()).add(int(pos))
+
+        def fetch_range(var_range):
+            return fetch_region_genotypes(self.config['chr_paths'][str(var_range['chr'])],
+                                          var_range['chr'], int(var_range['start']), int(var_range['end']),
+                                          None if positions is None else positions.get(str(var_range['chr']), ()))
+
+        with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+            regions = list(executor.map(fetch_range, var_ranges))
+
+        # the people are those of the first file with any variants, as with PyVCF records
+        if positions is None:
+            sample_ids = next((region_samples for region_samples, variant_names, _ in regions if variant_names), [])
+        else:
+            sample_ids = next((region_samples for var_range, (region_samples, _, _) in zip(var_ranges, regions)
+                               if region_has_variants(self.config['chr_paths'][str(var_range['chr'])],
+                                                      var_range['chr'], int(var_range['start']), int(var_range['end']))),
+                              [])
+        sample_index = {sample: idx for idx, sample in enumerate(sample_ids)}
+        region_genotypes = []
+        for region_samples, variant_names, genotypes in regions:
+            self.variant_name_list.extend(variant_names)
+            if region_samples != sample_ids:
+                # line up the people of this file with those of the first
+                aligned = numpy.zeros((len(variant_names), len(sample_ids)), dtype=numpy.uint8)
+                for idx, sample in enumerate(region_samples):
+                    if sample in sample_index:
+                        aligned[:, sample_index[sample]] = genotypes[:, idx]
+                genotypes = aligned
+            region_genotypes.append(genotypes)
+
+        if not region_genotypes:
+            return sample_ids, numpy.zeros((len(sample_ids), 0), dtype=numpy.uint8)
+        return sample_ids, numpy.concatenate(region_genotypes).T
+
+    def index_variants(self):
+        """
+        Maps each variant name to the first column of the genotype_matrix with that name
+        """
+        for idx, variant_name in enumerate(self.variant_name_list):
+            self.variant_index.setdefault(variant_name, idx)
+
     @staticmethod
     def create_split_path(split_path, new_variant_name):
         """
@@ -94,40 +482,50 @@ class LOCAL_API:
 
         return w_split_path, wo_split_path
 
-    def create_variant_dict(self, variants):
+    def create_genotype_matrix(self, variants):
         """
-        Creates a ditionary of variants from a vcf file which is used to update variables
-        within this class
+        Creates a genotype matrix of variants from a vcf file which is used to update
+        variables within this class
 
         Args:
             variants (Reader): A Reader Object from the PyVCF library which contains variants
 
         Returns:
-            variant_dict (dict): A dictionary where the
-                                    key: is the individual ID
-                                    value: is a list of binary values where
-                                           (1 = variant exists, 0 = variant doesn't exist)
+            sample_ids (list): The individual IDs, in the order of the matrix rows
+            genotypes (numpy.ndarray): A (people x variants) uint8 matrix where
+                                       (1 = variant exists, 0 = variant doesn't exist)
         """
-        variant_dict = {}
-        idx = 0
+        sample_ids = []
+        sample_index = {}
+        columns = []
         # loops through variants
         for variant in variants:
-            idx += 1
             self.variant_name_list.append(':'.join([str(variant.CHROM), str(variant.POS-1), str(variant.POS)]))
-            # loops through people in variants
+            if not sample_ids:
+                sample_ids = [call.sample for call in variant.samples]
+                sample_index = {sample: idx for idx, sample in enumerate(sample_ids)}
+            column = numpy.zeros(len(sample_ids), dtype=numpy.uint8)
+            # loops through people in variants and checks if variant exists in person
             for call in variant.samples:
-                variant_dict[call.sample] = variant_dict.get(call.sample, [])
-                # checks if variant exists in person
-                if call['GT'] in ['0/0', '0|0', '.']:
-                    variant_dict[call.sample].append(0)
-                else:
-                    variant_dict[call.sample].append(1)
-        return variant_dict
+                if call['GT'] not in NO_VARIANT_GTS and call.sample in sample_index:
+                    column[sample_index[call.sample]] = 1
+            columns.append(column)
 
-    def read_user_mappings(self, variant_dict):
+        genotypes = numpy.zeros((len(sample_ids), len(columns)), dtype=numpy.uint8)
+        for idx, column in enumerate(columns):
+            genotypes[:, idx] = column
+        return sample_ids, genotypes
+
+    def read_user_mappings(self, sample_ids, genotypes):
         """
         Reads the usermappings from a file and updates the variables in the class
+
+        Args:
+            sample_ids (list): The individual IDs, in the order of the genotype rows
+            genotypes (numpy.ndarray): A (people x variants) matrix of genotypes from the vcf file
         """
+        sample_index = {sample: idx for idx, sample in enumerate(sample_ids)}
+        rows = []
         user_mapping_path = self.config['user_mapping_path']
         with open(user_mapping_path) as file:
             next(file)
@@ -138,15 +536,59 @@ class LOCAL_API:
 
                 self.ancestry_dict[indiv_id] = population
 
-                # checks if variant individual is in the variant dict from the vcf file
-                if indiv_id in variant_dict:
+                # checks if variant individual is in the genotypes from the vcf file
+                if indiv_id in sample_index:
                     self.indiv_list.append(indiv_id)
                     self.popu_list.append(population)
-                    self.variant_list.append(variant_dict[indiv_id])
+                    rows.append(sample_index[indiv_id])
 
         self.ancestry_list = list(set(self.ancestry_dict.values()))
         self.ancestry_list.sort()
 
+        ancestry_index = {ancestry: idx for idx, ancestry in enumerate(self.ancestry_list)}
+        self.popu_idx = numpy.array([ancestry_index[popu] for popu in self.popu_list], dtype=numpy.intp)
+        self.genotype_matrix = numpy.ascontiguousarray(genotypes[numpy.array(rows, dtype=numpy.intp)])
+
+    def find_sample_mask(self, split_path):
+        """
+        Finds the people in the genotype_matrix that are consistent with the split path
+
+        Args:
+            split_path (list1, list2): 
+                This is the paths of the splits before the current split. The first list
+                is the list of variant names and the second list is the direction
+                of the split. The direction of the second list is depicted by 1's
+                and 0's. Where 1 is splitting in the direction with the variant
+                and 0 is splitting in the direction without the variant.
+
+        Returns:
+            mask (numpy.ndarray): a boolean array which is True for the rows in the
+                genotype_matrix that have not been split away
+        """
+        mask = numpy.ones(len(self.genotype_matrix), dtype=bool)
+        for exc_var, direction in zip(split_path[0], split_path[1]):
+            var_idx = self.variant_index[exc_var]
+            mask &= self.genotype_matrix[:, var_idx] == direction
+        return mask
+
+    def find_samples(self, split_path):
+        """
+        Finds the indices of the people in the genotype_matrix that are consistent with
+        the split path. Replaying the split path touches every person once per split, so
+        prefer partitioning a parent's samples with split_samples when building a tree.
+
+        Args:
+            split_path (list1, list2): 
+                This is the paths of the splits before the current split. The first list
+                is the list of variant names and the second list is the direction
+                of the split. The direction of the second list is depicted by 1's
+                and 0's. Where 1 is splitting in the direction with the variant
+                and 0 is splitting in the direction without the variant.
+
+        Returns:
+            samples (numpy.ndarray): the row indices of the people in the genotype_matrix
+        """
+        return numpy.flatnonzero(self.find_sample_mask(split_path))
 
     def find_ignore_rows(self, split_path):
         """
@@ -166,18 +608,81 @@ class LOCAL_API:
             ignore_rows_idx (list): a list of numbers that represent the indices in the
                 variant_list.
         """
-        ignore_rows_idxs = []
+        return numpy.flatnonzero(~self.find_sample_mask(split_path)).tolist()
 
-        # basically find rows to ignore because it has been split upon already
-        for exc_var, direction in zip(split_path[0], split_path[1]):
-            # finding rows to ignore
-            var_idx = self.variant_name_list.index(exc_var)
-            # looping through all the people
-            for idx, variants in enumerate(self.variant_list):
-                if idx not in ignore_rows_idxs and variants[var_idx] is not direction:
-                    ignore_rows_idxs.append(idx)
+    def get_target_samples(self):
+        """
+        Gets the samples of the target set, which is every person
+
+        Returns:
+            samples (numpy.ndarray): the row indices of every person in the genotype_matrix
+        """
+        return numpy.arange(len(self.genotype_matrix))
+
+    def node_samples(self, node):
+        """
+        Gets the samples of a node, replaying its split path if the node does not carry them
+
+        Args:
+            node (ID3_Node): a node of the tree
+
+        Returns:
+            samples (numpy.ndarray): the row indices of the people in the node
+        """
+        if node.samples is not None:
+            return node.samples
+        return self.find_samples(node.split_path)
+
+    def split_samples(self, node, split_var):
+        """
+        Partitions the samples of a node on a variant
+
+        Args:
+            node (ID3_Node): the node which is being split
+            split_var (string): The variant name it is now splitting on
+
+        Returns:
+            w_samples (numpy.ndarray): the row indices of the people with the variant
+            wo_samples (numpy.ndarray): the row indices of the people without the variant
+        """
+        with self.profiler.stage('split_queries'):
+            samples = self.node_samples(node)
+            has_variant = self.genotype_matrix[samples, self.variant_index[split_var]] == 1
+            return samples[has_variant], samples[~has_variant]
+
+    def count_ancestries(self, samples):
+        """
+        Counts the people of every ancestry within a subset of people
+
+        Args:
+            samples (numpy.ndarray): row indices (or a boolean mask) of the genotype_matrix
+
+        Returns:
+            counts (numpy.ndarray): the counts, ordered as in ancestry_list
+        """
+        return numpy.bincount(self.popu_idx[samples], minlength=len(self.ancestry_list))
+
+    def count_variants_by_ancestry(self, samples, candidates=None):
+        """
+        Counts the people of every ancestry that have each variant within a subset of people
+
+        Args:
+            samples (numpy.ndarray): row indices of the genotype_matrix
+            candidates (numpy.ndarray): the indices of the variants to count, or None for every variant
 
-        return ignore_rows_idxs
+        Returns:
+            counts (numpy.ndarray): a (variants x ancestries) matrix of counts, the
+                ancestries being ordered as in ancestry_list; 0 for the variants not counted
+        """
+        counts = numpy.zeros((len(self.variant_name_list), len(self.ancestry_list)), dtype=numpy.int64)
+        sample_popu = self.popu_idx[samples]
+        for popu_i in numpy.unique(sample_popu).tolist():
+            popu_samples = samples[sample_popu == popu_i]
+            if candidates is None:
+                counts[:, popu_i] = self.genotype_matrix[popu_samples].sum(axis=0, dtype=numpy.int64)
+            else:
+                counts[candidates, popu_i] = self.genotype_matrix[numpy.ix_(popu_samples, candidates)].sum(axis=0, dtype=numpy.int64)
+        return counts
 
     # splits the set given a variant 
     # returns 2 subsets of the data
@@ -201,31 +706,24 @@ class LOCAL_API:
             
 
         """
-        split_path = node.split_path
         # retrieves variant from "API"
         ancestry_list = self.ancestry_list
 
         w_variant_dict = dict.fromkeys(ancestry_list, 0)
         wo_variant_dict = dict.fromkeys(ancestry_list, 0)
 
-        ignore_rows_idxs = self.find_ignore_rows(split_path)
+        # check if split_var is null
+        if not split_var:
+            return w_variant_dict, wo_variant_dict
 
-        # create new subset after finding all the rows to ignore
-        for idx, variants in enumerate(self.variant_list):
-            if idx in ignore_rows_idxs:
-                continue
-            popu = self.popu_list[idx]
-            # check if split_var is null
-            if split_var:
-                f_var_idx = self.variant_name_list.index(split_var)
-                if variants[f_var_idx] == 1:
-                    w_variant_dict[popu] += 1
-                else:
-                    wo_variant_dict[popu] += 1
+        # create new subsets from the samples of the node
+        w_samples, wo_samples = self.split_samples(node, split_var)
+        w_variant_dict.update(zip(ancestry_list, self.count_ancestries(w_samples).tolist()))
+        wo_variant_dict.update(zip(ancestry_list, self.count_ancestries(wo_samples).tolist()))
 
         return w_variant_dict, wo_variant_dict
 
-    def find_next_variant_counts(self, split_path):
+    def find_next_variant_counts(self, split_path, samples=None):
         """
         Finds the counts of the a potential next variant to perform the
         split on
@@ -237,6 +735,8 @@ class LOCAL_API:
                 of the split. The direction of the second list is depicted by 1's
                 and 0's. Where 1 is splitting in the direction with the variant
                 and 0 is splitting in the direction without the variant.
+            samples (numpy.ndarray): the row indices of the people consistent with the
+                split path; found by replaying the split path if not given
         Returns:
             w_variant_list: 
                 A list representing of a dictionary of ancestry counts per variant
@@ -248,19 +748,76 @@ class LOCAL_API:
                 ]
         """
         ancestry_list = self.ancestry_list
-        w_variant_list = [dict.fromkeys(ancestry_list, 0) for variant_names in self.variant_name_list]
-        ignore_rows_idxs = self.find_ignore_rows(split_path)
+        counts = self.find_next_variant_count_matrix(split_path, samples)
+        return [dict(zip(ancestry_list, variant_counts)) for variant_counts in counts.tolist()]
 
-        for idx, variants in enumerate(self.variant_list):
-            if idx in ignore_rows_idxs:
-                continue
-            popu = self.popu_list[idx]
-            # find counts of variants
-            for idx2, variant in enumerate(variants):
-                if variant == 1:
-                    w_variant_list[idx2][popu] += 1
+    def find_next_variant_count_matrix(self, split_path, samples=None, candidates=None):
+        """
+        Finds the counts of the potential next variants to perform the split on,
+        as a matrix rather than a list of dictionaries
 
-        return w_variant_list
+        Attributes:
+            split_path (list1, list2): 
+                This is the paths of the splits before the current split. The first list
+                is the list of variant names and the second list is the direction
+                of the split. The direction of the second list is depicted by 1's
+                and 0's. Where 1 is splitting in the direction with the variant
+                and 0 is splitting in the direction without the variant.
+            samples (numpy.ndarray): the row indices of the people consistent with the
+                split path; found by replaying the split path if not given
+            candidates (numpy.ndarray): the indices of the variants to count, or None for every variant
+        Returns:
+            counts (numpy.ndarray): a (variants x ancestries) matrix of the counts of
+                people with each variant, the ancestries being ordered as in ancestry_list;
+                0 for the variants which are not candidates
+        """
+        self.profiler.count('count_queries')
+        self.profiler.count('candidate_counts', len(self.variant_name_list) if candidates is None else len(candidates))
+        with self.profiler.stage('count_queries'):
+            if samples is None:
+                samples = self.find_samples(split_path)
+            return self.count_variants_by_ancestry(samples, candidates)
+
+    def find_next_variant_count_matrices(self, split_paths, samples_list=None, candidates_list=None):
+        """
+        Finds the count matrices of the potential next variants for a batch of nodes
+
+        Attributes:
+            split_paths (list): the split paths of the nodes
+            samples_list (list): the row indices of the people in each node, or None
+            candidates_list (list): the indices of the variants to count in each node, or None
+        Returns:
+            count_matrices (list): a count matrix, as from find_next_variant_count_matrix, per node
+        """
+        if samples_list is None:
+            samples_list = [None] * len(split_paths)
+        if candidates_list is None:
+            candidates_list = [None] * len(split_paths)
+        return [self.find_next_variant_count_matrix(split_path, samples, candidates)
+                for split_path, samples, candidates in zip(split_paths, samples_list, candidates_list)]
+
+    async def async_find_next_variant_count_matrices(self, split_paths, samples_list=None, candidates_list=None):
+        """
+        Finds the count matrices of the potential next variants for a batch of nodes, as
+        find_next_variant_count_matrices does; the counts are local, so nothing is awaited
+        """
+        return self.find_next_variant_count_matrices(split_paths, samples_list, candidates_list)
+
+    @staticmethod
+    def run(coroutine):
+        """
+        Runs a coroutine to completion without an event loop, as the counts are local and
+        nothing is awaited, so that a tree can be trained from within a running event loop
+
+        Raises:
+            RuntimeError: if the coroutine waits on an event loop after all
+        """
+        try:
+            coroutine.send(None)
+        except StopIteration as stop:
+            return stop.value
+        coroutine.close()
+        raise RuntimeError('a local coroutine waited on an event loop')
 
     def get_target_set(self):
         """
@@ -270,20 +827,17 @@ class LOCAL_API:
             counts (dict): A dictionary containing keys of ancestries and values of the counts for the particular ancestry
         """
         ancestry_list = self.ancestry_list
-        counts = dict.fromkeys(ancestry_list, 0)
-        for i in self.popu_list:
-            counts[i] = counts.get(i, 0) + 1
-        return counts
+        counts = numpy.bincount(self.popu_idx, minlength=len(ancestry_list))
+        return dict(zip(ancestry_list, counts.tolist()))
 
     def count_variants(self):
         """
         Gets the counts of each variant
         """
         my_dict = {}
-        for variants in (self.variant_list):
-            for idx, variant in enumerate(variants):
-                if variant == 1:
-                    my_dict[self.variant_name_list[idx]] = my_dict.get(self.variant_name_list[idx], 0) + 1
+        totals = self.genotype_matrix.sum(axis=0, dtype=numpy.int64)
+        for idx in numpy.flatnonzero(totals).tolist():
+            my_dict[self.variant_name_list[idx]] = my_dict.get(self.variant_name_list[idx], 0) + int(totals[idx])
         return my_dict
 
 if __name__ == "__main__":
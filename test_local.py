@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
+import asyncio
+import io
+import json
+import pickle
 import numpy
+import pysam
 import pytest
 from src.id3_variants_training.__train__ import train
-from src.id3_variants_training.__predict__ import predict
+from src.id3_variants_training.__predict__ import predict, load_model
+from src.id3_variants_training.__convert__ import convert
+from src.id3_variants_training.local_API import LOCAL_API, fetch_region_genotypes
+from src.id3_variants_training.candig_standin import CanDIG_StandIn
+from src.id3_variants_training.CountCache import CountCache
+from src.id3_variants_training.candig_API import CanDIG_API, CanDIGAPIError, decode_ethnicity
+from src.id3_variants_training.ID3_Class import ID3
+from src.id3_variants_training.ID3_Node import ID3_Node
+from src.id3_variants_training.Profiler import Profiler
+from src.id3_variants_training.PredictionService import PredictionService
+from src.id3_variants_training.__serve__ import make_app, serve_lines
+from aiohttp.test_utils import TestClient, TestServer
 
 @pytest.fixture
 def model_case1_train():
@@ -19,6 +35,11 @@ def model_case3_train():
     trainfile = 'test_cases/case3/config.json'
     return train(True, trainfile, verbose=False)
 
+@pytest.fixture
+def model_case3_train_parallel():
+    trainfile = 'test_cases/case3/config.json'
+    return train(True, trainfile, verbose=False, workers=2, parallel_depth=1)
+
 def test_case1_on_train(model_case1_train):
     trainfile = 'test_cases/case1/config.json'
     expected = numpy.array([[3, 0], [0, 3]])
@@ -71,6 +92,515 @@ def test_case3_on_test(model_case3_train):
     results = predict(testfile, model_case3_train).conf_matrix
     assert (results == expected).all()
 
+def test_case3_parallel_on_test(model_case3_train_parallel):
+    testfile = 'test_cases/case3/test-config.json'
+    expected = numpy.array([[14, 0, 1, 0, 0, 0],
+                            [ 0, 5, 1, 0, 9, 0],
+                            [ 0, 3,12, 0, 0, 0],
+                            [ 0, 0, 0,14, 1, 0],
+                            [ 0, 0, 0, 0,15, 0],
+                            [ 0, 0, 0, 0, 0,15]])
+
+    results = predict(testfile, model_case3_train_parallel).conf_matrix
+    assert (results == expected).all()
+
+def test_case3_children_derived_from_noisy_counts(model_case3_train):
+    api = model_case3_train.api
+    # a node split in two whose larger child was split again, so that its counts are derived
+    split = next(node for node in model_case3_train.root_node.iter_nodes()
+                 if len(node.children) == 2 and max(node.children, key=lambda child: child.total_count).children)
+    parent = split.detached()
+    parent.samples = api.find_samples(parent.split_path)
+    parent.variant_counts = api.find_next_variant_count_matrix(parent.split_path, parent.samples)
+    children = model_case3_train.split_node(parent)
+    smaller, larger = sorted(children, key=lambda child: child.counts.sum())
+    assert model_case3_train.can_split(larger)
+
+    # noise that takes the parent's counts below those of the smaller child
+    noise = 3
+    parent.variant_counts = parent.variant_counts - noise
+    LOCAL_API.run(model_case3_train.find_children_variant_counts([(parent, children)]))
+    exact = api.find_next_variant_count_matrix(larger.split_path, larger.samples)
+    assert (parent.variant_counts - smaller.variant_counts < 0).any()
+    assert (smaller.variant_counts == api.find_next_variant_count_matrix(smaller.split_path, smaller.samples)).all()
+    assert (larger.variant_counts == numpy.maximum(exact - noise, 0)).all()
+
+    # counts with a variant are capped by the subset being split, and at zero
+    w_counts, wo_counts, _, _, _ = ID3.split_gains(numpy.array([[5, -2], [1, 1]]), numpy.array([3, 4]))
+    assert w_counts.tolist() == [[3, 0], [1, 1]] and wo_counts.tolist() == [[0, 4], [2, 3]]
+
+def test_case3_train_in_event_loop(model_case3_train):
+    trainfile = 'test_cases/case3/config.json'
+    expected = model_case3_train.compile()
+
+    async def train_in_loop(**kwargs):
+        # as from a notebook or a request handler, with an event loop already running
+        return train(True, trainfile, verbose=False, **kwargs)
+
+    for kwargs in ({}, {'prune': True}, {'workers': 2, 'parallel_depth': 1}):
+        compiled_tree = asyncio.run(train_in_loop(**kwargs)).compile()
+        assert compiled_tree.variant_names == expected.variant_names
+        assert (compiled_tree.counts == expected.counts).all()
+
+def test_remote_train_rejects_local_only_options():
+    # rejected before the remote API is opened, so no server is needed
+    with pytest.raises(ValueError, match='workers'):
+        train(False, 'test_cases/case3/config.json', verbose=False, workers=2)
+    with pytest.raises(ValueError, match='ensembles'):
+        train(False, 'test_cases/case3/config.json', verbose=False, trees=2)
+
+def test_case3_compiled_model(model_case3_train, tmp_path):
+    testfile = 'test_cases/case3/test-config.json'
+    expected = predict(testfile, model_case3_train).conf_matrix
+    pickle_path = str(tmp_path / 'model.pickle')
+    model_path = str(tmp_path / 'model.npz')
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(model_case3_train, f)
+
+    compiled_tree = convert(pickle_path, model_path)
+    assert (compiled_tree.counts[0] == [model_case3_train.root_node.subset[ancestry]
+                                        for ancestry in compiled_tree.ancestry_list]).all()
+    for mmap in (False, True):
+        model = load_model(model_path, mmap=mmap)
+        assert isinstance(model.feature, numpy.memmap) == mmap
+        assert (model.counts == compiled_tree.counts).all()
+        assert (predict(testfile, model).conf_matrix == expected).all()
+    assert (predict(testfile, load_model(pickle_path)).conf_matrix == expected).all()
+
+def test_case3_targeted_predict(model_case3_train):
+    testfile = 'test_cases/case3/test-config.json'
+    targeted = predict(testfile, model_case3_train, targeted=True)
+    decoded_all = predict(testfile, model_case3_train)
+
+    variant_names = set(model_case3_train.compile().variant_names)
+    assert set(targeted.api.variant_name_list) <= variant_names
+    assert len(targeted.api.variant_name_list) < len(decoded_all.api.variant_name_list)
+    assert targeted.api.indiv_list == decoded_all.api.indiv_list
+    assert (targeted.conf_matrix == decoded_all.conf_matrix).all()
+
+def test_case3_node_pickles(model_case3_train, model_case3_train_parallel):
+    # nodes keep nothing of how they were built, leaves included
+    for tree in (model_case3_train, model_case3_train_parallel):
+        assert all(node.samples is None and node.variant_counts is None and node.upper_variant_counts is None
+                   for node in tree.root_node.iter_nodes())
+    assert not set(ID3_Node.build_slots) & set(model_case3_train.root_node.__getstate__())
+
+    model = pickle.loads(pickle.dumps(model_case3_train))
+    nodes = list(model.root_node.iter_nodes())
+    assert [node.split_path for node in nodes] == [node.split_path for node in model_case3_train.root_node.iter_nodes()]
+    assert all(node.ancestries is model.root_node.ancestries for node in nodes)
+    assert (model.compile().counts == model_case3_train.compile().counts).all()
+
+    # nodes pickled before they had slots hold their subset and split path, and anytree's links
+    root, child = ID3_Node.__new__(ID3_Node), ID3_Node.__new__(ID3_Node)
+    root.__setstate__({'variant_name': 'root', 'with_variant': True, 'subset': {'A': 2, 'B': 1}, 'total_count': '3',
+                       'most_common_ancestry': 'A', 'split_path': ([], []), '_NodeMixin__children': [child]})
+    child.__setstate__({'variant_name': '1:1:2', 'with_variant': False, 'subset': {'A': 0, 'B': 1}, 'total_count': '1',
+                        'most_common_ancestry': 'B', 'split_path': (['1:1:2'], [0]), '_NodeMixin__parent': root})
+    assert child.split_path == (['1:1:2'], [0]) and child.depth == 1
+    assert (root.most_common_ancestry, root.total_count, child.most_common_ancestry) == ('A', 3, 'B')
+    assert root.children == [child] and child.parent is root
+
+def test_case3_ensemble(model_case3_train, tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    ensemble = train(True, trainfile, verbose=False, trees=5, seed=1)
+    parallel = train(True, trainfile, verbose=False, trees=5, seed=1, workers=2)
+    api = LOCAL_API(testfile)
+    votes = ensemble.predict_votes(api.genotype_matrix, api.variant_name_list)
+    assert (votes.sum(axis=1) == 5).all()
+    assert (parallel.predict_votes(api.genotype_matrix, api.variant_name_list) == votes).all()
+    assert ensemble.profiler.nodes == parallel.profiler.nodes == sum(len(tree.feature) for tree in ensemble.trees)
+
+    model_path = str(tmp_path / 'ensemble.npz')
+    ensemble.save(model_path)
+    for mmap in (False, True):
+        model = load_model(model_path, mmap=mmap)
+        assert (model.predict_votes(api.genotype_matrix, api.variant_name_list) == votes).all()
+    assert (predict(testfile, model).conf_matrix.sum(axis=1) == 15).all()
+
+    # trees of every person and variant are all the single tree
+    unsampled = train(True, trainfile, verbose=False, trees=2, bootstrap=False, variant_fraction=1)
+    assert (predict(testfile, unsampled).conf_matrix == predict(testfile, model_case3_train).conf_matrix).all()
+
+def test_sites_only_vcf(tmp_path):
+    vcf_path = str(tmp_path / 'sites.vcf')
+    with open(vcf_path, 'w') as f:
+        f.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n1\t100\t.\tA\tG\t.\tPASS\t.\n')
+    vcf_path = pysam.tabix_index(vcf_path, preset='vcf')
+    for positions in (None, [100]):
+        with pytest.raises(ValueError, match='sites.vcf.gz has no genotypes at 1:100'):
+            fetch_region_genotypes(vcf_path, '1', 0, 200, positions=positions)
+
+def test_case3_genotype_cache(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    uncached = LOCAL_API(trainfile)
+    LOCAL_API(trainfile, cache_dir=str(tmp_path))
+    cached = LOCAL_API(trainfile, cache_dir=str(tmp_path))
+
+    assert isinstance(cached.genotype_matrix, numpy.memmap)
+    assert (cached.genotype_matrix == uncached.genotype_matrix).all()
+    assert cached.variant_name_list == uncached.variant_name_list
+    assert cached.popu_list == uncached.popu_list
+
+def test_case3_predict_batch(model_case3_train):
+    testfile = 'test_cases/case3/test-config.json'
+    api = LOCAL_API(testfile)
+    expected = []
+    for row in api.genotype_matrix:
+        include_variants = [name for name, genotype in zip(api.variant_name_list, row) if genotype == 1]
+        expected.append(model_case3_train.predict(include_variants).most_common_ancestry)
+
+    results = model_case3_train.predict_batch(api.genotype_matrix, api.variant_name_list)
+    assert results == expected
+
+def test_case3_prediction_service(model_case3_train):
+    testfile = 'test_cases/case3/test-config.json'
+    api = LOCAL_API(testfile)
+    compiled_tree = model_case3_train.compile()
+    expected = [compiled_tree.ancestry_list[label]
+                for label in compiled_tree.predict_batch(api.genotype_matrix, api.variant_name_list)]
+    samples = [{'variants': [name for name, genotype in zip(api.variant_name_list, row) if genotype == 1]}
+               for row in api.genotype_matrix]
+
+    async def serve():
+        service = PredictionService({'case3': compiled_tree}, max_batch=8)
+        try:
+            return await asyncio.gather(*[service.predict(sample) for sample in samples]), service.report()
+        finally:
+            await service.close()
+
+    results, report = asyncio.run(serve())
+    assert [result['ancestry'] for result in results] == expected
+    assert report['requests'] == len(samples) and report['errors'] == 0
+    assert len(samples) / 8 <= report['batches'] < len(samples)
+
+    malformed = [{'variants': 'ab'}, {'variants': None}, {'variants': [['a']]}, {'genotypes': [2]}]
+    lines = [json.dumps(dict(sample, id=idx)) for idx, sample in enumerate(samples)] + ['{"model": "other"}'] + \
+        [json.dumps(dict(sample, id='malformed%d' % idx)) for idx, sample in enumerate(malformed)]
+    out = io.StringIO()
+    asyncio.run(serve_lines(PredictionService({'case3': compiled_tree}), io.StringIO('\n'.join(lines)), out))
+    answers = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted((answer['id'], answer['ancestry']) for answer in answers if 'ancestry' in answer) == \
+        list(enumerate(expected))
+    assert sum('error' in answer for answer in answers) == 1 + len(malformed)
+    assert {answer['id'] for answer in answers if 'error' in answer and 'id' in answer} == \
+        {'malformed%d' % idx for idx in range(len(malformed))}
+
+def test_case3_prediction_service_http(model_case3_train):
+    compiled_tree = model_case3_train.compile()
+    sample = {'variants': list(compiled_tree.variant_names[:1])}
+
+    async def post_bodies():
+        async with TestClient(TestServer(make_app(PredictionService({'case3': compiled_tree})))) as client:
+            statuses = []
+            for body in (sample, [sample, sample], 'x', [1], [sample, None], {'variants': 'ab'},
+                         {'variants': None}, {'variants': [['a']]}, {'genotypes': 'ab'}):
+                response = await client.post('/predict', json=body)
+                statuses.append(response.status)
+            return statuses, await (await client.get('/stats')).json()
+
+    statuses, stats = asyncio.run(post_bodies())
+    # a body, or an item of a body list, which is not an object, or malformed variants or
+    # genotypes, are bad requests
+    assert statuses == [200, 200] + [400] * 7
+    assert stats['errors'] == 7
+
+class FailingPredictionService(PredictionService):
+
+    def features(self, model_name, sample):
+        if sample.get('fail'):
+            raise RuntimeError('failed')
+        return super().features(model_name, sample)
+
+def test_case3_prediction_service_failures(model_case3_train):
+    compiled_tree = model_case3_train.compile()
+    sample = {'variants': list(compiled_tree.variant_names[:1])}
+
+    # every line is answered, with its id, whatever goes wrong
+    lines = [json.dumps(dict(sample, id=0)), json.dumps(dict(sample, id=1, fail=True)), '[1]', 'not json']
+    out = io.StringIO()
+    asyncio.run(serve_lines(FailingPredictionService({'case3': compiled_tree}), io.StringIO('\n'.join(lines)), out))
+    answers = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(answers) == len(lines)
+    assert {answer.get('id'): 'error' in answer for answer in answers if 'id' in answer} == {0: False, 1: True}
+    assert sum('error' in answer for answer in answers) == 3
+
+    async def post_bodies():
+        async with TestClient(TestServer(make_app(FailingPredictionService({'case3': compiled_tree})))) as client:
+            answers = []
+            for body in (dict(sample, fail=True), {'variants': 1}):
+                response = await client.post('/predict', json=body)
+                answers.append((response.status, await response.json()))
+            return answers
+
+    (failed_status, failed), (bad_status, bad) = asyncio.run(post_bodies())
+    assert failed_status == 500 and 'failed' in failed['message']
+    assert bad_status == 400 and 'variants' in bad['message']
+
+def test_case3_metrics_on_test(model_case3_train):
+    testfile = 'test_cases/case3/test-config.json'
+    conf_matrix = predict(testfile, model_case3_train)
+
+    hit_rates = conf_matrix.get_hit_rates()
+    precisions = conf_matrix.get_precisions()
+    prevalences = conf_matrix.get_prevalences()
+    for idx, ancestry in enumerate(conf_matrix.api.ancestry_list):
+        assert hit_rates[idx] == conf_matrix.get_hit_rate(ancestry)
+        assert precisions[idx] == conf_matrix.get_precision(ancestry)
+        assert prevalences[idx] == conf_matrix.get_prevalence(ancestry)
+
+    assert numpy.allclose(hit_rates, [14/15, 5/15, 12/15, 14/15, 1, 1])
+    assert numpy.allclose(precisions, [1, 5/8, 12/14, 1, 15/25, 1])
+    assert numpy.allclose(prevalences, 1/6)
+
+def test_case3_pruned_on_test(model_case3_train):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    pruned_model = train(True, trainfile, verbose=False, prune=True)
+    pruned_parallel_model = train(True, trainfile, verbose=False, prune=True, workers=2, parallel_depth=1)
+
+    expected = predict(testfile, model_case3_train).conf_matrix
+    assert (predict(testfile, pruned_model).conf_matrix == expected).all()
+    assert (predict(testfile, pruned_parallel_model).conf_matrix == expected).all()
+    assert pruned_model.pruning_summary() == pruned_parallel_model.pruning_summary()
+    assert pruned_model.pruning_summary()['avoided'] > 0
+    assert model_case3_train.pruning_summary()['avoided'] == 0
+
+def test_case3_profile(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    progress = []
+    profiler = Profiler(callback=progress.append)
+    model = train(True, trainfile, verbose=False, profiler=profiler)
+
+    report = profiler.report()
+    assert report['nodes'] == len(progress) == len(list(model.root_node.iter_nodes()))
+    assert [update['nodes'] for update in progress] == list(range(1, report['nodes'] + 1))
+    assert report['stages']['vcf_decode']['calls'] == 1
+    assert report['stages']['find_variant_split']['calls'] > 0
+    assert report['counters']['count_queries'] == report['stages']['count_queries']['calls']
+
+    with CanDIG_StandIn(LOCAL_API(trainfile)) as server:
+        with open(trainfile) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+        remote_profiler = Profiler(callback=lambda progress: None)
+        remote_model = train(False, str(remote_trainfile), verbose=False, profiler=remote_profiler)
+
+    counters = remote_profiler.report()['counters']
+    assert counters['requests'] == remote_model.api.request_stats()['requests']
+    assert counters['bytes_sent'] == server.stats['bytes']
+    assert counters['bytes_received'] > 0
+    assert pickle.loads(pickle.dumps(remote_model)).profiler.callback is None
+
+def test_decode_ethnicity():
+    counts = {'EUR': 3, 'AFR': 2}
+    summary = {'field%d' % idx: {'value': idx} for idx in range(1000)}
+    body = json.dumps({'results': {'patients': [{'ethnicity': counts}], 'summary': summary}}).encode()
+    assert decode_ethnicity(body) == counts
+    assert decode_ethnicity(json.dumps({'results': {'patients': [{'ethnicity': counts}]}}).encode()) == counts
+    assert decode_ethnicity(b'{"results": {"patients": [{}]}}') == {}
+
+    # a field sharing the name of the counts is not mistaken for them
+    summary['ethnicity'] = 'self-reported'
+    body = json.dumps({'results': {'summary': summary, 'patients': [{'ethnicity': counts}]}}).encode()
+    assert decode_ethnicity(body) == counts
+    with pytest.raises(ValueError):
+        decode_ethnicity(b'{"message": "no results"}')
+
+def test_case3_remote_malformed_responses_on_standin(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    with open(trainfile) as f:
+        config = json.load(f)
+    with CanDIG_StandIn(LOCAL_API(trainfile)) as server:
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+        with CanDIG_API(str(remote_trainfile)) as api:
+            req_body = api.craft_api_request(([], []))
+            assert api.run(api.post('count', req_body, decode=decode_ethnicity))
+            # responses which are JSON results, but not shaped as expected
+            for decode in (lambda body: json.loads(body)['results']['missing'],
+                           lambda body: json.loads(body)['results']['patients'][5],
+                           lambda body: json.loads(body)['results']['patients'][0]['ethnicity'] + 1):
+                with pytest.raises(CanDIGAPIError, match='/count did not answer with JSON results on attempt 1') as e:
+                    api.run(api.post('count', req_body, decode=decode))
+                assert e.value.attempts == 1 and e.value.status is None
+
+def test_case3_remote_compressed_on_standin(model_case3_train, tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    with open(trainfile) as f:
+        config = json.load(f)
+    remote_trainfile = tmp_path / 'config.json'
+    expected = predict(testfile, model_case3_train).conf_matrix
+
+    for compress in (True, False):
+        with CanDIG_StandIn(LOCAL_API(trainfile), compress=compress) as server:
+            config['candig_server_url'] = server.start()
+            remote_trainfile.write_text(json.dumps(config))
+            with CanDIG_API(str(remote_trainfile), compress=True, compress_min_bytes=0) as api:
+                remote_model = ID3(api, verbose=False)
+            # a server which does not accept compressed requests is sent uncompressed ones
+            assert api.compress_requests == compress
+            assert api.request_stats()['bytes'] == server.stats['bytes']
+        assert (predict(testfile, remote_model).conf_matrix == expected).all()
+
+def test_case3_remote_on_standin(model_case3_train, tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    with CanDIG_StandIn(LOCAL_API(trainfile)) as server:
+        with open(trainfile) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+
+        remote_model = train(False, str(remote_trainfile), verbose=False)
+        assert server.stats['count'] == remote_model.api.request_stats()['requests'] - server.stats['search']
+
+    results = predict(testfile, remote_model).conf_matrix
+    assert (results == predict(testfile, model_case3_train).conf_matrix).all()
+
+def test_case3_remote_with_variant_logic(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    local_api = LOCAL_API(trainfile)
+    # the two variants most people have together, some people having only one of them
+    genotypes = local_api.genotype_matrix.astype(int)
+    together = genotypes.T @ genotypes
+    numpy.fill_diagonal(together, -1)
+    first, second = numpy.unravel_index(numpy.argmax(together), together.shape)
+    rarest = numpy.argmin(genotypes.sum(axis=0))
+    first_name, second_name = local_api.variant_name_list[first], local_api.variant_name_list[second]
+    split_path = ([first_name, second_name, local_api.variant_name_list[rarest]], [1, 1, 0])
+
+    with CanDIG_StandIn(local_api) as server:
+        with open(trainfile) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+
+        with CanDIG_API(str(remote_trainfile)) as api:
+            # people must have every variant split on with, not any of them
+            assert api.craft_api_logic(split_path) == {'and': [
+                {'and': [{'id': first_name}, {'id': second_name}]},
+                {'and': [{'id': local_api.variant_name_list[rarest], 'negate': True}]}]}
+            assert json.loads(api.encode_api_request(split_path))['logic'] == api.craft_api_logic(split_path)
+            # the ancestries are found with the target set, as when training
+            api.get_target_set()
+            columns = [api.ancestry_list.index(ancestry) for ancestry in local_api.ancestry_list]
+            remote_counts = api.find_next_variant_count_matrix(split_path)[:, columns]
+
+    local_counts = local_api.find_next_variant_count_matrix(split_path)
+    # the remote API does not count the variants already split on
+    candidates = [idx for idx, variant_name in enumerate(local_api.variant_name_list)
+                  if variant_name not in split_path[0]]
+    assert (remote_counts[candidates] == local_counts[candidates]).all()
+    assert remote_counts[candidates].sum() > 0
+    both = local_api.genotype_matrix[:, first] & local_api.genotype_matrix[:, second]
+    either = local_api.genotype_matrix[:, first] | local_api.genotype_matrix[:, second]
+    assert both.sum() < either.sum()
+
+def test_case3_request_bodies_on_standin(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    with CanDIG_StandIn(LOCAL_API(trainfile)) as server:
+        with open(trainfile) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+
+        with CanDIG_API(str(remote_trainfile)) as api:
+            variants = api.variant_name_list
+            split_path = ([variants[0], variants[3], variants[2]], [1, 0, 1])
+            req_body = api.craft_api_request(split_path)
+
+            # only the components the logic refers to are sent
+            assert [component['id'] for component in req_body['components']] == split_path[0]
+            assert json.loads(api.encode_api_request(split_path)) == req_body
+            assert len(api.encode_api_request(split_path)) < len(api.encode_api_request((variants, [1] * len(variants))))
+
+def test_case3_count_cache_on_standin(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    cache_path = str(tmp_path / 'counts.db')
+    with CanDIG_StandIn(LOCAL_API(trainfile)) as server:
+        with open(trainfile) as f:
+            config = json.load(f)
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+
+        first_cache = CountCache(path=cache_path)
+        first_model = train(False, str(remote_trainfile), verbose=False, count_cache=first_cache)
+        first_count_requests = server.stats['count']
+
+        # a new cache on the same file answers every lookup of a second run, without asking the server
+        second_cache = CountCache(path=cache_path)
+        second_model = train(False, str(remote_trainfile), verbose=False, count_cache=second_cache)
+        assert first_count_requests > 0 and server.stats['count'] == first_count_requests
+    assert first_cache.misses > 0
+    assert second_cache.misses == 0
+    assert second_cache.hits == first_cache.hits + first_cache.misses
+
+    results = predict(testfile, second_model).conf_matrix
+    assert (results == predict(testfile, first_model).conf_matrix).all()
+
+    key = CountCache.make_key('url', 'dataset', (['1:2:3', '1:5:6'], [1, 0]))
+    assert key == CountCache.make_key('url', 'dataset', (['1:5:6', '1:2:3'], [0, 1]))
+    assert key != CountCache.make_key('url', 'dataset', (['1:5:6', '1:2:3'], [1, 0]))
+
+def test_case3_remote_retries_on_standin(model_case3_train, tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    testfile = 'test_cases/case3/test-config.json'
+    with open(trainfile) as f:
+        config = json.load(f)
+    remote_trainfile = tmp_path / 'config.json'
+
+    with CanDIG_StandIn(LOCAL_API(trainfile), error_rate=0.2, seed=0) as server:
+        config['candig_server_url'] = server.start()
+        remote_trainfile.write_text(json.dumps(config))
+        with CanDIG_API(str(remote_trainfile), retry_delay=0.001, max_retries=10) as api:
+            remote_model = ID3(api, verbose=False)
+        assert api.request_stats()['retries'] == server.stats['errors'] > 0
+
+    results = predict(testfile, remote_model).conf_matrix
+    assert (results == predict(testfile, model_case3_train).conf_matrix).all()
+
+    with CanDIG_StandIn(LOCAL_API(trainfile), error_rate=1.0) as server:
+        config['candig_server_url'] = server.start()
+        remote_trainfile.write_text(json.dumps(config))
+        with pytest.raises(CanDIGAPIError) as error:
+            CanDIG_API(str(remote_trainfile), retry_delay=0.001, max_retries=2)
+        assert error.value.status == 503
+        assert error.value.attempts == 3
+
+def test_case3_variant_discovery_on_standin(tmp_path):
+    trainfile = 'test_cases/case3/config.json'
+    with open(trainfile) as f:
+        config = json.load(f)
+    local_api = LOCAL_API(trainfile)
+
+    with CanDIG_StandIn(local_api) as server:
+        config['candig_server_url'] = server.start()
+        remote_trainfile = tmp_path / 'config.json'
+        remote_trainfile.write_text(json.dumps(config))
+        with CanDIG_API(str(remote_trainfile), window_size=4, page_size=2) as api:
+            assert api.variant_name_list == local_api.variant_name_list
+            windows = sorted((window['start'], window['end']) for window in api.window_timings)
+            assert windows == [(99, 103), (103, 107), (107, 111), (111, 112)]
+            assert sum(window['variants'] for window in api.window_timings) == len(api.variant_name_list)
+            assert max(window['pages'] for window in api.window_timings) == 2
+
+        # a range of one base is searched too
+        config['variant_ranges'] = [{'start': '103', 'end': '103', 'chr': '1'}]
+        remote_trainfile.write_text(json.dumps(config))
+        with CanDIG_API(str(remote_trainfile), window_size=4) as api:
+            assert api.variant_name_list == ['1:103:104']
+
 if __name__ == "__main__":
     model1 = model_case1_train()
     model2 = model_case2_train()
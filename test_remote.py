@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import pickle
 import numpy
 import pytest
 from src.id3_variants_training.__train__ import train
@@ -71,6 +72,17 @@ def test_case3_on_test(model_case3_train):
     results = predict(testfile, model_case3_train).conf_matrix
     assert (results == expected).all()
 
+def test_case3_pickled_on_test(model_case3_train):
+    testfile = 'test_cases/case3/test-config.json'
+    model = pickle.loads(pickle.dumps(model_case3_train))
+
+    assert model.api.session is None
+    assert model.api.get_target_set() == model_case3_train.root_node.subset
+    model.api.close()
+
+    results = predict(testfile, model).conf_matrix
+    assert (results == predict(testfile, model_case3_train).conf_matrix).all()
+
 if __name__ == "__main__":
     model1 = model_case1_train()
     model2 = model_case2_train()